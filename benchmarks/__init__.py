@@ -0,0 +1,5 @@
+"""Benchmarks of pysftpserver, not installed with the package.
+
+Run them from the root of the repository, e.g.:
+    python -m benchmarks.protocol -o results.json
+"""
@@ -0,0 +1,381 @@
+"""End-to-end benchmarks, with real clients talking to real servers.
+
+pysftpjail, and pysftpproxy forwarding to the stub server of the tests
+(in its own process, on loopback), are spawned with their standard input
+and output connected to a socket pair, as sshd does with its pipes.
+So the event loop and the framing are measured too.
+
+A Paramiko client sends the requests of each workload keeping up to depth
+of them in flight, each moving up to packet bytes, and records the latency
+of each one. OpenSSH's sftp (-D) is measured too, when it is installed:
+only its throughput, though.
+
+    python -m benchmarks.endtoend --depth 1,16,64 --packet 8192,32768
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+from paramiko.sftp import CMD_READ, CMD_STAT, CMD_WRITE, int64
+
+from pysftpserver.proxystorage import PipelinedRequests
+from pysftpserver.tests.stub_sftp import (StubServer, StubSFTPServer,
+                                          StubSFTPServerSubsystem)
+from pysftpserver.tests.utils import t_path
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SERVERS = ('jail', 'proxy')
+CLIENTS = ('paramiko', 'openssh')
+WORKLOADS = ('write', 'read', 'stat')
+
+
+class PipeSocket(socket.socket):
+    """One end of the socket pair connected to the server.
+
+    Paramiko names the logger of its clients after their channel.
+    """
+
+    def get_name(self):
+        return 'pipe'
+
+
+class TimedRequests(PipelinedRequests):
+    """PipelinedRequests recording the latency of each request."""
+
+    def __init__(self, client, window):
+        PipelinedRequests.__init__(self, client, window)
+        self.sent_at = dict()
+        self.latencies = list()
+
+    def request(self, t, *args):
+        num = PipelinedRequests.request(self, t, *args)
+        self.sent_at[num] = time.time()
+        return num
+
+    def _async_response(self, t, msg, num):
+        self.latencies.append(time.time() - self.sent_at.pop(num))
+        PipelinedRequests._async_response(self, t, msg, num)
+
+
+def serve_stub(root, ports):
+    """Serve root with the stub SFTP server of the tests, on loopback.
+
+    The listening port is put in the ports queue.
+    """
+    StubSFTPServer.ROOT = root
+    host_key = paramiko.RSAKey.from_private_key_file(t_path('server_id_rsa'))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    ports.put(sock.getsockname()[1])
+    while True:
+        conn, _ = sock.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler(
+            'sftp', StubSFTPServerSubsystem, StubSFTPServer)
+        # don't wait the negotiation, to accept the next connections
+        transport.start_server(event=threading.Event(), server=StubServer())
+
+
+def command(server, root, stub_port):
+    """Return the command line of server, serving root."""
+    if server == 'jail':
+        return [sys.executable, os.path.join(REPOSITORY, 'bin', 'pysftpjail'),
+                root]
+    return [sys.executable, os.path.join(REPOSITORY, 'bin', 'pysftpproxy'),
+            '-d', '-c', os.devnull, '-p', str(stub_port),
+            'test:secret@127.0.0.1']
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPOSITORY] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def spawn(argv):
+    """Spawn argv talking SFTP over its standard input and output.
+
+    Return the process and the other end of its socket pair.
+    """
+    ours, theirs = socket.socketpair()
+    process = subprocess.Popen(
+        argv, stdin=theirs.fileno(), stdout=theirs.fileno(),
+        env=environment())
+    theirs.close()
+    sock = PipeSocket(ours.family, ours.type, ours.proto, ours.detach())
+    return process, sock
+
+
+def requests(workload, handle, size, packet):
+    """Return the requests of workload, over size bytes."""
+    if workload == 'write':
+        data = b'x' * packet
+        return ((CMD_WRITE, handle, int64(off), data[:size - off])
+                for off in range(0, size, packet))
+    if workload == 'read':
+        return ((CMD_READ, handle, int64(off), min(packet, size - off))
+                for off in range(0, size, packet))
+    return ((CMD_STAT, 'bench') for i in range(max(1, size // packet)))
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run_paramiko(argv, workload, size, packet, depth):
+    """Run workload against the server spawned with argv.
+
+    Return the (seconds, number of requests, sorted latencies).
+    """
+    process, sock = spawn(argv)
+    try:
+        client = paramiko.SFTPClient(sock)
+        handle = None
+        if workload != 'stat':
+            handle = client.open('bench', 'w' if workload == 'write' else 'r')
+        timed = TimedRequests(client, depth)
+        start = time.time()
+        results = timed.map(requests(
+            workload, handle.handle if handle else None, size, packet))
+        elapsed = time.time() - start
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        if handle:
+            handle.close()
+        client.close()
+    finally:
+        sock.close()
+        process.wait()
+    return elapsed, len(results), sorted(timed.latencies)
+
+
+def run_openssh(argv, workload, size, packet, depth, root):
+    """Run workload with OpenSSH's sftp, against the server spawned
+    with argv.
+
+    Return the (seconds, number of requests, no latencies).
+    The time taken by a session doing nothing (i.e. to start both sftp
+    and the server, at best) is subtracted: use large sizes.
+    """
+    local = os.path.join(root, 'local')
+    batch = os.path.join(root, 'batch')
+
+    def session(line):
+        with open(batch, 'w') as f:
+            f.write(line + '\n')
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                ['sftp', '-q', '-B', str(packet), '-R', str(depth),
+                 '-b', batch, '-D', ' '.join(argv)],
+                stdout=devnull, env=environment())
+        return time.time() - start
+
+    idle = min(session('pwd') for i in range(3))
+    if workload == 'write':
+        elapsed = session('put {} bench'.format(local))
+    else:
+        elapsed = session('get bench {}'.format(local))
+    return max(elapsed - idle, 1e-6), (size + packet - 1) // packet, []
+
+
+def measure(server, client, workload, size, packet, depth):
+    """Measure a combination, in a new scratch tree.
+
+    Return a dictionary of its results, or None if client
+    can't run workload.
+    """
+    if client == 'openssh' and workload == 'stat':
+        return None
+    root = tempfile.mkdtemp(prefix='pysftpserver-bench-')
+    stub = None
+    try:
+        served = os.path.join(root, 'served')
+        os.mkdir(served)
+        # the file read by the read workloads, and written by the put
+        for path in (os.path.join(served, 'bench'),
+                     os.path.join(root, 'local')):
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+
+        stub_port = None
+        if server == 'proxy':
+            ports = multiprocessing.Queue()
+            stub = multiprocessing.Process(
+                target=serve_stub, args=(served, ports))
+            stub.daemon = True
+            stub.start()
+            stub_port = ports.get(timeout=10)
+        argv = command(server, served, stub_port)
+
+        if client == 'paramiko':
+            elapsed, count, latencies = run_paramiko(
+                argv, workload, size, packet, depth)
+        else:
+            elapsed, count, latencies = run_openssh(
+                argv, workload, size, packet, depth, root)
+        p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+        return {
+            'server': server,
+            'client': client,
+            'workload': workload,
+            'packet': packet,
+            'depth': depth,
+            'requests': count,
+            'seconds': elapsed,
+            'ops_per_sec': count / elapsed,
+            'mb_per_sec':
+                0.0 if workload == 'stat' else size / elapsed / 1000000,
+            'p50_ms': None if p50 is None else p50 * 1000,
+            'p99_ms': None if p99 is None else p99 * 1000,
+        }
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.join()
+        shutil.rmtree(root, True)
+
+
+def run(servers, clients, workloads, packets, depths, size):
+    """Measure each combination. Return the list of their results."""
+    results = list()
+    for server, client, workload, packet, depth in itertools.product(
+            servers, clients, workloads, packets, depths):
+        result = measure(server, client, workload, size, packet, depth)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def table(results):
+    """Return the lines of a table of the results."""
+    lines = ['{:<7}{:<10}{:<7}{:>8}{:>7}{:>11}{:>9}{:>9}{:>9}'.format(
+        'server', 'client', 'work', 'packet', 'depth', 'ops/s', 'MB/s',
+        'p50 ms', 'p99 ms')]
+    for r in results:
+        lines.append(
+            '{:<7}{:<10}{:<7}{:>8}{:>7}{:>11.0f}{:>9.1f}{:>9}{:>9}'.format(
+                r['server'], r['client'], r['workload'], r['packet'],
+                r['depth'], r['ops_per_sec'], r['mb_per_sec'],
+                '-' if r['p50_ms'] is None else '{:.2f}'.format(r['p50_ms']),
+                '-' if r['p99_ms'] is None else '{:.2f}'.format(r['p99_ms'])))
+    return lines
+
+
+def choices(allowed, type=str):
+    """Return an argparse type parsing a comma separated list."""
+    def parse(value):
+        values = [type(v) for v in value.split(',')]
+        if allowed and set(values) - set(allowed):
+            raise argparse.ArgumentTypeError(
+                'choose among {}'.format(', '.join(allowed)))
+        return values
+    return parse
+
+
+def create_parser():
+    """Create the CLI argument parser."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark pysftpjail and pysftpproxy end-to-end, '
+                    'with real SFTP clients.'
+    )
+
+    parser.add_argument(
+        "--server",
+        default=list(SERVERS),
+        type=choices(SERVERS),
+        help="servers to measure (defaults to jail,proxy)"
+    )
+
+    parser.add_argument(
+        "--client",
+        type=choices(CLIENTS),
+        help="clients to use (defaults to paramiko, and openssh if sftp is installed)"
+    )
+
+    parser.add_argument(
+        "--workload",
+        default=list(WORKLOADS),
+        type=choices(WORKLOADS),
+        help="workloads to run (defaults to write,read,stat)"
+    )
+
+    parser.add_argument(
+        "--packet",
+        default=[32768],
+        type=choices(None, int),
+        help="comma separated bytes moved by each request (defaults to 32768)"
+    )
+
+    parser.add_argument(
+        "--depth",
+        default=[1, 16, 64],
+        type=choices(None, int),
+        help="comma separated numbers of requests kept in flight (defaults to 1,16,64)"
+    )
+
+    parser.add_argument(
+        "--size",
+        default=16 * 1024 * 1024,
+        type=int,
+        help="bytes of the file written and read (defaults to 16 MiB)"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="path of the JSON results (defaults to the standard output)"
+    )
+    return parser
+
+
+def main(args=None):
+    parser = create_parser()
+    args = parser.parse_args(args)
+
+    clients = args.client
+    if clients is None:
+        clients = ['paramiko']
+        if shutil.which('sftp'):
+            clients.append('openssh')
+
+    results = run(args.server, clients, args.workload, args.packet,
+                  args.depth, args.size)
+    output = json.dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': args.size,
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for line in table(results):
+        sys.stderr.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,527 @@
+"""Load generator, with many concurrent server sessions.
+
+As sshd does, each session is a server process of its own (pysftpjail by
+default), its standard input and output connected to a pipe (a socket
+pair). All of them serve the same scratch tree, so that they contend for
+the disk, the page cache and the rest, as in production.
+
+The sessions are driven by a few processes (--drivers), each one running
+an event loop over its share of the sessions. Each session keeps window
+operations going, picked at random with the weights of the profile, for
+duration seconds:
+    stat, lstat, realpath: of a random file of the shared tree;
+    read: a random file of the shared tree, packet bytes per request;
+    readdir: the directory of the shared tree;
+    write: a new file of file_size bytes in the directory of the session;
+    create, remove: an empty file in the directory of the session.
+
+The profile is a JSON object overriding some of DEFAULT_PROFILE, e.g.:
+    {"sessions": 200, "duration": 60, "mix": {"stat": 8, "read": 2}}
+
+The latency of each request is recorded in a histogram of its type.
+The CPU time of the servers is measured as the one of the children
+of the drivers, once they are reaped:
+    python -m benchmarks.load --profile profile.json -o load.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import selectors
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from pysftpserver.histogram import Histogram
+from pysftpserver.metrics import NAMES
+from pysftpserver.server import (SSH2_FILEXFER_VERSION, SSH2_FX_EOF,
+                                 SSH2_FX_OK, SSH2_FXF_CREAT, SSH2_FXF_READ,
+                                 SSH2_FXF_TRUNC, SSH2_FXF_WRITE,
+                                 SSH2_FXP_CLOSE, SSH2_FXP_DATA,
+                                 SSH2_FXP_HANDLE, SSH2_FXP_INIT,
+                                 SSH2_FXP_LSTAT, SSH2_FXP_OPEN,
+                                 SSH2_FXP_OPENDIR,
+                                 SSH2_FXP_READ, SSH2_FXP_READDIR,
+                                 SSH2_FXP_REALPATH, SSH2_FXP_REMOVE,
+                                 SSH2_FXP_STAT, SSH2_FXP_STATUS,
+                                 SSH2_FXP_VERSION, SSH2_FXP_WRITE)
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+DEFAULT_PROFILE = {
+    'sessions': 16,  # concurrent server processes
+    'duration': 10,  # seconds
+    'window': 4,  # operations kept going by each session
+    'packet': 32768,  # bytes read or written by each request
+    'files': 1000,  # files of the shared tree
+    'file_size': 65536,  # bytes of each file, read or written
+    'mix': {  # operation -> weight
+        'stat': 40,
+        'lstat': 10,
+        'realpath': 5,
+        'read': 20,
+        'readdir': 2,
+        'write': 10,
+        'create': 8,
+        'remove': 5,
+    },
+    # the server of each session: {root} is replaced by the scratch tree
+    'command': [sys.executable, os.path.join(REPOSITORY, 'bin', 'pysftpjail'),
+                '{root}'],
+}
+
+
+def string(s):
+    return struct.pack('>I', len(s)) + s
+
+
+def data_file(context):
+    return 'data/{}'.format(context.rng.randrange(context.files)).encode()
+
+
+def op_stat(context, msg_type=SSH2_FXP_STAT):
+    yield msg_type, string(data_file(context))
+
+
+def op_lstat(context):
+    return op_stat(context, SSH2_FXP_LSTAT)
+
+
+def op_realpath(context):
+    return op_stat(context, SSH2_FXP_REALPATH)
+
+
+def op_read(context):
+    msg_type, payload = yield SSH2_FXP_OPEN, string(data_file(context)) + \
+        struct.pack('>II', SSH2_FXF_READ, 0)
+    if msg_type != SSH2_FXP_HANDLE:
+        return
+    handle = string(parse_string(payload))
+    offset = 0
+    while True:
+        msg_type, payload = yield SSH2_FXP_READ, handle + \
+            struct.pack('>QI', offset, context.packet)
+        if msg_type != SSH2_FXP_DATA:
+            break
+        offset += len(payload) - 4
+        context.bytes += len(payload) - 4
+    yield SSH2_FXP_CLOSE, handle
+
+
+def op_readdir(context):
+    msg_type, payload = yield SSH2_FXP_OPENDIR, string(b'data')
+    if msg_type != SSH2_FXP_HANDLE:
+        return
+    handle = string(parse_string(payload))
+    while msg_type != SSH2_FXP_STATUS:
+        msg_type, payload = yield SSH2_FXP_READDIR, handle
+    yield SSH2_FXP_CLOSE, handle
+
+
+def op_write(context):
+    msg_type, payload = yield SSH2_FXP_OPEN, string(context.new_file()) + \
+        struct.pack('>II', SSH2_FXF_WRITE | SSH2_FXF_CREAT | SSH2_FXF_TRUNC,
+                    0)
+    if msg_type != SSH2_FXP_HANDLE:
+        return
+    handle = string(parse_string(payload))
+    for offset in range(0, context.file_size, context.packet):
+        data = context.data[:context.file_size - offset]
+        yield SSH2_FXP_WRITE, handle + struct.pack('>Q', offset) + string(data)
+        context.bytes += len(data)
+    yield SSH2_FXP_CLOSE, handle
+
+
+def op_create(context):
+    filename = context.new_file()
+    msg_type, payload = yield SSH2_FXP_OPEN, string(filename) + \
+        struct.pack('>II', SSH2_FXF_WRITE | SSH2_FXF_CREAT, 0)
+    if msg_type != SSH2_FXP_HANDLE:
+        return
+    yield SSH2_FXP_CLOSE, string(parse_string(payload))
+    context.created.append(filename)
+
+
+def op_remove(context):
+    if context.created:
+        yield SSH2_FXP_REMOVE, string(context.created.pop(0))
+    else:
+        yield SSH2_FXP_STAT, string(data_file(context))
+
+
+OPERATIONS = {
+    'stat': op_stat,
+    'lstat': op_lstat,
+    'realpath': op_realpath,
+    'read': op_read,
+    'readdir': op_readdir,
+    'write': op_write,
+    'create': op_create,
+    'remove': op_remove,
+}
+
+
+def parse_string(payload):
+    """Return the string at the start of payload."""
+    slen, = struct.unpack('>I', payload[:4])
+    return payload[4:4 + slen]
+
+
+def load_profile(path=None):
+    """Return DEFAULT_PROFILE, overridden by the JSON profile at path."""
+    profile = dict(DEFAULT_PROFILE)
+    if path:
+        with open(path) as f:
+            profile.update(json.load(f))
+    unknown = set(profile['mix']) - set(OPERATIONS)
+    if unknown:
+        raise ValueError('Unknown operations: {}'.format(
+            ', '.join(sorted(unknown))))
+    return profile
+
+
+class Context(object):
+    """The state of the operations of a session."""
+
+    def __init__(self, index, profile, seed):
+        self.index = index
+        self.rng = random.Random(seed * 100003 + index)
+        self.files = profile['files']
+        self.file_size = profile['file_size']
+        self.packet = profile['packet']
+        self.data = os.urandom(profile['packet'])
+        self.counter = 0
+        self.created = list()
+        self.bytes = 0  # file contents read or written
+        names = sorted(profile['mix'])
+        self.names = names
+        self.weights = [profile['mix'][name] for name in names]
+
+    def new_file(self):
+        self.counter += 1
+        return 'sessions/{}/{}'.format(self.index, self.counter).encode()
+
+    def operation(self):
+        name = self.rng.choices(self.names, self.weights)[0]
+        return OPERATIONS[name](self)
+
+
+class Session(object):
+    """A server process, and the operations going on with it."""
+
+    def __init__(self, argv, context):
+        ours, theirs = socket.socketpair()
+        self.process = subprocess.Popen(
+            argv, stdin=theirs.fileno(), stdout=theirs.fileno(),
+            env=environment())
+        theirs.close()
+        self.sock = ours
+        self.context = context
+        self.buffer = b''
+        self.sid = 0
+        self.pending = dict()  # request id -> (operation, type, time sent)
+
+    def send(self, operation, request):
+        msg_type, payload = request
+        self.sid = (self.sid + 1) & 0xffffffff
+        self.pending[self.sid] = (operation, msg_type, time.time())
+        self.sock.sendall(struct.pack(
+            '>IBI', len(payload) + 5, msg_type, self.sid) + payload)
+
+    def init(self):
+        """Initialize the session, waiting for the version of the server."""
+        self.sock.sendall(struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION))
+        while len(self.buffer) < 4 or \
+                len(self.buffer) < 4 + struct.unpack('>I', self.buffer[:4])[0]:
+            data = self.sock.recv(4096)
+            if not data:
+                raise EOFError('The server closed the session')
+            self.buffer += data
+        msg_len, msg_type = struct.unpack('>IB', self.buffer[:5])
+        if msg_type != SSH2_FXP_VERSION:
+            raise EOFError('The server did not send its version')
+        self.buffer = self.buffer[4 + msg_len:]
+
+    def replies(self):
+        """Receive the replies available, yield their (type, id, payload)."""
+        data = self.sock.recv(256 * 1024)
+        if not data:
+            raise EOFError('The server closed the session')
+        self.buffer += data
+        while len(self.buffer) >= 9:
+            msg_len, = struct.unpack('>I', self.buffer[:4])
+            if len(self.buffer) < 4 + msg_len:
+                break
+            msg_type, sid = struct.unpack('>BI', self.buffer[4:9])
+            payload = self.buffer[9:4 + msg_len]
+            self.buffer = self.buffer[4 + msg_len:]
+            yield msg_type, sid, payload
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPOSITORY] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def cpu_times():
+    """Return the CPU seconds of the process and of its reaped children."""
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+
+def drive(profile, root, indices, seed, results):
+    """Drive the sessions indices, with profile, serving root.
+
+    Put a dictionary of the results in the results queue.
+    """
+    argv = [arg.replace('{root}', root) for arg in profile['command']]
+    sessions = [Session(argv, Context(i, profile, seed)) for i in indices]
+    selector = selectors.DefaultSelector()
+    for session in sessions:
+        session.init()
+        selector.register(session.sock, selectors.EVENT_READ, session)
+
+    histograms = dict()  # request name -> Histogram of microseconds
+    errors = dict()  # request name -> error statuses
+    operations = 0
+
+    def step(session, operation, reply=None):
+        """Send the next request of operation, or start a new one."""
+        try:
+            request = next(operation) if reply is None \
+                else operation.send(reply)
+        except StopIteration:
+            return True
+        session.send(operation, request)
+        return False
+
+    cpu, _ = cpu_times()
+    start = time.time()
+    deadline = start + profile['duration']
+    for session in sessions:
+        for i in range(profile['window']):
+            while step(session, session.context.operation()):
+                pass
+    while any(session.pending for session in sessions):
+        for key, _ in selector.select():
+            session = key.data
+            now = time.time()
+            for msg_type, sid, payload in session.replies():
+                operation, request_type, sent = session.pending.pop(sid)
+                name = NAMES.get(request_type, str(request_type))
+                if name not in histograms:
+                    histograms[name] = Histogram()
+                    errors[name] = 0
+                histograms[name].record((now - sent) * 1000000)
+                if msg_type == SSH2_FXP_STATUS:
+                    status, = struct.unpack('>I', payload[:4])
+                    if status not in (SSH2_FX_OK, SSH2_FX_EOF):
+                        errors[name] += 1
+                if not step(session, operation, (msg_type, payload)):
+                    continue
+                operations += 1
+                while now < deadline and \
+                        step(session, session.context.operation()):
+                    operations += 1
+    elapsed = time.time() - start
+    cpu = cpu_times()[0] - cpu
+
+    _, server_cpu = cpu_times()
+    for session in sessions:
+        selector.unregister(session.sock)
+        session.sock.close()
+        session.process.wait()
+    # only the children reaped here are accounted
+    server_cpu = cpu_times()[1] - server_cpu
+    results.put({
+        'seconds': elapsed,
+        'operations': operations,
+        'bytes': sum(session.context.bytes for session in sessions),
+        'histograms': histograms,
+        'errors': errors,
+        'driver_cpu_seconds': cpu,
+        'server_cpu_seconds': server_cpu,
+    })
+
+
+def setup(root, profile):
+    """Create the shared tree, and the directories of the sessions."""
+    os.mkdir(os.path.join(root, 'data'))
+    data = os.urandom(profile['file_size'])
+    for i in range(profile['files']):
+        with open(os.path.join(root, 'data', str(i)), 'wb') as f:
+            f.write(data)
+    for i in range(profile['sessions']):
+        os.makedirs(os.path.join(root, 'sessions', str(i)))
+
+
+def run(profile, drivers=None, seed=0):
+    """Run the load described by profile. Return the dictionary
+    of its results."""
+    drivers = min(drivers or multiprocessing.cpu_count(), profile['sessions'])
+    root = tempfile.mkdtemp(prefix='pysftpserver-load-')
+    try:
+        setup(root, profile)
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=drive, args=(
+                profile, root, list(range(i, profile['sessions'], drivers)),
+                seed, queue))
+            for i in range(drivers)
+        ]
+        for process in processes:
+            process.start()
+        results = [queue.get() for process in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(root, True)
+
+    histograms, errors = dict(), dict()
+    for result in results:
+        for name, histogram in result['histograms'].items():
+            histograms.setdefault(name, Histogram()).merge(histogram)
+            errors[name] = errors.get(name, 0) + result['errors'][name]
+    elapsed = max(result['seconds'] for result in results)
+    requests = sum(h.count for h in histograms.values())
+    server_cpu = sum(result['server_cpu_seconds'] for result in results)
+    return {
+        'sessions': profile['sessions'],
+        'seconds': elapsed,
+        'operations': sum(result['operations'] for result in results),
+        'requests': requests,
+        'ops_per_sec':
+            sum(result['operations'] for result in results) / elapsed,
+        'requests_per_sec': requests / elapsed,
+        'mb_per_sec':
+            sum(result['bytes'] for result in results) / elapsed / 1000000,
+        'server_cpu_seconds': server_cpu,
+        'driver_cpu_seconds':
+            sum(result['driver_cpu_seconds'] for result in results),
+        'server_cpu_us_per_request':
+            server_cpu * 1000000 / requests if requests else 0.0,
+        'requests_by_type': {
+            name: {
+                'count': histogram.count,
+                'errors': errors[name],
+                'mean_us': histogram.mean(),
+                'p50_us': histogram.percentile(50),
+                'p90_us': histogram.percentile(90),
+                'p99_us': histogram.percentile(99),
+                'p999_us': histogram.percentile(99.9),
+                'max_us': histogram.max,
+                # (lowest, highest, count) of each bucket
+                'histogram': histogram.ranges(),
+            }
+            for name, histogram in histograms.items()
+        },
+    }
+
+
+def table(results):
+    """Return the lines of a report of the results."""
+    lines = [
+        '{} sessions, {:.1f} s: {:.0f} operations/s, {:.0f} requests/s, '
+        '{:.1f} MB/s'.format(
+            results['sessions'], results['seconds'], results['ops_per_sec'],
+            results['requests_per_sec'], results['mb_per_sec']),
+        'server CPU: {:.1f} s, {:.0f} us per request; driver CPU: {:.1f} s'
+        .format(results['server_cpu_seconds'],
+                results['server_cpu_us_per_request'],
+                results['driver_cpu_seconds']),
+        '{:<10}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'request', 'count', 'errors', 'p50 us', 'p90 us', 'p99 us',
+            'p99.9 us', 'max us'),
+    ]
+    by_type = results['requests_by_type']
+    for name in sorted(by_type, key=lambda n: -by_type[n]['count']):
+        r = by_type[name]
+        lines.append('{:<10}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            name, r['count'], r['errors'], r['p50_us'], r['p90_us'],
+            r['p99_us'], r['p999_us'], r['max_us']))
+    return lines
+
+
+def create_parser():
+    """Create the CLI argument parser."""
+    parser = argparse.ArgumentParser(
+        description='Drive many concurrent server sessions with a mixed '
+                    'workload, and report the throughput and the latency.'
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="path of the JSON profile (see DEFAULT_PROFILE)"
+    )
+
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        help="concurrent sessions, overriding the profile"
+    )
+
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="seconds of load, overriding the profile"
+    )
+
+    parser.add_argument(
+        "--drivers",
+        type=int,
+        help="processes driving the sessions (defaults to the number of CPUs)"
+    )
+
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="seed of the random choices of the operations (defaults to 0)"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="path of the JSON results (defaults to the standard output)"
+    )
+    return parser
+
+
+def main(args=None):
+    parser = create_parser()
+    args = parser.parse_args(args)
+
+    profile = load_profile(args.profile)
+    if args.sessions:
+        profile['sessions'] = args.sessions
+    if args.duration:
+        profile['duration'] = args.duration
+
+    results = run(profile, args.drivers, args.seed)
+    output = json.dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'profile': profile,
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for line in table(results):
+        sys.stderr.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""In-process benchmarks of the SFTP protocol handling.
+
+Each benchmark drives an SFTPServer over a SFTPServerVirtualChroot the same
+way the tests do: the requests are put in its input queue and process()
+is called, so neither a client nor the event loop are measured.
+Up to window requests are processed at once, as a pipelining client
+would send them.
+
+Each benchmark runs in its own process, twice: once timed, and once with
+the allocations traced (much slower). The results are printed as JSON,
+to be compared across versions:
+    python -m benchmarks.protocol -o before.json
+    ...
+    python -m benchmarks.protocol --compare before.json
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pysftpserver.server import (SSH2_FX_EOF, SSH2_FX_OK, SSH2_FXF_CREAT,
+                                 SSH2_FXF_READ, SSH2_FXF_TRUNC,
+                                 SSH2_FXF_WRITE, SSH2_FXP_CLOSE,
+                                 SSH2_FXP_DATA, SSH2_FXP_HANDLE,
+                                 SSH2_FXP_LSTAT, SSH2_FXP_NAME,
+                                 SSH2_FXP_OPEN, SSH2_FXP_OPENDIR,
+                                 SSH2_FXP_READ, SSH2_FXP_READDIR,
+                                 SSH2_FXP_REALPATH, SSH2_FXP_REMOVE,
+                                 SSH2_FXP_STAT, SSH2_FXP_STATUS,
+                                 SSH2_FXP_WRITE, SSH2_FXP_ATTRS, SFTPServer)
+from pysftpserver.tests.utils import (get_sftpmsgs, parse_sftpstring,
+                                      sftpcmd, sftpint, sftpint64,
+                                      sftpstring)
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+
+class Session(object):
+    """An SFTPServer over a virtual chroot of root."""
+
+    def __init__(self, root, window=64):
+        self.server = SFTPServer(SFTPServerVirtualChroot(root))
+        self.window = window  # requests processed at once
+        self.requests = 0
+        self.bytes = 0  # file contents read or written
+
+    def send(self, cmds):
+        """Process cmds and return their replies,
+        (type, id, payload) tuples."""
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(cmds)
+        self.server.process()
+        self.requests += len(cmds)
+        return get_sftpmsgs(self.server.output_queue)
+
+    def pipeline(self, cmds):
+        """Send cmds, window at a time, and return all the replies."""
+        replies = list()
+        batch = list()
+        for cmd in cmds:
+            batch.append(cmd)
+            if len(batch) == self.window:
+                replies.extend(self.send(batch))
+                batch = list()
+        if batch:
+            replies.extend(self.send(batch))
+        return replies
+
+    def call(self, cmd, expected):
+        """Send cmd and return the payload of its reply,
+        of type expected."""
+        (msg_type, _, payload), = self.send([cmd])
+        check(msg_type, payload, expected)
+        return payload
+
+    def open(self, filename, flags):
+        payload = self.call(
+            sftpcmd(SSH2_FXP_OPEN, sftpstring(filename), sftpint(flags),
+                    sftpint(0)),
+            SSH2_FXP_HANDLE
+        )
+        return parse_sftpstring(payload)[0]
+
+    def opendir(self, dirname):
+        payload = self.call(
+            sftpcmd(SSH2_FXP_OPENDIR, sftpstring(dirname)), SSH2_FXP_HANDLE)
+        return parse_sftpstring(payload)[0]
+
+    def close(self, handle):
+        self.call(sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle)), SSH2_FXP_STATUS)
+
+
+def check(msg_type, payload, expected):
+    """Raise a RuntimeError if the reply isn't of type expected
+    (or it is an error status)."""
+    if msg_type == SSH2_FXP_STATUS:
+        status, = struct.unpack('>I', payload[:4])
+        if status not in (SSH2_FX_OK, SSH2_FX_EOF):
+            raise RuntimeError('Unexpected status {}'.format(status))
+    if msg_type != expected:
+        raise RuntimeError('Unexpected reply {}'.format(msg_type))
+
+
+def names(prefix, count):
+    return ['{}{}'.format(prefix, i).encode() for i in range(count)]
+
+
+def create(root, filenames, size=0):
+    """Create filenames inside root, of size bytes."""
+    data = b'x' * size
+    for filename in filenames:
+        with open(os.path.join(root.encode(), filename), 'wb') as f:
+            f.write(data)
+
+
+class Benchmark(object):
+    """A workload.
+
+    setup prepares the files inside root, and run(session), defined
+    by each workload, sends the requests (the timed part): it must be
+    possible to run it twice.
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+
+    def scaled(self, count):
+        return max(1, int(count * self.scale))
+
+    def setup(self, root):
+        pass
+
+
+class SmallFiles(Benchmark):
+    """Create, read and then delete many small files."""
+
+    def __init__(self, scale=1.0, count=2000, size=4096):
+        Benchmark.__init__(self, scale)
+        self.filenames = names('small', self.scaled(count))
+        self.data = b'x' * size
+
+    def run(self, session):
+        for filename in self.filenames:
+            handle = session.open(
+                filename, SSH2_FXF_CREAT | SSH2_FXF_WRITE | SSH2_FXF_TRUNC)
+            for msg_type, _, payload in session.send([
+                    sftpcmd(SSH2_FXP_WRITE, sftpstring(handle), sftpint64(0),
+                            sftpstring(self.data)),
+                    sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))]):
+                check(msg_type, payload, SSH2_FXP_STATUS)
+            session.bytes += len(self.data)
+
+        for filename in self.filenames:
+            handle = session.open(filename, SSH2_FXF_READ)
+            read, close = session.send([
+                sftpcmd(SSH2_FXP_READ, sftpstring(handle), sftpint64(0),
+                        sftpint(len(self.data))),
+                sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))])
+            check(read[0], read[2], SSH2_FXP_DATA)
+            check(close[0], close[2], SSH2_FXP_STATUS)
+            session.bytes += len(parse_sftpstring(read[2])[0])
+
+        for msg_type, _, payload in session.pipeline(
+                sftpcmd(SSH2_FXP_REMOVE, sftpstring(filename))
+                for filename in self.filenames):
+            check(msg_type, payload, SSH2_FXP_STATUS)
+
+
+class SequentialWrite(Benchmark):
+    """Write a large file, in chunks."""
+
+    def __init__(self, scale=1.0, size=64 * 1024 * 1024, chunk=32 * 1024):
+        Benchmark.__init__(self, scale)
+        self.size = self.scaled(size // chunk) * chunk
+        self.chunk = b'x' * chunk
+
+    def run(self, session):
+        handle = session.open(
+            b'large', SSH2_FXF_CREAT | SSH2_FXF_WRITE | SSH2_FXF_TRUNC)
+        for msg_type, _, payload in session.pipeline(
+                sftpcmd(SSH2_FXP_WRITE, sftpstring(handle), sftpint64(off),
+                        sftpstring(self.chunk))
+                for off in range(0, self.size, len(self.chunk))):
+            check(msg_type, payload, SSH2_FXP_STATUS)
+        session.bytes += self.size
+        session.close(handle)
+
+
+class SequentialRead(Benchmark):
+    """Read a large file, in chunks."""
+
+    def __init__(self, scale=1.0, size=64 * 1024 * 1024, chunk=32 * 1024):
+        Benchmark.__init__(self, scale)
+        self.size = self.scaled(size // chunk) * chunk
+        self.chunk = chunk
+
+    def setup(self, root):
+        with open(os.path.join(root, 'large'), 'wb') as f:
+            f.truncate(self.size)
+
+    def run(self, session):
+        handle = session.open(b'large', SSH2_FXF_READ)
+        for msg_type, _, payload in session.pipeline(
+                sftpcmd(SSH2_FXP_READ, sftpstring(handle), sftpint64(off),
+                        sftpint(self.chunk))
+                for off in range(0, self.size, self.chunk)):
+            check(msg_type, payload, SSH2_FXP_DATA)
+            session.bytes += len(parse_sftpstring(payload)[0])
+        session.close(handle)
+
+
+class Readdir(Benchmark):
+    """List a directory of many entries."""
+
+    def __init__(self, scale=1.0, entries=100000):
+        Benchmark.__init__(self, scale)
+        self.entries = self.scaled(entries)
+
+    def setup(self, root):
+        os.mkdir(os.path.join(root, 'dir'))
+        create(os.path.join(root, 'dir'), names('entry', self.entries))
+
+    def run(self, session):
+        handle = session.opendir(b'dir')
+        listed = 0
+        while True:
+            replies = session.send(
+                [sftpcmd(SSH2_FXP_READDIR, sftpstring(handle))] *
+                session.window)
+            listed += sum(1 for msg_type, _, _ in replies
+                          if msg_type == SSH2_FXP_NAME)
+            if replies[-1][0] == SSH2_FXP_STATUS:
+                break
+        session.close(handle)
+        if listed != self.entries + 2:  # . and ..
+            raise RuntimeError('Listed {} entries'.format(listed))
+
+
+class StatStorm(Benchmark):
+    """stat and lstat the same files over and over."""
+
+    def __init__(self, scale=1.0, files=1000, rounds=20):
+        Benchmark.__init__(self, scale)
+        self.filenames = names('file', self.scaled(files))
+        self.rounds = rounds
+
+    def setup(self, root):
+        create(root, self.filenames, 128)
+
+    def run(self, session):
+        for msg_type, _, payload in session.pipeline(
+                sftpcmd(SSH2_FXP_LSTAT if i % 2 else SSH2_FXP_STAT,
+                        sftpstring(filename))
+                for i in range(self.rounds) for filename in self.filenames):
+            check(msg_type, payload, SSH2_FXP_ATTRS)
+
+
+class DeepRealpath(Benchmark):
+    """realpath of deep paths, full of . and .. components."""
+
+    def __init__(self, scale=1.0, depth=64, count=5000):
+        Benchmark.__init__(self, scale)
+        self.path = b'/'.join([b'd'] * depth)
+        self.count = self.scaled(count)
+        half = b'/'.join([b'..'] * (depth // 2))
+        self.paths = [
+            self.path, self.path + b'/./' + half,
+            b'./' + self.path + b'/../d',
+            self.path + b'/' + half + b'/d/./d',
+        ]
+
+    def setup(self, root):
+        os.makedirs(os.path.join(root.encode(), self.path))
+
+    def run(self, session):
+        for msg_type, _, payload in session.pipeline(
+                sftpcmd(SSH2_FXP_REALPATH,
+                        sftpstring(self.paths[i % len(self.paths)]))
+                for i in range(self.count)):
+            check(msg_type, payload, SSH2_FXP_NAME)
+
+
+BENCHMARKS = {
+    'small_files': SmallFiles,
+    'sequential_write': SequentialWrite,
+    'sequential_read': SequentialRead,
+    'readdir': Readdir,
+    'stat_storm': StatStorm,
+    'deep_realpath': DeepRealpath,
+}
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def measure(name, scale=1.0, trace=True):
+    """Run the benchmark name, in the current process,
+    and return a dictionary of its results.
+
+    peak_rss_kb is the peak resident set size of the whole process
+    (in KiB on Linux, in bytes on macOS).
+    CPython doesn't count the allocations: with trace, the benchmark
+    is run again to measure the peak of the memory traced by tracemalloc
+    (traced_peak_kb), and the memory blocks allocated by each request
+    and not freed yet (net_allocs_per_op), e.g. by caches and leaks.
+    """
+    benchmark = BENCHMARKS[name](scale)
+    root = tempfile.mkdtemp(prefix='pysftpserver-bench-')
+    try:
+        benchmark.setup(root)
+        session = Session(root)
+        gc.collect()
+        start, cpu = time.time(), cpu_time()
+        benchmark.run(session)
+        elapsed, cpu = time.time() - start, cpu_time() - cpu
+        results = {
+            'requests': session.requests,
+            'seconds': elapsed,
+            'cpu_seconds': cpu,
+            'ops_per_sec': session.requests / elapsed,
+            'mb_per_sec': session.bytes / elapsed / 1000000,
+            'peak_rss_kb':
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+        if trace:
+            session = Session(root)
+            gc.collect()
+            tracemalloc.start()
+            blocks = sys.getallocatedblocks()
+            benchmark.run(session)
+            blocks = sys.getallocatedblocks() - blocks
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results['traced_peak_kb'] = peak // 1024
+            results['net_allocs_per_op'] = \
+                float(blocks) / session.requests
+        return results
+    finally:
+        shutil.rmtree(root, True)
+
+
+def run(names, scale=1.0, trace=True):
+    """Run each benchmark in a new process.
+
+    Return a dictionary of their results.
+    """
+    results = dict()
+    for name in names:
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(measure, (name, scale, trace))
+        finally:
+            pool.terminate()
+    return results
+
+
+def compare(previous, current):
+    """Return the lines of a table of ops/s and MB/s, before and now."""
+    lines = ['{:<20}{:>14}{:>14}{:>9}{:>13}{:>10}'.format(
+        'benchmark', 'ops/s before', 'ops/s now', 'ratio',
+        'MB/s before', 'MB/s now')]
+    for name in sorted(current):
+        now = current[name]
+        before = previous.get(name)
+        if before is None:
+            continue
+        lines.append('{:<20}{:>14.0f}{:>14.0f}{:>9.2f}{:>13.1f}{:>10.1f}'.format(
+            name, before['ops_per_sec'], now['ops_per_sec'],
+            now['ops_per_sec'] / before['ops_per_sec'],
+            before['mb_per_sec'], now['mb_per_sec']))
+    return lines
+
+
+def create_parser():
+    """Create the CLI argument parser."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the SFTP protocol handling of pysftpserver, '
+                    'in-process, over a virtual chroot.'
+    )
+
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=sorted(BENCHMARKS),
+        help="benchmark to run (can be repeated, defaults to all of them)"
+    )
+
+    parser.add_argument(
+        "--scale",
+        default=1.0,
+        type=float,
+        help="multiply the number of files, requests and bytes (defaults to 1)"
+    )
+
+    parser.add_argument(
+        "--no-trace",
+        action="store_true",
+        help="don't run the benchmarks again to trace the allocations"
+    )
+
+    parser.add_argument(
+        "--label",
+        help="label stored with the results, e.g. the version"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="path of the JSON results (defaults to the standard output)"
+    )
+
+    parser.add_argument(
+        "--compare",
+        metavar="results.json",
+        help="print a comparison with these previous results to the standard error"
+    )
+    return parser
+
+
+def main(args=None):
+    parser = create_parser()
+    args = parser.parse_args(args)
+
+    results = {
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'benchmarks': run(
+            args.only or sorted(BENCHMARKS), args.scale, not args.no_trace),
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for line in compare(previous['benchmarks'], results['benchmarks']):
+            sys.stderr.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 """Abstract SFTP storage. Subclass it the way you want!"""
 
+import errno
+import os
+import stat
+
 
 class SFTPAbstractServerStorage:
     """Abstract storage class. Subclass it and override the methods."""
@@ -25,6 +29,20 @@ class SFTPAbstractServerStorage:
         """
         return {}
 
+    def stat_many(self, filenames, lstat=False):
+        """stat (or lstat) many files at once.
+
+        Return a list holding, for each filename, the dictionary of stats
+        or the raised exception.
+        """
+        stats = list()
+        for filename in filenames:
+            try:
+                stats.append(self.stat(filename, lstat=lstat))
+            except Exception as e:
+                stats.append(e)
+        return stats
+
     def setstat(self, filename, attrs, fsetstat=False):
         """setstat and fsetstat requests.
 
@@ -58,6 +76,124 @@ class SFTPAbstractServerStorage:
         """Move/rename file."""
         return
 
+    def rmtree(self, filename):
+        """Remove filename and, if it is a directory, all its contents.
+
+        Symlinks are removed, never followed.
+        Return the number of removed entries and a list of
+        (path, exception) of the entries that could not be removed.
+        This generic implementation relies on opendir, stat, rm and rmdir.
+        """
+        attrs = self.stat(filename, lstat=True)
+        if not stat.S_ISDIR(attrs[b'perm']):
+            self.rm(filename)
+            return 1, []
+
+        removed = 0
+        errors = list()
+        stack = [(filename, self.opendir(filename))]
+        while stack:
+            dirname, entries = stack[-1]
+            entry = next(entries, None)
+            if entry is None:  # now the directory should be empty
+                self.close(entries)
+                stack.pop()
+                try:
+                    self.rmdir(dirname)
+                    removed += 1
+                except Exception as e:
+                    errors.append((dirname, e))
+                continue
+            if entry in (b'.', b'..'):
+                continue
+            path = os.path.join(dirname, entry)
+            try:
+                attrs = self.stat(path, lstat=True)
+                if stat.S_ISDIR(attrs[b'perm']):
+                    stack.append((path, self.opendir(path)))
+                else:
+                    self.rm(path)
+                    removed += 1
+            except Exception as e:
+                errors.append((path, e))
+        return removed, errors
+
+    def makedirs(self, filename, mode):
+        """Create directory filename with given mode, and its missing parents
+        (with the default mode, as mkdir -p does).
+
+        Nothing is done if the directory already exists.
+        This generic implementation relies on stat and mkdir.
+        """
+        missing = list()
+        filename = dirname = filename.rstrip(b'/')
+        while dirname:
+            try:
+                attrs = self.stat(dirname)
+            except Exception:
+                parent = os.path.dirname(dirname)
+                if parent == dirname:
+                    break  # the root can't be created: mkdir will fail
+                missing.append(dirname)
+                dirname = parent
+                continue
+            if not stat.S_ISDIR(attrs[b'perm']):
+                raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR))
+            break
+        for dirname in reversed(missing):
+            self.mkdir(dirname, mode if dirname == filename else 0o777)
+
+    def disk_usage(self, filename):
+        """Summarize the usage of filename and, if it is a directory,
+        of all its contents. Symlinks are not followed.
+
+        Return a dictionary holding the total size of the files (b'size'),
+        and the number of files (b'files') and directories (b'dirs').
+        Unreadable entries are skipped.
+        This generic implementation relies on opendir and stat.
+        """
+        usage = {b'size': 0, b'files': 0, b'dirs': 0}
+        stack = [filename]
+        while stack:
+            path = stack.pop()
+            try:
+                attrs = self.stat(path, lstat=True)
+            except Exception:
+                if path == filename:
+                    raise
+                continue
+            if not stat.S_ISDIR(attrs[b'perm']):
+                usage[b'size'] += attrs[b'size']
+                usage[b'files'] += 1
+                continue
+            usage[b'dirs'] += 1
+            try:
+                entries = self.opendir(path)
+            except Exception:
+                continue
+            stack.extend(
+                os.path.join(path, entry) for entry in entries
+                if entry not in (b'.', b'..')
+            )
+            self.close(entries)
+        return usage
+
+    def posix_rename(self, oldpath, newpath):
+        """Move/rename file, atomically replacing newpath if it exists.
+
+        By default newpath is removed, then oldpath renamed:
+        override it to do it atomically.
+        """
+        try:
+            self.rm(newpath)
+        except Exception:
+            pass  # e.g. newpath doesn't exist
+        self.rename(oldpath, newpath)
+
+    def hardlink(self, oldpath, newpath):
+        """Create newpath as an hard link to oldpath."""
+        return
+
     def symlink(self, linkpath, targetpath):
         """Symlink file."""
         return
@@ -67,13 +203,42 @@ class SFTPAbstractServerStorage:
         return
 
     def write(self, handle, off, chunk):
-        """Write chunk at offset of handle."""
+        """Write chunk at offset of handle.
+
+        Can return an SFTPDeferred (see deferred.py) of the result.
+        """
         return
 
     def read(self, handle, off, size):
-        """Read from the handle size, starting from offset off."""
+        """Read from the handle size, starting from offset off.
+
+        Can return an SFTPDeferred (see deferred.py) of the result.
+        """
         return None
 
+    def fsync(self, handle):
+        """Flush the handle contents to stable storage."""
+        return
+
+    def fsync_many(self, handles):
+        """Flush many handles at once (used by the fsync group commit).
+
+        Return a list holding, for each handle, None on success
+        or the raised exception.
+        Handles occurring more than once are flushed only once.
+        """
+        synced = dict()
+        errors = list()
+        for handle in handles:
+            if handle not in synced:
+                try:
+                    self.fsync(handle)
+                    synced[handle] = None
+                except Exception as e:
+                    synced[handle] = e
+            errors.append(synced[handle])
+        return errors
+
     def close(self, handle):
         """Close the file handle."""
         return
@@ -0,0 +1,100 @@
+"""Measure the throughput of the SSH security options of the proxy backend.
+
+Each combination of cipher, MAC and compression is used to send some
+data to a local stub SSH server, over a socket pair: so only the cost of
+the encryption, of the authentication and of the compression is measured.
+"""
+
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+from pysftpserver.proxystorage import set_security_options
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accept any session, without authentication."""
+
+    def get_allowed_auths(self, username):
+        return 'none'
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+def sample(size, compressible=False):
+    """Return size bytes of random (or text-like, if compressible) data."""
+    if not compressible:
+        return os.urandom(size)
+    line = b'pysftpserver compressible sample line, repeated over and over\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def measure(cipher, mac, compression=False, data=b'', host_key=None,
+            chunk_size=32 * 1024):
+    """Send data through a transport negotiating cipher, mac and compression.
+
+    Return the throughput, in bytes per second.
+    """
+    host_key = host_key or paramiko.RSAKey.generate(2048)
+    client_sock, server_sock = socket.socketpair()
+    server = paramiko.Transport(server_sock)
+    server.add_server_key(host_key)
+    server.use_compression(compression)
+    client = paramiko.Transport(client_sock)
+    set_security_options(client, [cipher], [mac], compression=compression)
+    try:
+        # don't wait the negotiation, which needs the client
+        server.start_server(event=threading.Event(), server=StubServer())
+        client.start_client()
+        client.auth_none('benchmark')
+        channel = client.open_session()
+        remote = server.accept(10)
+
+        received = [0]
+
+        def drain():
+            while received[0] < len(data):
+                chunk = remote.recv(chunk_size)
+                if not chunk:
+                    break
+                received[0] += len(chunk)
+
+        thread = threading.Thread(target=drain)
+        start = time.time()
+        thread.start()
+        for off in range(0, len(data), chunk_size):
+            channel.sendall(data[off:off + chunk_size])
+        thread.join()
+        elapsed = time.time() - start
+    finally:
+        client.close()
+        server.close()
+    return received[0] / elapsed if elapsed else 0.0
+
+
+def benchmark(ciphers=None, macs=None, compressions=(False, True),
+              size=16 * 1024 * 1024, compressible=False):
+    """Measure each combination of ciphers, macs and compressions
+    (all the ones supported by Paramiko, by default).
+
+    Yield (cipher, mac, compression, bytes per second) tuples.
+    AEAD ciphers (e.g. AES-GCM) authenticate the data themselves,
+    so they are measured once, regardless of the MAC.
+    """
+    ciphers = ciphers or paramiko.Transport._preferred_ciphers
+    macs = macs or paramiko.Transport._preferred_macs
+    data = sample(size, compressible)
+    host_key = paramiko.RSAKey.generate(2048)
+    for cipher in ciphers:
+        aead = paramiko.Transport._cipher_info.get(cipher, {}).get('is_aead')
+        for mac in macs[:1] if aead else macs:
+            for compression in compressions:
+                yield (cipher, None if aead else mac, compression,
+                       measure(cipher, mac, compression, data, host_key))
@@ -0,0 +1,117 @@
+"""Share the backend SSH connections between several pysftpproxy sessions.
+
+Each pysftpproxy session would otherwise open (and authenticate) its own
+SSH connection to the remote server. A broker keeps a few authenticated
+transports open instead, and listens on a unix socket: every connection
+to it gets a new SFTP channel over one of the transports, whose bytes are
+relayed as they are.
+"""
+
+import os
+import select
+import socket
+import stat
+import threading
+from itertools import cycle
+
+
+class BrokerSocket(socket.socket):
+    """A unix socket attached to a broker.
+
+    Paramiko names the logger of its clients after their channel.
+    """
+
+    def get_name(self):
+        return 'broker'
+
+
+def attach(path):
+    """Return a socket speaking SFTP through the broker listening at path."""
+    sock = BrokerSocket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+class SFTPBroker(object):
+    """Lend SFTP channels over shared SSH transports."""
+
+    def __init__(self, connect, path, connections=1):
+        """connect is called to open a new authenticated transport;
+        connections of them are shared among the sessions
+        attached to the unix socket at path."""
+        self.connect = connect
+        self.path = path
+        self.transports = [connect() for i in range(max(1, connections))]
+        self.next_transport = cycle(range(len(self.transports)))
+        self.lock = threading.Lock()
+        self.sock = None
+
+    def transport(self):
+        """Return the next transport, reconnecting it if it has been closed."""
+        with self.lock:
+            i = next(self.next_transport)
+            if not self.transports[i].is_active():
+                self.transports[i] = self.connect()
+            return self.transports[i]
+
+    def listen(self):
+        """Bind the unix socket, accessible only by the current user."""
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)  # a stale socket
+        except (OSError, socket.error):
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(16)
+
+    def serve_forever(self):
+        if not self.sock:
+            self.listen()
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except (OSError, socket.error):
+                break  # closed
+            thread = threading.Thread(target=self.relay, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def relay(self, conn):
+        """Relay the bytes between conn and a new SFTP channel."""
+        try:
+            channel = self.transport().open_session()
+            channel.invoke_subsystem('sftp')
+        except Exception:
+            conn.close()
+            return
+
+        try:
+            while True:
+                r, _, _ = select.select([conn, channel], [], [])
+                if conn in r:
+                    data = conn.recv(32 * 1024)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in r:
+                    data = channel.recv(32 * 1024)
+                    if not data:
+                        break
+                    conn.sendall(data)
+        except (OSError, socket.error, EOFError):
+            pass
+        finally:
+            channel.close()
+            conn.close()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        for transport in self.transports:
+            transport.close()
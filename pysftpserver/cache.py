@@ -0,0 +1,214 @@
+"""Caches of the remote attributes and contents, for the proxy storage."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from collections import OrderedDict
+from functools import partial
+
+_finalizers = set()  # the weakrefs removing the spill dirs, on Python 2
+
+
+def _remove_spill_dir(spill_dir, ref):
+    _finalizers.discard(ref)
+    shutil.rmtree(spill_dir, True)
+
+
+class LRUCache(object):
+    """A bounded cache, evicting the least recently used entries.
+
+    Entries expire ttl seconds after they have been stored.
+    """
+
+    def __init__(self, size=1024, ttl=5, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expiration, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """Return the value of key, or None if it is not cached."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < self.clock():
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        self.entries[key] = self.entries.pop(key)  # the most recent
+        if count:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = (self.clock() + self.ttl, value)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """Invalidate the entries whose key satisfies predicate."""
+        for key in [k for k in self.entries if predicate(k)]:
+            del self.entries[key]
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+
+class SFTPAttributesCache(object):
+    """Attributes, directory listings and missing paths of a remote server.
+
+    Paths must be absolute and normalized.
+    """
+
+    def __init__(self, size=1024, ttl=5, clock=time.time):
+        self.attrs = LRUCache(size, ttl, clock)  # (path, lstat) -> attrs
+        self.dirs = LRUCache(size, ttl, clock)  # path -> list of attrs
+        self.missing = LRUCache(size, ttl, clock)  # path -> True
+
+    def invalidate(self, path):
+        """Forget everything about path, which has been changed."""
+        for lstat in (False, True):
+            self.attrs.invalidate((path, lstat))
+        self.dirs.invalidate(path)
+        self.dirs.invalidate(os.path.dirname(path))
+        self.missing.invalidate(path)
+
+    def invalidate_tree(self, path):
+        """Forget everything about path and what is inside it
+        (e.g. once it has been renamed)."""
+        prefix = os.path.join(path, b'')
+
+        def inside(p):
+            return p == path or p.startswith(prefix)
+
+        self.invalidate(path)
+        self.attrs.invalidate_if(lambda key: inside(key[0]))
+        self.dirs.invalidate_if(inside)
+        self.missing.invalidate_if(inside)
+
+    def stats(self):
+        """Return a dictionary of (hits, misses, hit rate) of each cache."""
+        return dict(
+            (name, (cache.hits, cache.misses, cache.hit_rate()))
+            for name, cache in (
+                ('attrs', self.attrs),
+                ('dirs', self.dirs),
+                ('missing', self.missing),
+            )
+        )
+
+
+class SFTPBlockCache(object):
+    """Blocks of remote files, keyed by (path, mtime, size, block index).
+
+    Up to memory bytes are kept in memory; if spill_dir is given,
+    the least recently used blocks are then moved to files inside it,
+    up to spill_size bytes.
+    """
+
+    def __init__(self, memory=64 * 1024 * 1024, block_size=64 * 1024,
+                 spill_dir=None, spill_size=1024 * 1024 * 1024):
+        self.memory = memory
+        self.block_size = block_size
+        self.blocks = OrderedDict()  # key -> data
+        self.memory_used = 0
+        self.spill_dir = None
+        if spill_dir:
+            # a private directory, removed with the cache
+            self.spill_dir = tempfile.mkdtemp(
+                prefix='pysftpserver-', dir=spill_dir)
+            if hasattr(weakref, 'finalize'):
+                weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+            else:  # Python 2
+                _finalizers.add(weakref.ref(
+                    self, partial(_remove_spill_dir, self.spill_dir)))
+        self.spill_size = spill_size
+        self.spilled = OrderedDict()  # key -> size
+        self.spill_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the block of key, or None if it is not cached."""
+        data = self.blocks.get(key)
+        if data is not None:
+            self.blocks[key] = self.blocks.pop(key)  # the most recent
+        elif key in self.spilled:
+            data = self.unspill(key)
+            if data is not None:
+                self.put(key, data)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if key in self.blocks:
+            self.memory_used -= len(self.blocks.pop(key))
+        self.blocks[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory:
+            key, data = self.blocks.popitem(last=False)
+            self.memory_used -= len(data)
+            self.spill(key, data)
+
+    def spill_path(self, key):
+        return os.path.join(
+            self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def spill(self, key, data):
+        """Move the block to the spill directory, if any."""
+        if not self.spill_dir or len(data) > self.spill_size:
+            return
+        try:
+            with open(self.spill_path(key), 'wb') as f:
+                f.write(data)
+        except (IOError, OSError):
+            return  # e.g. the disk is full: just forget it
+        self.spilled[key] = len(data)
+        self.spill_used += len(data)
+        while self.spill_used > self.spill_size:
+            self.remove_spilled(next(iter(self.spilled)))
+
+    def unspill(self, key):
+        """Remove the block from the spill directory and return it."""
+        try:
+            with open(self.spill_path(key), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            data = None
+        self.remove_spilled(key)
+        return data
+
+    def remove_spilled(self, key):
+        self.spill_used -= self.spilled.pop(key)
+        try:
+            os.remove(self.spill_path(key))
+        except OSError:
+            pass
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """Return a dictionary of (hits, misses, hit rate) of the cache."""
+        return {'blocks': (self.hits, self.misses, self.hit_rate())}
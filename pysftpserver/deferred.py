@@ -0,0 +1,65 @@
+"""Results of storage calls that complete later.
+
+A storage can return an SFTPDeferred instead of the result of a call
+(e.g. when it forwards the request to a remote server): the server then
+goes on processing the next requests, and sends the reply only once the
+result is available.
+"""
+
+
+class SFTPDeferred(object):
+    """The result of a pending storage call."""
+
+    def __init__(self, pump):
+        """pump is called, while the result is not available,
+        to make some progress towards it."""
+        self.pump = pump
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def set_result(self, result):
+        self.result = result
+        self.done = True
+
+    def set_error(self, error):
+        self.error = error
+        self.done = True
+
+    def wait(self):
+        """Wait the result and return it.
+
+        The exception raised by the call, if any, is raised instead.
+        """
+        while not self.done:
+            self.pump()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def resolve(result):
+    """Return result, waiting it if it is an SFTPDeferred."""
+    if isinstance(result, SFTPDeferred):
+        return result.wait()
+    return result
+
+
+def combine(results, function):
+    """Return function(*results).
+
+    If some results are SFTPDeferred, return an SFTPDeferred of it instead,
+    so that function is called once they are all available.
+    """
+    if not any(isinstance(result, SFTPDeferred) for result in results):
+        return function(*results)
+
+    def pump():
+        try:
+            deferred.set_result(
+                function(*[resolve(result) for result in results]))
+        except Exception as e:
+            deferred.set_error(e)
+
+    deferred = SFTPDeferred(pump)
+    return deferred
@@ -0,0 +1,75 @@
+"""Latency histograms, with buckets of logarithmic width (as HDR ones)."""
+
+SUB_BUCKETS = 16  # the buckets each power of 2 is split into
+
+
+def bucket(value):
+    """Return the index of the bucket of the (non negative integer) value.
+
+    The values below 2 * SUB_BUCKETS have a bucket each, the other ones
+    are bucketed within 1 / SUB_BUCKETS of their value.
+    """
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKETS.bit_length()
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_range(index):
+    """Return the lowest and the highest value of the bucket index."""
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift, top = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+    top += SUB_BUCKETS
+    return top << shift, ((top + 1) << shift) - 1
+
+
+class Histogram(object):
+    """Count the values recorded (e.g. latencies in microseconds)
+    in buckets: the memory taken doesn't depend on their number."""
+
+    def __init__(self):
+        self.buckets = dict()  # bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        index = bucket(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values recorded by the other histogram."""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0.0
+
+    def percentile(self, p):
+        """Return (the highest value of the bucket of) the p-th percentile."""
+        if not self.count:
+            return 0
+        rank = self.count * p / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_range(index)[1], self.max)
+        return self.max
+
+    def ranges(self):
+        """Return the (lowest value, highest value, count) of each
+        non empty bucket, in order."""
+        return [
+            bucket_range(index) + (self.buckets[index], )
+            for index in sorted(self.buckets)
+        ]
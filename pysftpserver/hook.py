@@ -69,3 +69,33 @@ class SftpHook:
 
     def readlink(self, filename):
         pass
+
+    def posix_rename(self, oldpath, newpath):
+        pass
+
+    def hardlink(self, oldpath, newpath):
+        pass
+
+    def fsync(self, handle_id):
+        pass
+
+    def stat_many(self, filenames, lstat):
+        pass
+
+    def get_file(self, filename):
+        pass
+
+    def put_file(self, filename, attrs, data):
+        pass
+
+    def tar_open(self, filename, flags):
+        pass
+
+    def rmtree(self, filename):
+        pass
+
+    def makedirs(self, filename, attrs):
+        pass
+
+    def disk_usage(self, filename):
+        pass
@@ -0,0 +1,106 @@
+"""Log levels, and a buffered log writer.
+
+The lines are queued and written by a background thread, that flushes
+the file every flush_interval seconds: so the server never waits for
+the disk. When the queue is full (the disk can't keep up), the lines are
+dropped and counted instead, and the count is logged once there is room.
+"""
+
+import atexit
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+DISABLED = 100  # above every level
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+
+LEVEL_NAMES = dict((level, name.upper()) for name, level in LEVELS.items())
+
+
+class SFTPLogWriter(object):
+    """Write to file in background, up to max_queue writes waiting.
+
+    It can stand for a text file (e.g. sys.stderr): the writes after
+    close are written at once.
+    """
+
+    def __init__(self, file, max_queue=10000, flush_interval=1.0):
+        self.file = file
+        self.queue = queue.Queue(max_queue)
+        self.flush_interval = flush_interval
+        self.dropped = 0  # writes dropped since the last report
+        self.total_dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, text):
+        if self.closed:
+            self.file.write(text)
+            self.file.flush()
+            return
+        try:
+            self.queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+            self.total_dropped += 1
+
+    def flush(self):
+        """The queued writes are flushed periodically, by the writer."""
+
+    def work(self):
+        last_flush = time.time()
+        dirty = False  # written, but not flushed yet
+        while True:
+            timeout = None
+            if dirty:
+                timeout = max(0, last_flush + self.flush_interval - time.time())
+            try:
+                text = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                text = ''
+            if text is None:
+                break
+            if text:
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    self.file.write(
+                        '{} log lines dropped\n'.format(dropped))
+                self.file.write(text)
+                dirty = True
+            if dirty and time.time() - last_flush >= self.flush_interval:
+                self.file.flush()
+                dirty = False
+                last_flush = time.time()
+        if self.dropped:
+            self.file.write('{} log lines dropped\n'.format(self.dropped))
+            self.dropped = 0
+        self.file.flush()
+
+    def close(self):
+        """Write the queued lines, and stop the writer (the file
+        is left open)."""
+        if self.closed:
+            return
+        # the last writes are waited, even if the queue is full
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+        while not self.queue.empty():  # written while closing
+            self.write(self.queue.get_nowait())
@@ -0,0 +1,289 @@
+"""Per request type metrics: counts, errors, bytes and latencies.
+
+The server measures each request it dispatches (see SFTPServer.process):
+its latency, and the part of it spent in the storage calls, are recorded
+in histograms (see histogram.py) of its type, named after its opcode
+(e.g. 'OPEN') or after its extension (e.g. 'posix-rename@openssh.com').
+The unknown extensions are all counted as 'EXTENDED', the unknown
+opcodes as 'unknown': the client can't create new request types.
+The replies sent later (see deferred.py) are measured until they are sent.
+
+The metrics are exported every interval seconds, by the exporters:
+    PrometheusTextfileExporter: to a file read by the textfile collector
+        of the Prometheus node exporter;
+    StatsdExporter: to a statsd daemon, over UDP.
+"""
+
+import os
+import re
+import socket
+import struct
+import time
+
+from pysftpserver import server
+from pysftpserver.histogram import Histogram, bucket
+
+# request type -> name, e.g. SSH2_FXP_OPEN -> 'OPEN'
+NAMES = dict(
+    (value, name[len('SSH2_FXP_'):])
+    for name, value in vars(server).items() if name.startswith('SSH2_FXP_')
+)
+
+# the upper bounds of the buckets of the Prometheus histograms, in seconds
+PROMETHEUS_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats(object):
+    """The metrics of a request type. The latencies are in microseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_in = 0  # of the requests
+        self.bytes_out = 0  # of the replies
+        self.latency = Histogram()  # from the request to its reply
+        self.storage = Histogram()  # spent in the storage calls
+
+
+class SFTPMetrics(object):
+    """Collect the metrics of a server, export them every interval
+    seconds with each of the exporters."""
+
+    def __init__(self, exporters=(), interval=10):
+        self.exporters = list(exporters)
+        self.interval = interval
+        self.requests = dict()  # request name -> RequestStats
+        self.last_export = time.time()
+
+    def stats(self, name):
+        if name not in self.requests:
+            self.requests[name] = RequestStats()
+        return self.requests[name]
+
+    def begin(self, msg_type, payload):
+        """Return the RequestStats of the request msg_type, whose
+        arguments are payload, about to be dispatched."""
+        name = NAMES.get(msg_type, 'unknown')
+        if msg_type == server.SSH2_FXP_EXTENDED:
+            # the payload starts with the name of the extension
+            slen, = struct.unpack('>I', payload[:4])
+            extension = payload[4:4 + slen]
+            if extension in server.SFTPServer.extended_table:
+                name = extension.decode('utf-8', 'replace')
+        return self.stats(name)
+
+    def end(self, stats, bytes_in, bytes_out, elapsed, storage_seconds):
+        """Account the request of stats, once replied: elapsed seconds,
+        storage_seconds of them spent in the storage."""
+        stats.count += 1
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.latency.record(elapsed * 1000000)
+        stats.storage.record(storage_seconds * 1000000)
+
+    def error(self, stats):
+        """Count an error status sent to the request of stats."""
+        stats.errors += 1
+
+    def tick(self, force=False):
+        """Export the metrics, if interval seconds passed since
+        the last export (or if force is True)."""
+        now = time.time()
+        if not force and now - self.last_export < self.interval:
+            return
+        self.last_export = now
+        for exporter in self.exporters:
+            try:
+                exporter.export(self)
+            except (IOError, OSError, socket.error):
+                pass  # the next export will be tried anyway
+
+    def close(self):
+        """Export the metrics a last time, and close the exporters."""
+        self.tick(force=True)
+        for exporter in self.exporters:
+            exporter.close()
+
+
+def escape(value):
+    """Escape value as a label value of the Prometheus text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def cumulative(histogram, bounds):
+    """Return the number of the values recorded by histogram up to each
+    one of bounds (microseconds), within the precision of its buckets."""
+    counts = [0] * len(bounds)
+    for index, count in histogram.buckets.items():
+        for i, bound in enumerate(bounds):
+            if index <= bucket(bound):
+                counts[i] += count
+    return counts
+
+
+class PrometheusTextfileExporter(object):
+    """Write the metrics to path, in the Prometheus text format.
+
+    '{pid}' in path is replaced by the process id, so that each session
+    can have its own file. The file is written atomically, and removed
+    by close.
+    """
+
+    def __init__(self, path):
+        self.path = path.replace('{pid}', str(os.getpid()))
+
+    def export(self, metrics):
+        requests = sorted(
+            (escape(name), stats) for name, stats in metrics.requests.items())
+        lines = list()
+
+        def header(name, kind, description):
+            lines.append('# HELP pysftpserver_{} {}'.format(name, description))
+            lines.append('# TYPE pysftpserver_{} {}'.format(name, kind))
+
+        header('requests_total', 'counter', 'Requests received.')
+        lines.extend(
+            'pysftpserver_requests_total{{request="{}"}} {}'.format(
+                name, stats.count)
+            for name, stats in requests)
+        header('request_errors_total', 'counter', 'Requests that failed.')
+        lines.extend(
+            'pysftpserver_request_errors_total{{request="{}"}} {}'.format(
+                name, stats.errors)
+            for name, stats in requests)
+        header('request_bytes_total', 'counter',
+               'Bytes of the requests (in) and of their replies (out).')
+        for name, stats in requests:
+            for direction, value in (('in', stats.bytes_in),
+                                     ('out', stats.bytes_out)):
+                lines.append(
+                    'pysftpserver_request_bytes_total'
+                    '{{request="{}",direction="{}"}} {}'.format(
+                        name, direction, value))
+
+        bounds = [int(bound * 1000000) for bound in PROMETHEUS_BUCKETS]
+        for metric, attribute, description in (
+                ('request_duration_seconds', 'latency',
+                 'Time from each request to its reply.'),
+                ('storage_duration_seconds', 'storage',
+                 'Time spent in the storage calls of each request.')):
+            header(metric, 'histogram', description)
+            for name, stats in requests:
+                histogram = getattr(stats, attribute)
+                prefix = 'pysftpserver_{}_bucket{{request="{}",le='.format(
+                    metric, name)
+                for bound, count in zip(PROMETHEUS_BUCKETS,
+                                        cumulative(histogram, bounds)):
+                    lines.append('{}"{}"}} {}'.format(prefix, bound, count))
+                lines.append('{}"+Inf"}} {}'.format(prefix, histogram.count))
+                lines.append('pysftpserver_{}_sum{{request="{}"}} {}'.format(
+                    metric, name, histogram.total / 1000000.0))
+                lines.append('pysftpserver_{}_count{{request="{}"}} {}'.format(
+                    metric, name, histogram.count))
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp, self.path)
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class StatsdExporter(object):
+    """Send the metrics to the statsd daemon at address (host, port).
+
+    The counters are sent as the increments since the last export, the
+    latencies as gauges of the percentiles of the requests received
+    since then (in milliseconds).
+    """
+
+    max_datagram = 1432
+
+    def __init__(self, address, prefix='pysftpserver'):
+        self.address = address
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.last = dict()  # request name -> its RequestStats exported
+
+    def export(self, metrics):
+        lines = list()
+        for name, stats in sorted(metrics.requests.items()):
+            last = self.last.get(name) or RequestStats()
+            if stats.count == last.count:
+                continue
+            key = '{}.{}'.format(self.prefix, re.sub(r'[^\w-]', '_', name))
+            for metric, value in (
+                    ('requests', stats.count - last.count),
+                    ('errors', stats.errors - last.errors),
+                    ('bytes_in', stats.bytes_in - last.bytes_in),
+                    ('bytes_out', stats.bytes_out - last.bytes_out)):
+                lines.append('{}.{}:{}|c'.format(key, metric, value))
+            for attribute in ('latency', 'storage'):
+                histogram = difference(
+                    getattr(stats, attribute), getattr(last, attribute))
+                for p in (50, 90, 99):
+                    lines.append('{}.{}.p{}:{:.3f}|g'.format(
+                        key, attribute, p, histogram.percentile(p) / 1000.0))
+            self.last[name] = snapshot(stats)
+
+        datagram = ''
+        for line in lines:
+            if datagram and len(datagram) + len(line) >= self.max_datagram:
+                self.sock.sendto(datagram.encode(), self.address)
+                datagram = ''
+            datagram += line + '\n'
+        if datagram:
+            self.sock.sendto(datagram.encode(), self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+def snapshot(stats):
+    """Return a copy of the RequestStats stats."""
+    copy = RequestStats()
+    copy.count, copy.errors = stats.count, stats.errors
+    copy.bytes_in, copy.bytes_out = stats.bytes_in, stats.bytes_out
+    copy.latency.merge(stats.latency)
+    copy.storage.merge(stats.storage)
+    return copy
+
+
+def difference(histogram, previous):
+    """Return a Histogram of the values recorded by histogram
+    after it was the previous one."""
+    result = Histogram()
+    for index, count in histogram.buckets.items():
+        count -= previous.buckets.get(index, 0)
+        if count:
+            result.buckets[index] = count
+    result.count = histogram.count - previous.count
+    result.total = histogram.total - previous.total
+    result.max = histogram.max
+    return result
+
+
+def parse_address(value):
+    """Parse a 'host:port' statsd address (the host defaults to localhost)."""
+    host, _, port = value.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def create_metrics(textfile=None, statsd=None, interval=10):
+    """Return the SFTPMetrics exporting to the Prometheus textfile
+    and to the statsd address ('host:port'), None if neither is given."""
+    exporters = list()
+    if textfile:
+        exporters.append(PrometheusTextfileExporter(textfile))
+    if statsd:
+        exporters.append(StatsdExporter(parse_address(statsd)))
+    if not exporters:
+        return None
+    return SFTPMetrics(exporters, interval)
@@ -0,0 +1,349 @@
+"""Mount table storage. Route each path prefix to its own storage."""
+
+import errno
+import os
+import stat
+import time
+
+from pysftpserver.abstractstorage import SFTPAbstractServerStorage
+from pysftpserver.stat_helpers import stat_to_longname
+
+
+class Mount(object):
+    """A storage (or a callable returning it) mounted at path.
+
+    The paths inside the mount point are mapped inside root
+    (the storage home, by default).
+    The storage is created on the first access.
+    """
+
+    def __init__(self, path, storage, root=None):
+        self.path = path
+        self.factory = storage if callable(storage) else None
+        self.instance = None if callable(storage) else storage
+        self.root = root
+
+    @property
+    def storage(self):
+        if self.instance is None:
+            self.instance = self.factory()
+        return self.instance
+
+    def translate(self, path):
+        """Return the path of the storage mapped to path."""
+        root = self.root or self.storage.home
+        if not isinstance(root, bytes):
+            root = root.encode()
+        rest = os.path.relpath(path, self.path)
+        return root if rest == b'.' else os.path.join(root, rest)
+
+
+class SFTPServerMountStorage(SFTPAbstractServerStorage):
+    """Mount table storage.
+
+    Each request is forwarded to the storage mounted at the longest
+    prefix of its path. The directories holding the mount points
+    (e.g. the root one) are synthesized, read-only, if nothing
+    is mounted there.
+    """
+
+    def __init__(self, mounts, home='/'):
+        """Home sweet home.
+
+        mounts maps each mount point (an absolute path) to the storage,
+        or to a (storage, root) tuple: a storage can be replaced
+        by a callable returning it, to connect it lazily.
+        The handles returned by the storages must be unique
+        (e.g. file descriptors or objects).
+        """
+        self.home = home
+        self.mounts = list()
+        for path, storage in mounts.items():
+            if not isinstance(path, bytes):
+                path = path.encode()
+            storage, root = storage if isinstance(storage, tuple) \
+                else (storage, None)
+            self.mounts.append(Mount(os.path.normpath(path), storage, root))
+        # the longest prefixes first
+        self.mounts.sort(key=lambda mount: len(mount.path), reverse=True)
+        self.handles = dict()  # handle -> storage that returned it
+        self.listings = dict()  # listing -> entries of the storage
+        self.started = int(time.time())
+
+    def resolve(self, filename):
+        """Return the absolute, normalized path of filename."""
+        home = self.home.encode()
+        return os.path.normpath(os.path.join(home, filename))
+
+    def mount(self, filename):
+        """Return the (mount, path) of filename.
+
+        mount is None if filename is not inside any mount point.
+        """
+        path = self.resolve(filename)
+        for mount in self.mounts:
+            if path == mount.path or mount.path == b'/' or \
+                    path.startswith(mount.path + b'/'):
+                return mount, path
+        return None, path
+
+    def route(self, filename):
+        """Return the storage of filename and its path there.
+
+        An OSError is raised if filename is not inside any mount point.
+        """
+        mount, path = self.mount(filename)
+        if mount is None:
+            if self.children(path):
+                raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+        return mount.storage, mount.translate(path)
+
+    def route_pair(self, oldpath, newpath):
+        """Route oldpath and newpath, that must be on the same mount."""
+        mount, _ = self.mount(oldpath)
+        if mount is not self.mount(newpath)[0]:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        storage, oldpath = self.route(oldpath)
+        return storage, oldpath, self.route(newpath)[1]
+
+    def children(self, path):
+        """Return the names of the entries of path leading to mount points
+        (the mount points themselves or their synthesized parents)."""
+        prefix = os.path.join(path, b'')
+        names = list()
+        for mount in self.mounts:
+            if mount.path != path and mount.path.startswith(prefix):
+                name = mount.path[len(prefix):].split(b'/')[0]
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def synthesized(self, path):
+        """Return whether path is a synthesized directory:
+        a mount point, or a directory holding some of them."""
+        return any(
+            mount.path == path or mount.path.startswith(
+                os.path.join(path, b''))
+            for mount in self.mounts
+        )
+
+    def directory(self, filename):
+        """Return the stats of a synthesized directory."""
+        _stat = os.stat_result((
+            stat.S_IFDIR | 0o555, 0, 0, 2, os.getuid(), os.getgid(), 0,
+            self.started, self.started, self.started
+        ))
+        return {
+            b'size': _stat.st_size,
+            b'uid': _stat.st_uid,
+            b'gid': _stat.st_gid,
+            b'perm': _stat.st_mode,
+            b'atime': _stat.st_atime,
+            b'mtime': _stat.st_mtime,
+            b'longname': stat_to_longname(_stat, filename)
+        }
+
+    def verify(self, filename):
+        """Verify filename with the storage of its mount."""
+        mount, path = self.mount(filename)
+        if mount is None or self.synthesized(path):
+            return True  # not found or synthesized
+        return mount.storage.verify(mount.translate(path))
+
+    def stat(self, filename, parent=None, lstat=False, fstat=False):
+        """stat, lstat and fstat requests.
+
+        Return a dictionary of stats.
+        Filename is an handle in the fstat variant.
+        The mount points have the stats of synthesized directories.
+        """
+        if fstat:
+            return self.handles[filename].stat(filename, fstat=True)
+        path = self.resolve(
+            filename if not parent else os.path.join(parent, filename))
+        if self.synthesized(path):
+            return self.directory(filename)
+        if parent:
+            mount, _ = self.mount(parent)
+            if mount is not None and mount is self.mount(path)[0]:
+                # keep the attributes collected by the listing, if any
+                return mount.storage.stat(
+                    filename, parent=mount.translate(self.resolve(parent)),
+                    lstat=lstat)
+        storage, path = self.route(path)
+        return storage.stat(path, lstat=lstat)
+
+    def stat_many(self, filenames, lstat=False):
+        """stat (or lstat) many files at once.
+
+        The files of each storage are stat'ed together.
+        """
+        stats = [None] * len(filenames)
+        groups = dict()  # storage -> [(index, path)]
+        for i, filename in enumerate(filenames):
+            try:
+                path = self.resolve(filename)
+                if self.synthesized(path):
+                    stats[i] = self.directory(filename)
+                    continue
+                storage, path = self.route(path)
+            except Exception as e:
+                stats[i] = e
+                continue
+            groups.setdefault(storage, list()).append((i, path))
+        for storage, group in groups.items():
+            results = storage.stat_many([path for i, path in group], lstat)
+            for (i, path), result in zip(group, results):
+                stats[i] = result
+        return stats
+
+    def setstat(self, filename, attrs, fsetstat=False):
+        """setstat and fsetstat requests.
+
+        Filename is an handle in the fstat variant.
+        """
+        if fsetstat:
+            return self.handles[filename].setstat(
+                filename, attrs, fsetstat=True)
+        storage, path = self.route(filename)
+        return storage.setstat(path, attrs)
+
+    def opendir(self, filename):
+        """Return an iterator over the files in filename.
+
+        The mount points inside it are listed too.
+        """
+        mount, path = self.mount(filename)
+        if mount is None:
+            if not self.synthesized(path):
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+            storage, entries = None, iter([b'.', b'..'])
+        else:
+            storage = mount.storage
+            entries = storage.opendir(mount.translate(path))
+        listing = self.listdir(entries, self.children(path))
+        self.handles[listing] = storage
+        self.listings[listing] = entries
+        return listing
+
+    @staticmethod
+    def listdir(entries, children):
+        seen = set()
+        for name in entries:
+            seen.add(name)
+            yield name
+        for name in children:
+            if name not in seen:
+                yield name
+
+    def open(self, filename, flags, mode):
+        """Return the file handle."""
+        storage, path = self.route(filename)
+        handle = storage.open(path, flags, mode)
+        self.handles[handle] = storage
+        return handle
+
+    def mkdir(self, filename, mode):
+        """Create directory with given mode."""
+        storage, path = self.route(filename)
+        storage.mkdir(path, mode)
+
+    def rmdir(self, filename):
+        """Remove directory."""
+        storage, path = self.route(filename)
+        storage.rmdir(path)
+
+    def rm(self, filename):
+        """Remove file."""
+        storage, path = self.route(filename)
+        storage.rm(path)
+
+    def rename(self, oldpath, newpath):
+        """Move/rename file, inside the same mount."""
+        storage, oldpath, newpath = self.route_pair(oldpath, newpath)
+        storage.rename(oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        """Move/rename file, atomically replacing newpath if it exists."""
+        storage, oldpath, newpath = self.route_pair(oldpath, newpath)
+        storage.posix_rename(oldpath, newpath)
+
+    def hardlink(self, oldpath, newpath):
+        """Create newpath as an hard link to oldpath."""
+        storage, oldpath, newpath = self.route_pair(oldpath, newpath)
+        storage.hardlink(oldpath, newpath)
+
+    def symlink(self, linkpath, targetpath):
+        """Symlink file. targetpath is stored as it is."""
+        storage, path = self.route(linkpath)
+        storage.symlink(path, targetpath)
+
+    def readlink(self, filename):
+        """Readlink of filename."""
+        storage, path = self.route(filename)
+        return storage.readlink(path)
+
+    def rmtree(self, filename):
+        """Remove filename and, if it is a directory, all its contents.
+
+        Forwarded to its storage, unless some mount points are inside it.
+        """
+        if self.synthesized(self.resolve(filename)):
+            return SFTPAbstractServerStorage.rmtree(self, filename)
+        storage, path = self.route(filename)
+        return storage.rmtree(path)
+
+    def makedirs(self, filename, mode):
+        """Create directory filename with given mode, and its missing parents.
+        """
+        if self.synthesized(self.resolve(filename)):
+            return
+        storage, path = self.route(filename)
+        storage.makedirs(path, mode)
+
+    def disk_usage(self, filename):
+        """Summarize the usage of filename and, if it is a directory,
+        of all its contents.
+
+        Forwarded to its storage, unless some mount points are inside it.
+        """
+        if self.synthesized(self.resolve(filename)):
+            return SFTPAbstractServerStorage.disk_usage(self, filename)
+        storage, path = self.route(filename)
+        return storage.disk_usage(path)
+
+    def write(self, handle, off, chunk):
+        """Write chunk at offset of handle."""
+        return self.handles[handle].write(handle, off, chunk)
+
+    def read(self, handle, off, size):
+        """Read from the handle size, starting from offset off."""
+        return self.handles[handle].read(handle, off, size)
+
+    def fsync(self, handle):
+        """Flush the handle contents to stable storage."""
+        self.handles[handle].fsync(handle)
+
+    def fsync_many(self, handles):
+        """Flush many handles at once.
+
+        The handles of each storage are flushed together.
+        """
+        errors = [None] * len(handles)
+        groups = dict()  # storage -> [(index, handle)]
+        for i, handle in enumerate(handles):
+            groups.setdefault(self.handles[handle], list()).append(
+                (i, handle))
+        for storage, group in groups.items():
+            results = storage.fsync_many([handle for i, handle in group])
+            for (i, handle), error in zip(group, results):
+                errors[i] = error
+        return errors
+
+    def close(self, handle):
+        """Close the file handle."""
+        storage = self.handles.pop(handle)
+        handle = self.listings.pop(handle, handle)
+        if storage is not None:
+            storage.close(handle)
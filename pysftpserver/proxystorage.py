@@ -1,13 +1,26 @@
 """Proxy SFTP storage. Forward each request to another SFTP server."""
 
 import paramiko
+from paramiko.sftp import (CMD_ATTRS, CMD_DATA, CMD_EXTENDED, CMD_LSTAT,
+                           CMD_READ, CMD_STAT, CMD_STATUS, CMD_WRITE, SFTPError,
+                           int64)
 
 from pysftpserver.abstractstorage import SFTPAbstractServerStorage
+from pysftpserver.broker import attach
+from pysftpserver.cache import SFTPAttributesCache, SFTPBlockCache
+from pysftpserver.deferred import SFTPDeferred, combine
+from pysftpserver.pysftpexceptions import SFTPConnectionError
+from pysftpserver.spool import SFTPUploadSpool, SpooledFile
 from pysftpserver.stat_helpers import stat_to_longname
 
+import errno
 import os
+import select
 import sys
 import socket
+import time
+from collections import deque
+from itertools import cycle
 from getpass import getuser
 
 
@@ -30,47 +43,270 @@ def exception_wrapper(method):
     return _wrapper
 
 
-class SFTPServerProxyStorage(SFTPAbstractServerStorage):
-    """Proxy SFTP storage.
-    Uses a Paramiko client to forward requests to another SFTP server.
+# the failures of the connection to the remote server
+# (reconnect checks that it has actually been lost)
+CONNECTION_ERRORS = (EOFError, socket.error, paramiko.SSHException)
+
+
+def reconnecting(method):
+    """Call the storage method again, once, if it fails because
+    the connection has been lost (and it could be reconnected).
+
+    Only for the idempotent methods: see reconnecting_before.
     """
+    def _wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except CONNECTION_ERRORS:
+            if not self.reconnect():
+                raise
+        return method(self, *args, **kwargs)
 
-    @staticmethod
-    def flags_to_mode(flags, mode):
-        """Convert:
-            os module flags and mode -> Paramiko file open mode.
-        Note: mode is ignored ATM.
+    return _wrapper
+
+
+def reconnecting_before(method):
+    """Reconnect before calling the storage method, if the connection
+    has been lost.
+
+    If the connection is lost during the call, the method is not called
+    again: the remote server could have applied it anyway (e.g. a rename,
+    that would then fail). The next calls will reconnect.
+    """
+    def _wrapper(self, *args, **kwargs):
+        self.reconnect()
+        try:
+            return method(self, *args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.reconnect()
+            raise
+
+    return _wrapper
+
+
+def to_oserror(e):
+    """Same as exception_wrapper, for exceptions that are returned."""
+    if isinstance(e, IOError) and not isinstance(e, OSError):
+        return OSError(e.errno, e.strerror)
+    return e
+
+
+class PipelinedRequests(object):
+    """Send many requests to the remote server without waiting
+    for each response, and then collect them.
+
+    Responses are stored as they come, so the remote server is
+    free to answer in any order.
+    If the connection is lost, lost is called to reconnect: if it
+    returns True, the requests still waiting a response are sent again
+    (see rebind).
+    """
+
+    def __init__(self, client, window=64, lost=None):
+        self.client = client
+        self.window = window  # max number of requests in flight
+        self.lost = lost
+        self.responses = dict()
+        self.deferred = dict()
+        self.sent = dict()  # num -> (type, arguments) waiting a response
+        self.renumbered = dict()  # num -> num of the request sent again
+        self.handles = dict()  # lost handle -> reopened one, see rebind
+        # smoothed round trip time of the deferred requests: it includes
+        # the time their responses wait before being read
+        self.rtt = None
+
+    def request(self, t, *args):
+        """Send the request and return its number."""
+        try:
+            num = self.client._async_request(self, t, *args)
+        except CONNECTION_ERRORS:
+            if self.lost is None or not self.lost():
+                raise
+            # the handles among args have been reopened meanwhile
+            args = self.remap(args)
+            num = self.client._async_request(self, t, *args)
+        self.sent[num] = (t, args)
+        return num
+
+    def defer(self, parse, t, *args):
+        """Send the request and return an SFTPDeferred of its response,
+        parsed by parse."""
+        deferred = SFTPDeferred(self.pump)
+        self.deferred[self.request(t, *args)] = (deferred, parse, time.time())
+        return deferred
+
+    def pump(self):
+        """Read the next response, reconnecting if the connection is lost."""
+        try:
+            self.client._read_response()
+        except CONNECTION_ERRORS:
+            if self.lost is None or not self.lost():
+                raise
+
+    def rebind(self, client, handles):
+        """Send the requests still waiting a response again, to client.
+
+        handles maps the handles of the lost connection
+        to the ones reopened on client.
         """
-        paramiko_mode = ''
-        if flags & os.O_WRONLY or (flags & os.O_WRONLY and flags & os.O_TRUNC):
-            paramiko_mode = 'w'
-        elif flags & os.O_RDWR and flags & os.O_APPEND:
-            paramiko_mode = 'a+'
-        elif flags & os.O_RDWR and flags & os.O_CREAT:
-            paramiko_mode = 'w+'
-        elif flags & os.O_APPEND:
-            paramiko_mode = 'a'
-        elif flags & os.O_RDWR and flags & os.O_TRUNC:
-            paramiko_mode = 'w+'
-        elif flags & os.O_RDWR:
-            paramiko_mode = 'r+'
-        elif flags & os.O_CREAT:
-            paramiko_mode = 'w'
-        else:  # OS.O_RDONLY fallback to read
-            paramiko_mode = 'r'
+        self.client = client
+        self.handles = handles
+        sent, self.sent = self.sent, dict()
+        for num in sorted(sent):
+            t, args = sent[num]
+            new = self.request(t, *self.remap(args))
+            if num in self.deferred:
+                self.deferred[new] = self.deferred.pop(num)
+            else:
+                self.renumbered[num] = new
 
-        if flags & os.O_CREAT and flags & os.O_EXCL:
-            paramiko_mode += 'x'
+    def remap(self, args):
+        """Replace the lost handles among args with the reopened ones."""
+        return tuple(
+            self.handles.get(arg, arg) if isinstance(arg, bytes) else arg
+            for arg in args
+        )
 
-        return paramiko_mode
+    def _async_response(self, t, msg, num):
+        """Called by Paramiko when a response is received."""
+        self.sent.pop(num, None)
+        if num not in self.deferred:
+            self.responses[num] = (t, msg)
+            return
+        deferred, parse, sent = self.deferred.pop(num)
+        rtt = time.time() - sent
+        self.rtt = rtt if self.rtt is None else 0.875 * self.rtt + 0.125 * rtt
+        try:
+            if t == CMD_STATUS:
+                self.client._convert_status(msg)
+            deferred.set_result(parse(t, msg))
+        except EOFError:  # only reads can hit the end of file
+            deferred.set_result(b'')
+        except Exception as e:
+            deferred.set_error(to_oserror(e))
+
+    def wait(self, num):
+        """Wait the response of the request num and return it.
+
+        An exception is raised if the response is an error status.
+        """
+        while True:
+            num = self.renumbered.pop(num, num)
+            if num in self.responses:
+                break
+            self.pump()
+        t, msg = self.responses.pop(num)
+        if t == CMD_STATUS:
+            self.client._convert_status(msg)
+        return t, msg
+
+    def map(self, requests, parse=None):
+        """Pipeline each request, a (type, arguments...) tuple.
+
+        Return the list of responses (parsed by parse, if given),
+        in the same order of requests.
+        The exception raised by a request replaces its response.
+        """
+        def result(num):
+            try:
+                response = self.wait(num)
+                return parse(*response) if parse else response
+            except Exception as e:
+                return to_oserror(e)
+
+        nums = deque()
+        results = list()
+        for request in requests:
+            if len(nums) >= self.window:
+                results.append(result(nums.popleft()))
+            nums.append(self.request(*request))
+        while nums:
+            results.append(result(nums.popleft()))
+        return results
+
+
+class ReadAhead(object):
+    """Read-ahead state of an handle.
+
+    Once the handle is read sequentially, the next chunks are
+    requested before the client asks for them.
+    """
+
+    def __init__(self, max_window):
+        self.max_window = max_window  # max number of chunks requested ahead
+        self.next = None  # offset of the next sequential read
+        self.size = None  # size of each read
+        self.ahead = 0  # end of the requested chunks
+        self.prefetched = dict()  # offset -> chunk (possibly deferred)
+        self.last = None  # time of the last read
+        self.interval = None  # smoothed interval between reads
+        self.eof = False
+
+    def update(self, off, size):
+        """Account for a read and return True if it is sequential."""
+        now = time.time()
+        sequential = off == self.next and size == self.size
+        if sequential:
+            interval = now - self.last
+            self.interval = interval if self.interval is None else \
+                0.875 * self.interval + 0.125 * interval
+            self.ahead = max(self.ahead, off + size)
+        else:
+            self.size = size
+            self.ahead = off + size
+            self.prefetched.clear()
+            self.interval = None
+            self.eof = False
+        self.next = off + size
+        self.last = now
+        return sequential
+
+    def window(self, rtt):
+        """Return the number of chunks to keep requested ahead:
+        enough to cover a round trip at the current read rate."""
+        if rtt is None or self.interval is None:
+            return min(4, self.max_window)
+        if self.interval <= 0:
+            return self.max_window
+        return max(1, min(self.max_window, int(rtt / self.interval) + 1))
+
+
+def set_security_options(transport, ciphers=None, macs=None, kex=None,
+                         compression=False):
+    """Prefer the given ciphers, MACs and key exchange algorithms
+    (the other ones are still accepted, with a lower priority),
+    and ask for compression if compression is True.
+
+    Must be called before the transport is started.
+    A ValueError is raised if an algorithm is not supported by Paramiko.
+    """
+    options = transport.get_security_options()
+    for name, preferred in (('ciphers', ciphers), ('digests', macs),
+                            ('kex', kex)):
+        if preferred:
+            default = getattr(options, name)
+            setattr(options, name, tuple(preferred) + tuple(
+                algorithm for algorithm in default
+                if algorithm not in preferred))
+    transport.use_compression(compression)
+
+
+class SSHConnector(object):
+    """Open authenticated transports to a remote server."""
 
     def __init__(self, remote,
                  key=None, port=None,
                  ssh_config_path=None, ssh_agent=False,
-                 known_hosts_path=None):
-        """Home sweet home.
+                 known_hosts_path=None, ciphers=None, macs=None, kex=None,
+                 compression=False, replicas=None, keepalive=0):
+        """Parse the ssh-url of the remote server and load the keys.
 
-        Init the transport and then the client.
+        ciphers, macs and kex are lists of the algorithms to prefer
+        (see set_security_options).
+        replicas is a list of hostnames to connect to, in order,
+        when the remote server can't be reached.
+        If keepalive is given, a keepalive is sent every keepalive seconds.
+        An SFTPConnectionError is raised if the keys can't be loaded.
         """
         if '@' in remote:
             self.username, self.hostname = remote.split('@', 1)
@@ -97,8 +333,9 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
             except Exception as e:
                 # it could be safe to continue anyway,
                 # because parameters could have been manually specified
-                print(
-                    "Error while parsing ssh_config file: {}. Trying to continue anyway...".format(e)
+                # (stdout is the SFTP session: don't write there)
+                sys.stderr.write(
+                    "Error while parsing ssh_config file: {}. Trying to continue anyway...\n".format(e)
                 )
 
         # Set default values
@@ -116,107 +353,466 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
 
                 if not self.pkeys:
                     agent.close()
-                    print(
-                        "SSH agent didn't provide any valid key. Trying to continue..."
+                    sys.stderr.write(
+                        "SSH agent didn't provide any valid key. Trying to continue...\n"
                     )
 
             except paramiko.SSHException:
                 agent.close()
-                print(
-                    "SSH agent speaks a non-compatible protocol. Ignoring it.")
+                sys.stderr.write(
+                    "SSH agent speaks a non-compatible protocol. Ignoring it.\n")
 
         if key and not self.password and not self.pkeys:
             key = os.path.expanduser(key)
             try:
                 self.pkeys.append(paramiko.RSAKey.from_private_key_file(key))
             except paramiko.PasswordRequiredException:
-                print("It seems that your private key is encrypted. Please configure me to use ssh_agent.")
-                sys.exit(1)
+                raise SFTPConnectionError(
+                    b"It seems that your private key is encrypted. Please configure me to use ssh_agent.")
             except Exception:
-                print(
-                    "Something went wrong while opening {}. Exiting.".format(
-                        key)
+                raise SFTPConnectionError(
+                    "Something went wrong while opening {}.".format(
+                        key).encode()
                 )
-                sys.exit(1)
         elif not key and not self.password and not self.pkeys:
-            print(
-                "You need to specify either a password, an identity or to enable the ssh-agent support."
+            raise SFTPConnectionError(
+                b"You need to specify either a password, an identity or to enable the ssh-agent support."
             )
-            sys.exit(1)
 
+        self.known_hosts_path = known_hosts_path
+        self.ciphers = ciphers
+        self.macs = macs
+        self.kex = kex
+        self.compression = compression
+        self.hosts = [self.hostname] + list(replicas or [])
+        self.current = 0  # index of the last host that could be reached
+        self.keepalive = keepalive
+
+    def connect(self):
+        """Open and authenticate a new transport to the remote server.
+
+        The replicas are tried in order, starting from the last host
+        that could be reached: the error of the last one is raised
+        if none of them can be.
+        """
+        for i in range(len(self.hosts)):
+            current = (self.current + i) % len(self.hosts)
+            try:
+                transport = self.connect_to(self.hosts[current])
+            except SFTPConnectionError as e:
+                error = e
+                continue
+            self.current = current
+            if self.keepalive:
+                transport.set_keepalive(self.keepalive)
+            return transport
+        raise error
+
+    def connect_to(self, hostname):
+        """Open and authenticate a new transport to hostname.
+
+        An SFTPConnectionError is raised on failure.
+        """
         try:
-            self.transport = paramiko.Transport((self.hostname, self.port))
+            transport = paramiko.Transport((hostname, self.port))
         except socket.gaierror:
-            print(
-                "Hostname not known. Are you sure you inserted it correctly?")
-            sys.exit(1)
+            raise SFTPConnectionError(
+                b"Hostname not known. Are you sure you inserted it correctly?")
+        except (socket.error, paramiko.SSHException) as e:
+            raise SFTPConnectionError(
+                "Can't connect to {}: {}.".format(hostname, e).encode())
 
         try:
-            self.transport.start_client()
+            set_security_options(
+                transport, self.ciphers, self.macs, self.kex, self.compression)
+        except ValueError:
+            transport.close()
+            raise SFTPConnectionError(
+                b"Some of the requested ciphers, MACs or key exchange algorithms are not supported.")
 
-            if known_hosts_path:
+        try:
+            transport.start_client()
+
+            if self.known_hosts_path:
                 known_hosts = paramiko.HostKeys()
                 known_hosts_path = os.path.realpath(
-                    os.path.expanduser(known_hosts_path))
+                    os.path.expanduser(self.known_hosts_path))
 
                 try:
                     known_hosts.load(known_hosts_path)
                 except IOError:
-                    print(
-                        "Error while loading known hosts file at {}. Exiting...".format(
-                            known_hosts_path)
+                    transport.close()
+                    raise SFTPConnectionError(
+                        "Error while loading known hosts file at {}.".format(
+                            known_hosts_path).encode()
                     )
-                    sys.exit(1)
 
-                ssh_host = self.hostname if self.port == 22 else "[{}]:{}".format(
-                    self.hostname, self.port)
-                pub_k = self.transport.get_remote_server_key()
+                ssh_host = hostname if self.port == 22 else "[{}]:{}".format(
+                    hostname, self.port)
+                pub_k = transport.get_remote_server_key()
                 if ssh_host in known_hosts.keys() and not known_hosts.check(ssh_host, pub_k):
-                    print(
+                    transport.close()
+                    raise SFTPConnectionError(
                         "Security warning: "
                         "remote key fingerprint {} for hostname "
-                        "{} didn't match the one in known_hosts {}. "
-                        "Exiting...".format(
+                        "{} didn't match the one in known_hosts {}.".format(
                             pub_k.get_base64(),
                             ssh_host,
-                            known_hosts.lookup(self.hostname),
-                        )
+                            known_hosts.lookup(hostname),
+                        ).encode()
                     )
-                    sys.exit(1)
 
             if self.password:
-                self.transport.auth_password(
+                transport.auth_password(
                     username=self.username,
                     password=self.password
                 )
             else:
                 for pkey in self.pkeys:
                     try:
-                        self.transport.auth_publickey(
+                        transport.auth_publickey(
                             username=self.username,
                             key=pkey
                         )
                         break
                     except paramiko.SSHException as e:
-                        print(
-                            "Authentication with identity {}... failed".format(
+                        # stdout could be the SFTP session, by now
+                        sys.stderr.write(
+                            "Authentication with identity {}... failed\n".format(
                                 pkey.get_base64()[:10]
                             )
                         )
                 else:  # none of the keys worked
                     raise paramiko.SSHException
         except paramiko.SSHException:
-            print(
-                "None of the provided authentication methods worked. Exiting."
+            transport.close()
+            raise SFTPConnectionError(
+                b"None of the provided authentication methods worked."
             )
-            self.transport.close()
-            sys.exit(1)
+        except socket.error as e:
+            transport.close()
+            raise SFTPConnectionError(
+                "Connection to {} lost: {}.".format(hostname, e).encode())
+
+        return transport
+
+
+class SFTPServerProxyStorage(SFTPAbstractServerStorage):
+    """Proxy SFTP storage.
+    Uses a Paramiko client to forward requests to another SFTP server.
+    """
 
-        self.client = paramiko.SFTPClient.from_transport(self.transport)
+    @staticmethod
+    def flags_to_mode(flags, mode):
+        """Convert:
+            os module flags and mode -> Paramiko file open mode.
+        Note: mode is ignored ATM.
+        """
+        paramiko_mode = ''
+        if flags & os.O_WRONLY or (flags & os.O_WRONLY and flags & os.O_TRUNC):
+            paramiko_mode = 'w'
+        elif flags & os.O_RDWR and flags & os.O_APPEND:
+            paramiko_mode = 'a+'
+        elif flags & os.O_RDWR and flags & os.O_CREAT:
+            paramiko_mode = 'w+'
+        elif flags & os.O_APPEND:
+            paramiko_mode = 'a'
+        elif flags & os.O_RDWR and flags & os.O_TRUNC:
+            paramiko_mode = 'w+'
+        elif flags & os.O_RDWR:
+            paramiko_mode = 'r+'
+        elif flags & os.O_CREAT:
+            paramiko_mode = 'w'
+        else:  # OS.O_RDONLY fallback to read
+            paramiko_mode = 'r'
 
-        # Let's retrieve the current dir
-        self.client.chdir('.')
-        self.home = self.client.getcwd()
+        if flags & os.O_CREAT and flags & os.O_EXCL:
+            paramiko_mode += 'x'
+
+        return paramiko_mode
+
+    def __init__(self, remote,
+                 key=None, port=None,
+                 ssh_config_path=None, ssh_agent=False,
+                 known_hosts_path=None, cache_size=0, cache_ttl=5,
+                 block_cache_size=0, block_cache_dir=None, readahead=16,
+                 write_window=64, channels=1, connections=1, broker=None,
+                 stripe_size=0, ciphers=None, macs=None, kex=None,
+                 compression=False, spool_dir=None, spool_workers=2,
+                 lazy=False, keepalive=0, replicas=None,
+                 reconnect_attempts=3):
+        """Home sweet home.
+
+        Init the transports and then the clients (see connect):
+        channels SFTP channels, over connections SSH connections.
+        If lazy is True, they are connected on the first request.
+        If broker is given, the channels are instead attached
+        to the broker listening at that unix socket path (see broker.py),
+        which already holds the authenticated transports.
+        ciphers, macs, kex and compression tune the negotiation
+        of the transports (see set_security_options).
+        replicas are the hostnames to fail over to, in order,
+        and keepalive the interval of the SSH keepalives
+        (see SSHConnector).
+        If the connection is lost, it is reconnected (see reconnect),
+        trying up to reconnect_attempts times.
+        If cache_size is given, up to cache_size remote attributes
+        are cached for cache_ttl seconds (0 disables the cache).
+        If block_cache_size is given, up to block_cache_size bytes
+        of the read files are cached in memory, and then spilled
+        to block_cache_dir (if given).
+        Up to readahead read requests are sent in advance
+        to the files read sequentially (0 disables it).
+        Up to write_window writes to each file are acknowledged
+        before the remote server does (0 disables it).
+        If stripe_size is given, the files are opened on every channel,
+        and their reads and writes are split into stripes of stripe_size
+        bytes, serviced in turn by each channel.
+        If spool_dir is given, the files opened for writing are staged
+        inside it, and uploaded by spool_workers background workers
+        once closed (see spool.py).
+        """
+        self.channels = max(1, channels)
+        self.connections = max(1, min(connections, self.channels))
+        self.broker = broker
+        self.connector = None
+        if not broker:
+            self.connector = SSHConnector(
+                remote, key, port,
+                ssh_config_path, ssh_agent, known_hosts_path,
+                ciphers, macs, kex, compression, replicas, keepalive
+            )
+        self.reconnect_attempts = reconnect_attempts
+        self.transports = list()
+        self.clients = list()
+        self.next_client = None
+        self.pipelines = dict()
+        self.opened = dict()  # (path, mode) of each open handle, to reopen it
+        self._home = None
+        # attributes of the last entry of each listing, until it is stat'ed
+        self.listed = dict()
+        self.cache = None
+        if cache_size and cache_ttl:
+            self.cache = SFTPAttributesCache(cache_size, cache_ttl)
+        self.paths = dict()  # path of each open handle
+        self.block_cache = None
+        if block_cache_size:
+            self.block_cache = SFTPBlockCache(
+                block_cache_size, spill_dir=block_cache_dir)
+        # (path, mtime, size) of the read-only handles, at open time
+        self.versions = dict()
+        self.fetching = dict()  # blocks requested for each handle
+        self.readahead = readahead
+        self.readaheads = dict()  # read-ahead state of the read-only handles
+        self.write_window = write_window
+        self.writes = dict()  # writes of each handle still to be acknowledged
+        self.stripe_size = stripe_size
+        self.stripes = dict()  # handles of each striped file, one per channel
+        self.spool = None
+        if spool_dir:
+            self.spool = SFTPUploadSpool(
+                spool_dir, self.new_client, spool_workers)
+
+        if not lazy:
+            self.connect()
+
+    def connect(self):
+        """Open the transports and then the clients.
+
+        The handles open on the previous clients, if any,
+        are reopened on the new ones (see reconnect).
+        """
+        previous = self.clients
+        transports = list()
+        try:
+            if self.broker:
+                # the broker lends its authenticated transports
+                clients = [
+                    paramiko.SFTPClient(attach(self.broker))
+                    for i in range(self.channels)
+                ]
+            else:
+                for i in range(self.connections):
+                    transports.append(self.connector.connect())
+                # handles are pinned to the client (i.e. the channel) they are
+                # opened on, while the other requests are spread over all of them
+                clients = [
+                    paramiko.SFTPClient.from_transport(
+                        transports[i % self.connections])
+                    for i in range(self.channels)
+                ]
+            # Let's retrieve the current dir (the same one, on reconnects)
+            for client in clients:
+                client.chdir(self._home or '.')
+        except Exception:
+            for transport in transports:
+                transport.close()
+            raise
+        if self._home is None:
+            self._home = clients[0].getcwd()
+        self.transports = transports
+        self.clients = clients
+        self.next_client = cycle(clients)
+
+        if not previous:
+            # reads and writes are forwarded without waiting the responses
+            self.pipelines = dict(
+                (client, PipelinedRequests(client, lost=self.reconnect))
+                for client in clients
+            )
+            return
+        handles = self.reopen(previous)
+        for old, client in zip(previous, clients):
+            pipeline = self.pipelines.pop(old)
+            pipeline.rebind(client, handles)
+            self.pipelines[client] = pipeline
+
+    def reopen(self, previous):
+        """Reopen the open handles of the previous clients on the new ones.
+
+        The handles are updated in place (the ones that can't be reopened
+        will fail on the remote server): return the map of their remote
+        handles, from the previous to the new ones.
+        """
+        handles = dict()
+        for handle, (path, mode) in self.opened.items():
+            client = self.clients[previous.index(handle.sftp)]
+            # don't truncate them again
+            mode = 'r+' if mode.startswith('w') else mode.replace('x', '')
+            try:
+                reopened = client.open(path, mode)
+            except IOError:
+                handle.sftp = client
+                continue
+            reopened._closed = True  # the remote handle now belongs to handle
+            handles[handle.handle] = reopened.handle
+            handle.sftp, handle.handle = client, reopened.handle
+        return handles
+
+    @staticmethod
+    def alive(client):
+        """Return whether the connection of client is still up."""
+        sock = client.sock
+        if isinstance(sock, paramiko.Channel):
+            transport = sock.get_transport()
+            return not sock.closed and transport is not None and \
+                transport.is_active()
+        try:
+            # a socket attached to the broker: it is readable once closed
+            readable, _, _ = select.select([sock], [], [], 0)
+            return not readable or sock.recv(1, socket.MSG_PEEK) != b''
+        except (socket.error, ValueError):
+            return False
+
+    def reconnect(self):
+        """Reconnect, if the connection has been lost.
+
+        The open handles are reopened, and the pipelined requests still
+        waiting a response are sent again: since each read and write
+        carries its own offset, the handles go on from where they were.
+        Up to reconnect_attempts attempts are made, waiting
+        1 second (doubled each time) in between.
+        Return whether the connection has been lost and reconnected.
+        """
+        if not self.reconnect_attempts or \
+                all(self.alive(client) for client in self.clients):
+            return False
+        for client in self.clients:
+            client.close()
+        for transport in self.transports:
+            transport.close()
+        delay = 1
+        for attempt in range(self.reconnect_attempts):
+            try:
+                self.connect()
+                return True
+            except (SFTPConnectionError, paramiko.SSHException,
+                    EnvironmentError, EOFError):
+                if attempt == self.reconnect_attempts - 1:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    @property
+    def home(self):
+        """The remote current dir."""
+        if self._home is None:
+            self.connect()
+        return self._home
+
+    def new_client(self):
+        """Open a new SFTP client, on a new channel."""
+        if not self.clients:
+            self.connect()
+        if self.broker:
+            return paramiko.SFTPClient(attach(self.broker))
+        return paramiko.SFTPClient.from_transport(self.transports[0])
+
+    def drain(self):
+        """Wait the staged uploads, if any.
+
+        Return the (kind, paths, exception) of the failed operations.
+        """
+        if not self.spool:
+            return list()
+        return self.spool.drain()
+
+    @property
+    def client(self):
+        """The client of the next request, in a round robin fashion."""
+        if not self.clients:
+            self.connect()
+        return next(self.next_client)
+
+    def pipeline(self, handle):
+        """Return the PipelinedRequests of the client of handle."""
+        return self.pipelines[handle.sftp]
+
+    def stripe(self, handle, off):
+        """Return the handle servicing the offset off of handle."""
+        stripes = self.stripes.get(handle)
+        if not stripes:
+            return handle
+        return stripes[(off // self.stripe_size) % len(stripes)]
+
+    def split(self, handle, off, size):
+        """Split the range of size bytes at offset off of handle
+        into (handle, offset, size) ranges, at the stripe boundaries."""
+        if handle not in self.stripes:
+            return [(handle, off, size)]
+        ranges = list()
+        end = off + size
+        while off < end:
+            stop = min(end, (off // self.stripe_size + 1) * self.stripe_size)
+            ranges.append((self.stripe(handle, off), off, stop - off))
+            off = stop
+        return ranges or [(handle, off, size)]
+
+    def path(self, filename):
+        """Return the normalized remote path of filename."""
+        return os.path.normpath(self.client._adjust_cwd(filename))
+
+    def invalidate(self, *filenames):
+        """Invalidate the cached attributes of filenames."""
+        if self.cache:
+            for filename in filenames:
+                if filename is not None:
+                    self.cache.invalidate(self.path(filename))
+
+    def invalidate_tree(self, *filenames):
+        """Invalidate the cached attributes of filenames and their content."""
+        if self.cache:
+            for filename in filenames:
+                self.cache.invalidate_tree(self.path(filename))
+
+    def cache_stats(self):
+        """Return a dictionary of (hits, misses, hit rate) of each cache."""
+        stats = dict()
+        if self.cache:
+            stats.update(self.cache.stats())
+        if self.block_cache:
+            stats.update(self.block_cache.stats())
+        return stats
 
     def verify(self, filename):
         """Verify that requested filename is accessible.
@@ -226,31 +822,29 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
         return True
 
     @exception_wrapper
+    @reconnecting
     def stat(self, filename, parent=None, lstat=False, fstat=False):
         """stat, lstat and fstat requests.
 
         Return a dictionary of stats.
         Filename is an handle in the fstat variant.
         """
+        if parent and not lstat:
+            listed = self.listed.pop(os.path.join(parent, filename), None)
+            if listed is not None:
+                return self.staged_stat(
+                    os.path.join(parent, filename), listed)
+
         if not lstat and fstat:
             # filename is an handle
             _stat = filename.stat()
-        elif lstat:
-            _stat = self.client.lstat(filename)
+        elif self.cache:
+            _stat = self.cached_stat(
+                filename if not parent else os.path.join(parent, filename),
+                lstat
+            )
         else:
-            try:
-                _stat = self.client.stat(
-                    filename if not parent
-                    else os.path.join(parent, filename)
-                )
-            except:
-                # we could have a broken symlink
-                # but lstat could be false:
-                # this happens in case of readdir responses
-                _stat = self.client.lstat(
-                    filename if not parent
-                    else os.path.join(parent, filename)
-                )
+            _stat = self.remote_stat(filename, parent, lstat)
 
         if fstat:
             longname = None  # not needed in case of fstat
@@ -259,6 +853,62 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
                 _stat, filename
             )
 
+        stats = self._attributes_to_dict(_stat, longname)
+        if fstat:
+            return stats
+        return self.staged_stat(
+            filename if not parent else os.path.join(parent, filename), stats)
+
+    def staged_stat(self, filename, stats):
+        """Replace the size and mtime in stats of filename
+        with the ones of its staged contents, if any:
+        the remote file could still be uploaded."""
+        if not self.spool:
+            return stats
+        staged = self.spool.stat(self.path(filename))
+        if staged is not None:
+            stats = dict(stats)
+            stats[b'size'], stats[b'mtime'] = staged
+        return stats
+
+    def remote_stat(self, filename, parent=None, lstat=False):
+        """stat or lstat request, sent to the remote server."""
+        if lstat:
+            return self.client.lstat(filename)
+        try:
+            return self.client.stat(
+                filename if not parent
+                else os.path.join(parent, filename)
+            )
+        except:
+            # we could have a broken symlink
+            # but lstat could be false:
+            # this happens in case of readdir responses
+            return self.client.lstat(
+                filename if not parent
+                else os.path.join(parent, filename)
+            )
+
+    def cached_stat(self, filename, lstat=False):
+        """Same as remote_stat, using the cache."""
+        path = self.path(filename)
+        if self.cache.missing.get(path):
+            raise OSError(errno.ENOENT, 'No such file')
+        _stat = self.cache.attrs.get((path, lstat))
+        if _stat is not None:
+            return _stat
+        try:
+            _stat = self.remote_stat(path, lstat=lstat)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                self.cache.missing.put(path, True)
+            raise
+        self.cache.attrs.put((path, lstat), _stat)
+        return _stat
+
+    @staticmethod
+    def _attributes_to_dict(_stat, longname=None):
+        """Convert Paramiko SFTPAttributes to a dictionary of stats."""
         return {
             b'size': _stat.st_size,
             b'uid': _stat.st_uid,
@@ -269,12 +919,70 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
             b'longname': longname
         }
 
+    def stat_many(self, filenames, lstat=False):
+        """stat (or lstat) many files at once.
+
+        The attributes are taken from the cache, if any: the other
+        requests are pipelined to the remote server. As in stat, the
+        broken symlinks are lstat'ed and the staged sizes are reported.
+        """
+        def parse(t, msg):
+            if t != CMD_ATTRS:
+                raise SFTPError('Expected attributes')
+            return paramiko.SFTPAttributes._from_msg(msg)
+
+        paths = [self.path(filename) for filename in filenames]
+        stats = [None] * len(paths)
+        if self.cache:
+            for i, path in enumerate(paths):
+                if self.cache.missing.get(path):
+                    stats[i] = OSError(errno.ENOENT, 'No such file')
+                else:
+                    stats[i] = self.cache.attrs.get((path, lstat))
+
+        misses = [i for i, _stat in enumerate(stats) if _stat is None]
+        client = self.client
+        results = self.pipelines[client].map(
+            ((CMD_LSTAT if lstat else CMD_STAT, paths[i]) for i in misses),
+            parse=parse
+        )
+        if not lstat:  # we could have some broken symlinks
+            failed = [
+                i for i, result in zip(misses, results)
+                if isinstance(result, Exception)
+            ]
+            lstats = dict(zip(failed, self.pipelines[client].map(
+                ((CMD_LSTAT, paths[i]) for i in failed), parse=parse)))
+            results = [lstats.get(i, result)
+                       for i, result in zip(misses, results)]
+        for i, result in zip(misses, results):
+            stats[i] = result
+            if not self.cache:
+                continue
+            if not isinstance(result, Exception):
+                self.cache.attrs.put((paths[i], lstat), result)
+            elif getattr(result, 'errno', None) == errno.ENOENT:
+                self.cache.missing.put(paths[i], True)
+
+        return [
+            _stat if isinstance(_stat, Exception)
+            else self.staged_stat(path, self._attributes_to_dict(_stat))
+            for path, _stat in zip(paths, stats)
+        ]
+
     @exception_wrapper
+    @reconnecting
     def setstat(self, filename, attrs, fsetstat=False):
         """setstat and fsetstat requests.
 
         Filename is an handle in the fstat variant.
         """
+        self.invalidate(self.paths.get(filename) if fsetstat else filename)
+        if self.spool and not fsetstat and \
+                self.spool.pending(self.path(filename)):
+            # after the staged operations on it
+            self.spool.setstat(self.path(filename), attrs)
+            return
 
         if b'size' in attrs and not fsetstat:
             self.client.truncate(filename, attrs[b'size'])
@@ -299,11 +1007,50 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
             filename.utime((attrs[b'atime'], attrs[b'mtime']))
 
     @exception_wrapper
+    @reconnecting
     def opendir(self, filename):
-        """Return an iterator over the files in filename."""
-        return (f.encode() for f in self.client.listdir(filename) + ['.', '..'])
+        """Return an iterator over the files in filename.
+
+        The attributes sent by the remote server are kept
+        until each file is stat'ed by the readdir request.
+        """
+        if not self.cache:
+            return self.listdir(filename, self.client.listdir_attr(filename))
+        path = self.path(filename)
+        entries = self.cache.dirs.get(path)
+        if entries is None:
+            entries = self.client.listdir_attr(filename)
+            self.cache.dirs.put(path, entries)
+            for attr in entries:  # readdir attributes are lstat ones
+                self.cache.attrs.put(
+                    (os.path.join(path, attr.filename.encode()), True), attr)
+        return self.listdir(filename, entries)
+
+    def listdir(self, dirname, entries):
+        """Yield the names of entries, keeping the attributes of the
+        last one in listed: the readdir request stats it right away,
+        the other walks just move on to the next one."""
+        path = None
+        try:
+            for attr in entries:
+                name = attr.filename.encode()
+                longname = getattr(attr, 'longname', None)
+                if longname:
+                    longname = longname.encode()
+                else:
+                    longname = stat_to_longname(attr, name)
+                path = os.path.join(dirname, name)
+                self.listed[path] = self._attributes_to_dict(attr, longname)
+                yield name
+                self.listed.pop(path, None)
+            for name in (b'.', b'..'):
+                yield name
+        finally:  # exhausted, or closed
+            if path is not None:
+                self.listed.pop(path, None)
 
     @exception_wrapper
+    @reconnecting_before
     def open(self, filename, flags, mode):
         """Return the file handle.
 
@@ -319,55 +1066,374 @@ class SFTPServerProxyStorage(SFTPAbstractServerStorage):
                 the file was created and did not previously exist.
         """
         paramiko_mode = SFTPServerProxyStorage.flags_to_mode(flags, mode)
-        return self.client.open(filename, paramiko_mode)
+        if paramiko_mode != 'r':
+            self.invalidate(filename)
+        if self.spool:
+            spooled = self.open_spooled(filename, paramiko_mode)
+            if spooled is not None:
+                return spooled
+        handle = self.client.open(filename, paramiko_mode)
+        self.opened[handle] = (self.path(filename), paramiko_mode)
+        if self.cache:
+            self.paths[handle] = filename
+        if self.block_cache and paramiko_mode == 'r':
+            _stat = handle.stat()
+            self.versions[handle] = \
+                (self.path(filename), _stat.st_mtime, _stat.st_size)
+        if self.readahead and paramiko_mode == 'r':
+            self.readaheads[handle] = ReadAhead(self.readahead)
+        if self.stripe_size and len(self.clients) > 1 and \
+                'a' not in paramiko_mode:
+            self.open_stripes(handle, filename, paramiko_mode)
+        return handle
+
+    def open_spooled(self, filename, paramiko_mode):
+        """Return a SpooledFile of filename, or None
+        if it is neither staged nor to be staged.
+
+        The files truncated by the open are staged: the remote one
+        is still opened (and closed) at once, so that its errors
+        are reported now.
+        """
+        path = self.path(filename)
+        if paramiko_mode == 'r':
+            return self.spool.lookup(path)
+        self.spool.settle(path)
+        if not paramiko_mode.startswith('w'):
+            return None
+        self.client.open(filename, paramiko_mode).close()
+        return self.spool.stage(path)
+
+    def open_stripes(self, handle, filename, paramiko_mode):
+        """Open filename again on the other channels, to stripe handle.
+
+        Read-only files smaller than a stripe are not striped.
+        """
+        if paramiko_mode == 'r':
+            version = self.versions.get(handle)
+            size = version[2] if version else handle.stat().st_size
+            if size <= self.stripe_size:
+                return
+        # the file has already been created (and truncated) by handle
+        mode = 'r' if paramiko_mode == 'r' else 'r+'
+        stripes = [handle]
+        try:
+            for client in self.clients:
+                if client is not handle.sftp:
+                    stripes.append(client.open(filename, mode))
+                    self.opened[stripes[-1]] = (self.path(filename), mode)
+        except IOError:
+            # e.g. a write-only file: just don't stripe it
+            for stripe in stripes[1:]:
+                self.opened.pop(stripe, None)
+                stripe.close()
+            return
+        self.stripes[handle] = stripes
 
     @exception_wrapper
+    @reconnecting_before
     def mkdir(self, filename, mode):
         """Create directory with given mode."""
+        self.invalidate(filename)
         self.client.mkdir(filename, mode)
 
     @exception_wrapper
+    @reconnecting_before
     def rmdir(self, filename):
         """Remove directory."""
+        self.invalidate_tree(filename)
+        if self.spool:
+            self.spool.settle(self.path(filename), tree=True)
         self.client.rmdir(filename)
 
     @exception_wrapper
+    @reconnecting_before
     def rm(self, filename):
         """Remove file."""
+        self.invalidate(filename)
+        if self.spool and self.spool.pending(self.path(filename)):
+            self.spool.remove(self.path(filename))
+            return
         self.client.remove(filename)
 
     @exception_wrapper
+    @reconnecting_before
     def rename(self, oldpath, newpath):
         """Move/rename file."""
+        self.invalidate_tree(oldpath, newpath)
+        if self.spooled_rename(oldpath, newpath):
+            return
         self.client.rename(oldpath, newpath)
 
     @exception_wrapper
+    @reconnecting_before
+    def posix_rename(self, oldpath, newpath):
+        """Move/rename file, atomically replacing newpath if it exists."""
+        self.invalidate_tree(oldpath, newpath)
+        if self.spooled_rename(oldpath, newpath, posix=True):
+            return
+        self.client.posix_rename(oldpath, newpath)
+
+    def spooled_rename(self, oldpath, newpath, posix=False):
+        """Queue the rename after the staged operations on the paths,
+        if any, and return whether it has been queued.
+
+        The renamed directories wait the staged operations inside them.
+        """
+        if not self.spool:
+            return False
+        oldpath, newpath = self.path(oldpath), self.path(newpath)
+        if self.spool.pending(oldpath) or self.spool.pending(newpath):
+            self.spool.rename(oldpath, newpath, posix)
+            return True
+        self.spool.settle(oldpath, tree=True)
+        return False
+
+    @exception_wrapper
+    @reconnecting_before
+    def hardlink(self, oldpath, newpath):
+        """Create newpath as an hard link to oldpath."""
+        self.invalidate(oldpath, newpath)  # the links count changes too
+        if self.spool:
+            self.spool.settle(self.path(oldpath))
+        self.client._request(
+            CMD_EXTENDED, 'hardlink@openssh.com',
+            self.client._adjust_cwd(oldpath),
+            self.client._adjust_cwd(newpath)
+        )
+
+    @exception_wrapper
+    @reconnecting_before
     def symlink(self, linkpath, targetpath):
         """Symlink file."""
+        self.invalidate(linkpath)
         self.client.symlink(targetpath, linkpath)
 
     @exception_wrapper
+    @reconnecting
     def readlink(self, filename):
         """Readlink of filename."""
         l = self.client.readlink(filename)
         return l.encode()
 
     def write(self, handle, off, chunk):
-        """Write chunk at offset of handle."""
-        try:
-            handle.seek(off)
-            handle.write(chunk)
-        except:
-            return False
-        else:
+        """Write chunk at offset of handle.
+
+        The request is forwarded without waiting the response:
+        up to write_window writes are acknowledged in advance,
+        and their errors are raised by a later write, fsync or close
+        of the same handle (as OpenSSH does).
+        """
+        def parse(t, msg):
             return True
 
+        if isinstance(handle, SpooledFile):
+            return handle.write(off, chunk)
+        self.invalidate(self.paths.get(handle))
+        handle.flush()
+        requests = [
+            self.pipeline(stripe).defer(
+                parse, CMD_WRITE, stripe.handle, int64(start),
+                chunk[start - off:start - off + size])
+            for stripe, start, size in self.split(handle, off, len(chunk))
+        ]
+        if not self.write_window:
+            return combine(requests, lambda *results: True)
+        self.acknowledge(handle)
+        writes = self.writes.setdefault(handle, deque())
+        writes.extend(requests)
+        while len(writes) > self.write_window:
+            writes.popleft().wait()
+        return True
+
+    def acknowledge(self, handle, wait=False):
+        """Forget the writes to handle acknowledged by the remote server,
+        raising the first error.
+
+        If wait is True, wait all of them.
+        """
+        writes = self.writes.get(handle)
+        while writes and (wait or writes[0].done):
+            writes.popleft().wait()
+
     def read(self, handle, off, size):
-        """Read from the handle size, starting from offset off."""
-        handle.seek(off)
-        return handle.read(size)
+        """Read from the handle size, starting from offset off.
+
+        If the handle is read sequentially, the next chunks
+        are requested in advance.
+        """
+        if isinstance(handle, SpooledFile):
+            return handle.read(off, size)
+        state = self.readaheads.get(handle)
+        if state is None:
+            return self.cached_read(handle, off, size)
+        sequential = state.update(off, size)
+        chunk = state.prefetched.pop(off, None)
+        if chunk is None:
+            chunk = self.cached_read(handle, off, size)
+        if not sequential:
+            return chunk
+
+        version = self.versions.get(handle)
+        for prefetched in [chunk] + list(state.prefetched.values()):
+            if isinstance(prefetched, SFTPDeferred):
+                if not prefetched.done:
+                    continue
+                prefetched = prefetched.result
+            if prefetched is None or len(prefetched) < size:
+                state.eof = True  # short read or error
+        if version is not None and state.ahead >= version[2]:
+            state.eof = True
+        window = state.window(self.pipeline(handle).rtt)
+        while not state.eof and len(state.prefetched) < window:
+            state.prefetched[state.ahead] = \
+                self.cached_read(handle, state.ahead, size)
+            state.ahead += size
+        return chunk
+
+    def cached_read(self, handle, off, size):
+        """Read from the handle size, starting from offset off.
+
+        The cached blocks of the file are served locally,
+        the missing ones are requested without waiting the responses.
+        """
+        version = self.versions.get(handle)
+        if version is None or off >= version[2]:
+            return self.remote_read(handle, off, size)
+
+        block_size = self.block_cache.block_size
+        end = min(off + size, version[2])
+        indexes = range(off // block_size, (end - 1) // block_size + 1)
+        fetching = self.fetching.setdefault(handle, dict())
+        blocks = list()
+        for index in indexes:
+            block = self.block_cache.get(version + (index,))
+            if block is None:
+                # pipelined reads often share the same block
+                block = fetching.get(index)
+            if block is None or getattr(block, 'error', None):
+                block = fetching[index] = self.remote_read(
+                    handle, index * block_size,
+                    min(block_size, version[2] - index * block_size))
+            blocks.append(block)
+
+        def assemble(*blocks):
+            data = list()
+            for index, block in zip(indexes, blocks):
+                complete = min(block_size, version[2] - index * block_size)
+                if fetching.pop(index, None) and len(block) == complete:
+                    self.block_cache.put(version + (index,), block)
+                data.append(block)
+                if len(block) < complete:
+                    break  # the file is shorter than it was
+            start = off - indexes[0] * block_size
+            return b''.join(data)[start:end - indexes[0] * block_size]
+
+        return combine(blocks, assemble)
+
+    def remote_read(self, handle, off, size):
+        """Forward the read request without waiting the response.
+
+        The reads of striped handles are split among their channels,
+        and the stripes joined back in order.
+        """
+        def parse(t, msg):
+            if t != CMD_DATA:
+                raise SFTPError('Expected data')
+            return msg.get_string()
+
+        def join(*chunks):
+            data = list()
+            for chunk, (_, _, size) in zip(chunks, ranges):
+                data.append(chunk)
+                if len(chunk) < size:
+                    break  # end of file
+            return b''.join(data)
+
+        handle.flush()
+        ranges = self.split(handle, off, size)
+        chunks = [
+            self.pipeline(stripe).defer(
+                parse, CMD_READ, stripe.handle, int64(start), int(size))
+            for stripe, start, size in ranges
+        ]
+        if len(chunks) == 1:
+            return chunks[0]
+        return combine(chunks, join)
+
+    @exception_wrapper
+    @reconnecting
+    def fsync(self, handle):
+        """Flush the handle contents to stable storage.
+
+        The staged files are flushed to the spool.
+        """
+        if isinstance(handle, SpooledFile):
+            return handle.fsync()
+        self.acknowledge(handle, wait=True)
+        handle.flush()
+        for stripe in self.stripes.get(handle, [handle]):
+            stripe.sftp._request(
+                CMD_EXTENDED, 'fsync@openssh.com', stripe.handle)
+
+    def fsync_many(self, handles):
+        """Flush many handles at once.
+
+        The fsync requests are pipelined (on the channel of each handle),
+        so that the whole group costs a single round trip
+        to the remote server.
+        """
+        unique = list()
+        errors = dict()
+        for handle in handles:
+            if handle in unique or handle in errors:
+                continue
+            try:
+                if isinstance(handle, SpooledFile):
+                    errors[handle] = handle.fsync()
+                    continue
+                self.acknowledge(handle, wait=True)
+                handle.flush()
+            except Exception as e:
+                errors[handle] = to_oserror(e)
+            else:
+                unique.append(handle)
+        fsyncs = [
+            combine([
+                self.pipeline(stripe).defer(
+                    lambda t, msg: None,
+                    CMD_EXTENDED, 'fsync@openssh.com', stripe.handle)
+                for stripe in self.stripes.get(handle, [handle])
+            ], lambda *results: None)
+            for handle in unique
+        ]
+        for handle, fsync in zip(unique, fsyncs):
+            try:
+                errors[handle] = fsync.wait()
+            except Exception as e:
+                errors[handle] = e
+        return [errors[handle] for handle in handles]
 
     @exception_wrapper
     def close(self, handle):
-        """Close the file handle."""
-        handle.close()
+        """Close the file handle.
+
+        The errors of the writes not yet acknowledged are raised.
+        The staged files are queued to be uploaded.
+        """
+        if isinstance(handle, SpooledFile):
+            return self.spool.close(handle)
+        self.paths.pop(handle, None)
+        self.versions.pop(handle, None)
+        self.fetching.pop(handle, None)
+        self.readaheads.pop(handle, None)
+        stripes = self.stripes.pop(handle, [handle])
+        try:
+            self.acknowledge(handle, wait=True)
+        finally:
+            self.writes.pop(handle, None)
+            for stripe in stripes:
+                self.opened.pop(stripe, None)
+            for stripe in stripes[1:]:
+                stripe.close()
+            handle.close()
@@ -13,3 +13,7 @@ class SFTPForbidden(SFTPException):
 
 class SFTPNotFound(SFTPException):
     pass
+
+
+class SFTPConnectionError(SFTPException):
+    pass
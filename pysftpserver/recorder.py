@@ -0,0 +1,224 @@
+"""Record the SFTP sessions, to replay them later (see replay.py).
+
+A recording starts with MAGIC, followed by records made of a kind byte and
+the microseconds elapsed since the previous record (a 32 bit integer):
+    REQUEST: the request, framed as it was received;
+    HANDLE: the id of a request (32 bit) and the handle returned to it,
+        so that the handles can be mapped when replaying.
+"""
+
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from pysftpserver.server import (SSH2_FXP_CLOSE, SSH2_FXP_EXTENDED,
+                                 SSH2_FXP_FSETSTAT, SSH2_FXP_FSTAT,
+                                 SSH2_FXP_HANDLE, SSH2_FXP_INIT,
+                                 SSH2_FXP_LSTAT, SSH2_FXP_MKDIR,
+                                 SSH2_FXP_OPEN, SSH2_FXP_OPENDIR,
+                                 SSH2_FXP_READ, SSH2_FXP_READDIR,
+                                 SSH2_FXP_READLINK, SSH2_FXP_REALPATH,
+                                 SSH2_FXP_REMOVE, SSH2_FXP_RENAME,
+                                 SSH2_FXP_RMDIR, SSH2_FXP_SETSTAT,
+                                 SSH2_FXP_STAT, SSH2_FXP_SYMLINK,
+                                 SSH2_FXP_WRITE)
+
+MAGIC = b'SFTPREC\x01'
+
+REQUEST = 0
+HANDLE = 1
+
+# the leading arguments of each request, up to its last path or handle:
+# 'paths' is a 32 bit count followed by that many paths
+ARGUMENTS = {
+    SSH2_FXP_OPEN: ('path', ),
+    SSH2_FXP_CLOSE: ('handle', ),
+    SSH2_FXP_READ: ('handle', ),
+    SSH2_FXP_WRITE: ('handle', ),
+    SSH2_FXP_LSTAT: ('path', ),
+    SSH2_FXP_FSTAT: ('handle', ),
+    SSH2_FXP_SETSTAT: ('path', ),
+    SSH2_FXP_FSETSTAT: ('handle', ),
+    SSH2_FXP_OPENDIR: ('path', ),
+    SSH2_FXP_READDIR: ('handle', ),
+    SSH2_FXP_REMOVE: ('path', ),
+    SSH2_FXP_MKDIR: ('path', ),
+    SSH2_FXP_RMDIR: ('path', ),
+    SSH2_FXP_REALPATH: ('path', ),
+    SSH2_FXP_STAT: ('path', ),
+    SSH2_FXP_RENAME: ('path', 'path'),
+    SSH2_FXP_READLINK: ('path', ),
+    SSH2_FXP_SYMLINK: ('path', 'path'),
+}
+
+EXTENDED_ARGUMENTS = {
+    b'posix-rename@openssh.com': ('path', 'path'),
+    b'hardlink@openssh.com': ('path', 'path'),
+    b'fsync@openssh.com': ('handle', ),
+    b'stat-many@unbit.com': ('int', 'paths'),
+    b'get-file@unbit.com': ('path', ),
+    b'get-files@unbit.com': ('paths', ),
+    b'put-file@unbit.com': ('path', ),
+    b'tar-open@unbit.com': ('path', ),
+    b'rmtree@unbit.com': ('path', ),
+    b'makedirs@unbit.com': ('path', ),
+    b'du@unbit.com': ('path', ),
+}
+
+
+def string(s):
+    return struct.pack('>I', len(s)) + s
+
+
+def parse_string(blob, off):
+    """Return the string at offset off of blob, and the offset after it."""
+    slen, = struct.unpack('>I', blob[off:off + 4])
+    return blob[off + 4:off + 4 + slen], off + 4 + slen
+
+
+def rewrite(msg, path=None, handle=None):
+    """Return the framed request msg, with each of its paths replaced
+    by path(p) and each of its handles by handle(h).
+
+    The requests with no path or handle are returned as they are.
+    """
+    msg_type, = struct.unpack('>B', msg[4:5])
+    if msg_type == SSH2_FXP_INIT:
+        return msg
+    off = 9
+    arguments = ARGUMENTS.get(msg_type, ())
+    if msg_type == SSH2_FXP_EXTENDED:
+        request, off = parse_string(msg, off)
+        arguments = EXTENDED_ARGUMENTS.get(request, ())
+    if not arguments:
+        return msg
+
+    body = [msg[4:off]]
+    for argument in arguments:
+        if argument == 'int':
+            body.append(msg[off:off + 4])
+            off += 4
+            continue
+        count = 1
+        if argument == 'paths':
+            count, = struct.unpack('>I', msg[off:off + 4])
+            body.append(msg[off:off + 4])
+            off += 4
+        for i in range(count):
+            value, off = parse_string(msg, off)
+            if argument == 'handle':
+                value = handle(value) if handle else value
+            else:
+                value = path(value) if path else value
+            body.append(string(value))
+    body.append(msg[off:])
+    body = b''.join(body)
+    return struct.pack('>I', len(body)) + body
+
+
+class Redactor(object):
+    """Replace each component of the paths with a keyed hash of it,
+    the same one for the same component: so the structure of the tree
+    is kept, but not the names."""
+
+    def __init__(self, key=None):
+        self.key = key or os.urandom(16)
+        self.names = dict()
+
+    def __call__(self, path):
+        return b'/'.join(
+            self.redact(name) if name not in (b'', b'.', b'..') else name
+            for name in path.split(b'/')
+        )
+
+    def redact(self, name):
+        if name not in self.names:
+            if len(self.names) > 65536:
+                self.names.clear()
+            self.names[name] = hmac.new(
+                self.key, name, hashlib.sha256).hexdigest()[:16].encode()
+        return self.names[name]
+
+
+class SFTPRecorder(object):
+    """Record the requests of a session in the file at path.
+
+    Once the recording reaches max_size bytes, the next records
+    are dropped. If redact is True, the paths are redacted (see Redactor).
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, redact=False):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        self.max_size = max_size
+        self.redactor = Redactor() if redact else None
+        self.last = time.time()
+        self.dropped = 0
+
+    def write(self, kind, data):
+        if self.size + 5 + len(data) > self.max_size:
+            self.dropped += 1
+            return
+        now = time.time()
+        delta = min(int((now - self.last) * 1000000), 0xffffffff)
+        self.last = now
+        self.file.write(struct.pack('>BI', kind, delta) + data)
+        self.size += 5 + len(data)
+
+    def request(self, msg):
+        """Record the framed request msg."""
+        if self.redactor:
+            msg = rewrite(msg, path=self.redactor)
+        self.write(REQUEST, msg)
+
+    def reply(self, msg):
+        """Record the reply msg (unframed), if it returns an handle."""
+        if msg[:1] != struct.pack('>B', SSH2_FXP_HANDLE):
+            return
+        sid, = struct.unpack('>I', msg[1:5])
+        handle, _ = parse_string(msg, 5)
+        self.write(HANDLE, struct.pack('>I', sid) + string(handle))
+
+    def close(self):
+        self.file.close()
+
+
+def recording_path(dirname):
+    """Return the path of a new recording inside dirname."""
+    return os.path.join(dirname, '{}-{}.sftprec'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+
+
+def read_recording(path):
+    """Yield the (seconds since the start, kind, data) of each record
+    of the recording at path.
+
+    data is the framed request, or the (request id, handle) tuple.
+    A truncated record at the end is ignored.
+    """
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if blob[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a recording'.format(path))
+    off = len(MAGIC)
+    elapsed = 0.0
+    while off + 9 <= len(blob):
+        kind, delta = struct.unpack('>BI', blob[off:off + 5])
+        off += 5
+        elapsed += delta / 1000000.0
+        if kind == REQUEST:
+            msg_len, = struct.unpack('>I', blob[off:off + 4])
+            data = blob[off:off + 4 + msg_len]
+            off += 4 + msg_len
+            if len(data) < 4 + msg_len:
+                return
+        else:
+            sid, = struct.unpack('>I', blob[off:off + 4])
+            handle, off = parse_string(blob, off + 4)
+            data = (sid, handle)
+            if off > len(blob):
+                return
+        yield elapsed, kind, data
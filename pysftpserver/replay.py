@@ -0,0 +1,233 @@
+"""Replay the recorded sessions (see recorder.py), for load testing.
+
+Each session is replayed against a new server process, whose standard input
+and output are connected to a socket pair (as sshd does with its pipes),
+serving its own scratch tree. Many of them can be replayed concurrently,
+either as fast as possible or at their original pace.
+
+The handles are mapped to the ones returned by the new server, and the
+paths inside the recorded prefixes are moved inside the scratch tree.
+"""
+
+import os
+import select
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from pysftpserver.metrics import NAMES
+from pysftpserver.recorder import (HANDLE, REQUEST, parse_string,
+                                   read_recording, rewrite)
+from pysftpserver.server import (SSH2_FX_EOF, SSH2_FX_OK, SSH2_FXP_EXTENDED,
+                                 SSH2_FXP_HANDLE, SSH2_FXP_INIT,
+                                 SSH2_FXP_STATUS, SSH2_FXP_VERSION)
+
+
+def fsencode(path):
+    """Return path as bytes, in the encoding of the file system
+    (os.fsencode is missing on Python 2)."""
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def spawn(argv):
+    """Spawn argv talking SFTP over its standard input and output.
+
+    Return the process and the other end of its socket pair.
+    """
+    ours, theirs = socket.socketpair()
+    # the other servers mustn't inherit ours (as on Python 2), or they
+    # would keep this session open
+    process = subprocess.Popen(
+        argv, stdin=theirs.fileno(), stdout=theirs.fileno(), close_fds=True)
+    theirs.close()
+    return process, ours
+
+
+class Replayer(object):
+    """Replay a recorded session against the server spawned with argv.
+
+    records are the records of the session (see read_recording).
+    The paths starting with one of prefixes are moved inside root.
+    Up to window requests are sent without waiting their replies.
+    If paced is True, each request is sent at its recorded time.
+    """
+
+    def __init__(self, records, argv, root=b'', prefixes=(), paced=False,
+                 window=64):
+        self.requests = [
+            (offset, msg) for offset, kind, msg in records if kind == REQUEST]
+        # request id -> handle it returned, when recorded
+        self.opens = dict(
+            msg for offset, kind, msg in records if kind == HANDLE)
+        self.argv = argv
+        self.root = root
+        self.prefixes = prefixes
+        self.paced = paced
+        self.window = window
+        self.handles = dict()  # recorded handle -> replayed one
+        self.opening = dict()  # request id -> recorded handle it opens
+        self.pending = dict()  # request id -> (name, time it was sent)
+        self.latencies = list()  # (name, seconds) of each request
+        self.errors = 0  # error statuses received
+        self.failure = None  # the exception that stopped the replay, if any
+        self.elapsed = None
+        self.sock = None
+        self.buffer = b''
+        self.initialized = False
+
+    def remap(self, path):
+        for prefix in self.prefixes:
+            if path == prefix or path.startswith(prefix + b'/'):
+                return self.root + path[len(prefix):]
+        return path
+
+    def handle(self, recorded):
+        """Return the replayed handle of the recorded one,
+        waiting for it if it is still being opened."""
+        while recorded in self.opening.values():
+            self.receive(None)
+        return self.handles.get(recorded, recorded)
+
+    def receive(self, timeout):
+        """Receive and account the replies, waiting up to timeout
+        seconds (forever if None)."""
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return
+        data = self.sock.recv(256 * 1024)
+        if not data:
+            raise EOFError('The server closed the session')
+        self.buffer += data
+        now = time.time()
+        while len(self.buffer) >= 5:
+            msg_len, msg_type = struct.unpack('>IB', self.buffer[:5])
+            if len(self.buffer) < 4 + msg_len:
+                break
+            msg = self.buffer[4:4 + msg_len]
+            self.buffer = self.buffer[4 + msg_len:]
+            if msg_type == SSH2_FXP_VERSION:
+                self.initialized = True
+                continue
+            sid, = struct.unpack('>I', msg[1:5])
+            if sid not in self.pending:
+                continue
+            name, sent = self.pending.pop(sid)
+            self.latencies.append((name, now - sent))
+            recorded = self.opening.pop(sid, None)
+            if msg_type == SSH2_FXP_HANDLE and recorded is not None:
+                self.handles[recorded] = parse_string(msg, 5)[0]
+            elif msg_type == SSH2_FXP_STATUS:
+                status, = struct.unpack('>I', msg[5:9])
+                if status not in (SSH2_FX_OK, SSH2_FX_EOF):
+                    self.errors += 1
+
+    def send(self, msg):
+        msg_type, = struct.unpack('>B', msg[4:5])
+        if msg_type == SSH2_FXP_INIT:
+            self.sock.sendall(msg)
+            while not self.initialized:
+                self.receive(None)
+            return
+        msg = rewrite(
+            msg, path=self.remap if self.prefixes else None,
+            handle=self.handle)
+        sid, = struct.unpack('>I', msg[5:9])
+        name = NAMES.get(msg_type, str(msg_type))
+        if msg_type == SSH2_FXP_EXTENDED:
+            name = parse_string(msg, 9)[0].decode('utf-8', 'replace')
+        if sid in self.opens:
+            self.opening[sid] = self.opens[sid]
+        self.pending[sid] = (name, time.time())
+        self.sock.sendall(msg)
+
+    def run(self):
+        process, self.sock = spawn(self.argv)
+        try:
+            start = time.time()
+            for offset, msg in self.requests:
+                if self.paced:
+                    while time.time() < start + offset:
+                        self.receive(max(0, start + offset - time.time()))
+                while len(self.pending) >= self.window:
+                    self.receive(None)
+                self.send(msg)
+            while self.pending:
+                self.receive(None)
+            self.elapsed = time.time() - start
+        except (EOFError, socket.error) as e:
+            self.failure = e
+        finally:
+            self.sock.close()
+            process.wait()
+        return self
+
+
+def replay(recordings, command, instances=1, scratch=None, seed=None,
+           prefixes=(), paced=False, window=64):
+    """Replay the recordings (paths) with instances concurrent servers,
+    each one replaying the next recording, in turn.
+
+    command is the list of arguments spawning a server: '{root}' is
+    replaced by the scratch tree of the instance, a new directory
+    inside scratch (a copy of seed, if given).
+    Return the Replayer of each instance, once they are done.
+    """
+    sessions = [list(read_recording(path)) for path in recordings]
+    prefixes = [os.path.normpath(fsencode(p)) for p in prefixes]
+    replayers = list()
+    for i in range(instances):
+        root = os.path.join(scratch, 'instance{}'.format(i))
+        if seed:
+            shutil.copytree(seed, root, symlinks=True)
+        else:
+            os.mkdir(root)
+        argv = [arg.replace('{root}', root) for arg in command]
+        replayers.append(Replayer(
+            sessions[i % len(sessions)], argv, fsencode(root), prefixes,
+            paced, window))
+
+    threads = [threading.Thread(target=r.run) for r in replayers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return replayers
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the sorted values."""
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summary(replayers, elapsed):
+    """Return the lines of a report of the replayers, that took
+    elapsed seconds overall."""
+    latencies = dict()  # name -> [seconds]
+    for replayer in replayers:
+        for name, latency in replayer.latencies:
+            latencies.setdefault(name, list()).append(latency)
+    requests = sum(len(values) for values in latencies.values())
+    errors = sum(replayer.errors for replayer in replayers)
+    lines = [
+        '{} sessions, {} requests in {:.2f} s: {:.0f} requests/s, {} errors'.format(
+            len(replayers), requests, elapsed, requests / elapsed, errors),
+    ]
+    lines.extend(
+        'session {} failed: {}'.format(i, replayer.failure)
+        for i, replayer in enumerate(replayers) if replayer.failure)
+    lines += [
+        '{:<28}{:>9}{:>10}{:>10}{:>10}'.format(
+            'request', 'count', 'p50 ms', 'p99 ms', 'max ms'),
+    ]
+    for name in sorted(latencies, key=lambda n: -len(latencies[n])):
+        values = sorted(latencies[name])
+        lines.append('{:<28}{:>9}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+            name, len(values), percentile(values, 50) * 1000,
+            percentile(values, 99) * 1000, values[-1] * 1000))
+    return lines
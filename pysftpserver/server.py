@@ -9,14 +9,21 @@ Python 2/3 compatibility:
     too.
 """
 
+import binascii
 import errno
 import os
 import select
 import struct
 import sys
+import time
+from collections import deque
 
 from pysftpserver.pysftpexceptions import (SFTPException, SFTPForbidden,
                                            SFTPNotFound)
+from pysftpserver.deferred import SFTPDeferred, resolve
+from pysftpserver.logger import (DEBUG, DISABLED, INFO, LEVEL_NAMES,
+                                 SFTPLogWriter)
+from pysftpserver.tarstream import SFTPTarStream
 
 SSH2_FX_OK = 0
 SSH2_FX_EOF = 1
@@ -53,6 +60,7 @@ SSH2_FXP_NAME = 104
 SSH2_FXP_ATTRS = 105
 
 SSH2_FXP_EXTENDED = 200
+SSH2_FXP_EXTENDED_REPLY = 201
 
 SSH2_FILEXFER_VERSION = 3
 
@@ -69,11 +77,54 @@ SSH2_FILEXFER_ATTR_PERMISSIONS = 0x00000004
 SSH2_FILEXFER_ATTR_ACMODTIME = 0x00000008
 SSH2_FILEXFER_ATTR_EXTENDED = 0x80000000
 
+# vendor extensions
+STAT_MANY_LSTAT = 0x00000001
+TAR_OPEN_GZIP = 0x00000001
+
+
+class TimedStorage(object):
+    """Forward each call to storage, adding its duration
+    to the storage_seconds of the server."""
+
+    def __init__(self, storage, server):
+        self.storage = storage
+        self.server = server
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if not callable(attribute):
+            return attribute
+        server = self.server
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                server.storage_seconds += time.time() - start
+        return timed
+
+
+class MeasuredRequest(object):
+    """A request measured for the metrics and the slow log,
+    from its dispatch until its reply is sent."""
+
+    def __init__(self, stats, fields, start, size):
+        self.stats = stats  # its RequestStats, with metrics
+        self.fields = fields  # its slow log fields, with the slow log
+        self.start = start
+        self.bytes_in = size
+        self.bytes_out = 0
+        self.storage_seconds = 0.0
+        self.deferred = False  # replied after its dispatch
+
 
 class SFTPServer(object):
 
     def __init__(self, storage, hook=None, logfile=None, fd_in=0, fd_out=1,
-                 raise_on_error=False):
+                 raise_on_error=False, fsync_group_commit=False,
+                 small_file_threshold=64 * 1024, recorder=None, metrics=None,
+                 log_level=INFO, slowlog=None):
         self.input_queue = b''
         self.output_queue = b''
         self.payload = b''
@@ -87,11 +138,40 @@ class SFTPServer(object):
         self.handles = dict()
         self.dirs = dict()  # keep the path of opened dirs to reconstruct it later
         self.files = dict()
+        self.streams = set()  # handles generated by the server itself
         self.handle_cnt = 0
         self.raise_on_error = raise_on_error
+        # with group commit, fsync requests are collected and
+        # committed together once the pending input has been processed
+        self.fsync_group_commit = fsync_group_commit
+        self.fsync_queue = list()
+        # replies waiting for the result of a storage call (see deferred.py)
+        self.deferred = deque()
+        self.max_deferred = 64
+        self.max_reply_size = 256 * 1024  # OpenSSH max packet size
+        # files up to this size can be read with a single request:
+        # the reply, with its headers, has to fit in max_reply_size
+        self.small_file_threshold = min(
+            small_file_threshold, self.max_reply_size - 1024)
+        # records the requests, to replay them (see recorder.py)
+        self.recorder = recorder
+        # measures the requests (see metrics.py)
+        self.metrics = metrics
+        # logs the slow requests (see slowlog.py)
+        self.slowlog = slowlog
+        # while measuring, the time spent in the storage calls of the
+        # request dispatched, and the MeasuredRequest being replied to
+        self.storage_seconds = 0.0
+        self.request = None
+        self.received_at = None  # when the input was last read
+        if metrics is not None or slowlog is not None:
+            self.storage = TimedStorage(storage, self)
+        # the lines below log_level are not even formatted
         self.logfile = None
+        self.log_level = DISABLED
         if logfile:
-            self.logfile = open(logfile, 'a')
+            self.logfile = SFTPLogWriter(open(logfile, 'a'))
+            self.log_level = log_level
             sys.stderr = self.logfile
 
     def new_handle(self, filename, flags=0, attrs=dict(), is_opendir=False):
@@ -115,6 +195,9 @@ class SFTPServer(object):
                 os_flags |= os.O_EXCL
             mode = attrs.get(b'perm', 0o666)
             handle = self.storage.open(filename, os_flags, mode)
+        return self.add_handle(handle, filename, is_opendir)
+
+    def add_handle(self, handle, filename, is_opendir=False):
         if self.handle_cnt == 0xffffffffffffffff:
             raise OverflowError()
         self.handle_cnt += 1
@@ -145,11 +228,12 @@ class SFTPServer(object):
             return self.files[handle_id], False
         return None, None
 
-    def log(self, txt):
-        if not self.logfile:
+    def log(self, txt, level=INFO):
+        if level < self.log_level:
             return
-        self.logfile.write(txt + '\n')
-        self.logfile.flush()
+        self.logfile.write('%s %s %s\n' % (
+            time.strftime('%Y-%m-%d %H:%M:%S'), LEVEL_NAMES.get(level, level),
+            txt))
 
     def consume_int(self):
         value, = struct.unpack('>I', self.payload[0:4])
@@ -194,7 +278,9 @@ class SFTPServer(object):
         return attrs
 
     def consume_filename(self, default=None):
-        filename = self.consume_string()
+        return self.verify_filename(self.consume_string(), default)
+
+    def verify_filename(self, filename, default=None):
         if filename == b'.':
             filename = self.storage.home.encode()
         elif len(filename) == 0:
@@ -222,81 +308,262 @@ class SFTPServer(object):
     def send_msg(self, msg):
         msg_len = struct.pack('>I', len(msg))
         self.output_queue += msg_len + msg
+        if self.request is not None:
+            self.request.bytes_out += len(msg_len) + len(msg)
+        if self.recorder is not None:
+            self.recorder.reply(msg)
 
     def send_status(self, sid, status, exc=None):
         if status != SSH2_FX_OK and self.raise_on_error:
             if exc:
                 raise exc
             raise SFTPException()
-        self.log("sending status %d" % status)
+        if status not in (SSH2_FX_OK, SSH2_FX_EOF) and \
+                self.request is not None and self.request.stats is not None:
+            self.metrics.error(self.request.stats)
+        if self.log_level <= DEBUG:
+            self.log("sending status %d" % status, DEBUG)
         msg = struct.pack('>BII', SSH2_FXP_STATUS, sid, status)
         if exc and exc.msg:
             msg += struct.pack('>I', len(exc.msg)) + exc.msg
             msg += struct.pack('>I', 0)
         self.send_msg(msg)
 
+    def error_status(self, exc):
+        """Return the status corresponding to the exception exc."""
+        if isinstance(exc, SFTPForbidden):
+            return SSH2_FX_PERMISSION_DENIED
+        if isinstance(exc, SFTPNotFound):
+            return SSH2_FX_NO_SUCH_FILE
+        if isinstance(exc, OSError) and exc.errno == errno.ENOENT:
+            return SSH2_FX_NO_SUCH_FILE
+        return SSH2_FX_FAILURE
+
+    def send_error(self, sid, exc):
+        """Send the status corresponding to the exception exc."""
+        status = self.error_status(exc)
+        if isinstance(exc, (SFTPForbidden, SFTPNotFound)):
+            self.send_status(sid, status, exc)
+        elif status == SSH2_FX_NO_SUCH_FILE:
+            self.send_status(sid, status, SFTPNotFound())
+        else:
+            self.send_status(sid, status)
+
     def send_data(self, sid, buf, size):
         msg = struct.pack('>BII', SSH2_FXP_DATA, sid, size)
         msg += buf
         self.send_msg(msg)
 
     def run(self):
-        while True:
-            if self.run_once():
-                return
+        try:
+            while True:
+                if self.run_once():
+                    return
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.metrics is not None:
+                self.metrics.close()
+            if self.slowlog is not None:
+                self.slowlog.close()
+            if self.logfile is not None:
+                self.logfile.close()
 
     def run_once(self):
         wait_write = []
         if len(self.output_queue) > 0:
             wait_write = [self.fd_out]
-        rlist, wlist, xlist = select.select([self.fd_in], wait_write, [])
+        # pending replies are sent as soon as no more input is ready
+        timeout = 0 if self.pending() else None
+        if self.metrics is not None:
+            self.metrics.tick()
+            if timeout is None:
+                timeout = self.metrics.interval
+        rlist, wlist, xlist = select.select(
+            [self.fd_in], wait_write, [], timeout)
         if self.fd_in in rlist:
             buf = os.read(self.fd_in, self.buffer_size)
             if len(buf) <= 0:
                 return True
+            if self.slowlog is not None:
+                self.received_at = time.time()
             self.input_queue += buf
-            self.process()
+            self.process(flush=False)
+        elif self.pending():
+            self.flush()
         if self.fd_out in wlist:
             rlen = os.write(self.fd_out, self.output_queue)
             if rlen <= 0:
                 return True
             self.output_queue = self.output_queue[rlen:]
 
-    def process(self):
+    def process(self, flush=True):
+        """Process the messages in the input queue.
+
+        If flush is False, the pending replies are not sent yet.
+        """
         while True:
             if len(self.input_queue) < 5:
-                return
+                break
             msg_len, msg_type = struct.unpack('>IB', self.input_queue[0:5])
             if len(self.input_queue) < msg_len + 4:
-                return
+                break
+            if self.recorder is not None:
+                self.recorder.request(self.input_queue[:msg_len + 4])
             self.payload = self.input_queue[5:4 + msg_len]
             self.input_queue = self.input_queue[msg_len + 4:]
             if msg_type == SSH2_FXP_INIT:
                 msg = struct.pack(
                     '>BI', SSH2_FXP_VERSION, SSH2_FILEXFER_VERSION)
+                for name in sorted(self.extended_table.keys()):
+                    msg += struct.pack('>I', len(name)) + name
+                    msg += struct.pack('>I', 1) + b'1'  # extension version
                 self.send_msg(msg)
                 if self.hook:
                     self.hook.init()
             else:
                 msg_id = self.consume_int()
-                if msg_type in list(self.table.keys()):
-                    try:
-                        self.table[msg_type](self, msg_id)
-                    except SFTPForbidden as e:
-                        self.send_status(msg_id, SSH2_FX_PERMISSION_DENIED, e)
-                    except SFTPNotFound as e:
-                        self.send_status(msg_id, SSH2_FX_NO_SUCH_FILE, e)
-                    except OSError as e:
-                        if e.errno == errno.ENOENT:
-                            self.send_status(
-                                msg_id, SSH2_FX_NO_SUCH_FILE, SFTPNotFound()
-                            )
-                        else:
-                            self.send_status(msg_id, SSH2_FX_FAILURE)
-                    except Exception as e:
-                        self.send_status(msg_id, SSH2_FX_FAILURE)
+                if self.metrics is None and self.slowlog is None:
+                    self.dispatch(msg_type, msg_id)
+                else:
+                    self.measure(msg_type, msg_id, msg_len + 4)
+        if flush:
+            self.flush()
+
+    def dispatch(self, msg_type, sid):
+        """Handle the request msg_type sid, whose arguments are
+        in the payload."""
+        if msg_type in list(self.table.keys()):
+            try:
+                self.table[msg_type](self, sid)
+            except Exception as e:
+                self.send_error(sid, e)
+        else:
+            self.send_status(sid, SSH2_FX_OP_UNSUPPORTED)
+
+    def measure(self, msg_type, sid, size):
+        """Dispatch the request msg_type sid (of size bytes), measuring it
+        for the metrics and the slow log."""
+        stats = fields = None
+        if self.metrics is not None:
+            stats = self.metrics.begin(msg_type, self.payload)
+        if self.slowlog is not None:
+            fields = self.slowlog.describe(self, msg_type, self.payload)
+            fields['id'] = sid
+            fields['input_queue_bytes'] = len(self.input_queue)
+            fields['output_queue_bytes'] = len(self.output_queue)
+            fields['pending_replies'] = \
+                len(self.deferred) + len(self.fsync_queue)
+        self.storage_seconds = 0.0
+        start = time.time()
+        if fields is not None:
+            fields['queued_ms'] = round(
+                (start - (self.received_at or start)) * 1000, 3)
+        request = self.request = MeasuredRequest(stats, fields, start, size)
+        try:
+            self.dispatch(msg_type, sid)
+        finally:
+            self.request = None
+            request.storage_seconds = self.storage_seconds
+            # the deferred replies are accounted once sent
+            if not request.deferred:
+                self.account(request, time.time())
+
+    def account(self, request, now):
+        """Record the MeasuredRequest request, replied at now."""
+        elapsed = now - request.start
+        if request.stats is not None:
+            self.metrics.end(request.stats, request.bytes_in,
+                             request.bytes_out, elapsed,
+                             request.storage_seconds)
+        if request.fields is not None:
+            self.slowlog.check(request.fields, elapsed,
+                               request.storage_seconds)
+
+    def defer(self):
+        """Return the MeasuredRequest being dispatched, if any,
+        marked as replied later."""
+        request = self.request
+        if request is not None:
+            request.deferred = True
+            if request.fields is not None:
+                request.fields['deferred'] = True
+        return request
+
+    def pending(self):
+        """Return True if some replies are still pending."""
+        return bool(self.deferred or self.fsync_queue)
+
+    def flush(self):
+        """Send the pending replies."""
+        while self.deferred:
+            self.send_deferred(*self.deferred.popleft())
+        if self.fsync_queue:
+            self.commit_fsyncs()
+
+    def reply(self, sid, result, send):
+        """Send the reply to sid by calling send(sid, result).
+
+        If result is an SFTPDeferred, the reply is sent once it is
+        available: at most max_deferred replies are kept waiting.
+        """
+        if not isinstance(result, SFTPDeferred):
+            send(sid, result)
+            return
+        self.deferred.append((sid, result, send, self.defer()))
+        if len(self.deferred) > self.max_deferred:
+            self.send_deferred(*self.deferred.popleft())
+
+    def send_deferred(self, sid, deferred, send, request=None):
+        """Wait the deferred result and send its reply.
+
+        request is the MeasuredRequest of the request, when measured:
+        the time waited counts as storage time.
+        """
+        # it could be sent while dispatching another request
+        previous, self.request = self.request, request
+        waited = time.time()
+        try:
+            try:
+                result = deferred.wait()
+            except Exception as e:
+                self.send_error(sid, e)
+            else:
+                send(sid, result)
+        finally:
+            self.request = previous
+            if request is not None:
+                now = time.time()
+                request.storage_seconds += now - waited
+                self.account(request, now)
+
+    def commit_fsyncs(self):
+        """Commit the queued fsync requests with a single storage call."""
+        queue, self.fsync_queue = self.fsync_queue, list()
+        # it could be committed while dispatching another request
+        previous, self.request = self.request, None
+        storage_seconds = self.storage_seconds
+        start = time.time()
+        try:
+            errors = self.storage.fsync_many(
+                [handle for sid, handle, request in queue])
+        except Exception as e:
+            errors = [e] * len(queue)
+        committed = time.time()
+        self.storage_seconds = storage_seconds
+        try:
+            for (sid, handle, request), error in zip(queue, errors):
+                self.request = request
+                if error is None:
+                    self.send_status(sid, SSH2_FX_OK)
                 else:
-                    self.send_status(msg_id, SSH2_FX_OP_UNSUPPORTED)
+                    self.send_error(sid, error)
+                if request is not None:
+                    # each fsync waited the whole commit
+                    request.storage_seconds += committed - start
+                    self.account(request, time.time())
+        finally:
+            self.request = previous
 
     def send_dummy_item(self, sid, item, filename):
         # In case of readlink responses
@@ -404,12 +671,22 @@ class SFTPServer(object):
         if self.hook:
             self.hook.close(handle_id)
         handle = self.handles[handle_id]
-        self.storage.close(handle)
-        del(self.handles[handle_id])
+        if self.pending():
+            # the handle could still have to be synced or written
+            self.flush()
         try:
-            del(self.dirs[handle_id])
-        except KeyError:
-            pass  # dir was not open
+            if handle_id in self.streams:
+                self.streams.remove(handle_id)
+                handle.close()
+            else:
+                self.storage.close(handle)
+        finally:
+            # the handle is gone even if closing it failed
+            del(self.handles[handle_id])
+            try:
+                del(self.dirs[handle_id])
+            except KeyError:
+                pass  # dir was not open
         self.send_status(sid, SSH2_FX_OK)
 
     def _open(self, sid):
@@ -429,7 +706,13 @@ class SFTPServer(object):
         size = self.consume_int()
         if self.hook:
             self.hook.read(handle_id, off, size)
-        chunk = self.storage.read(handle, off, size)
+        if handle_id in self.streams:
+            chunk = handle.read(off, size)
+        else:
+            chunk = self.storage.read(handle, off, size)
+        self.reply(sid, chunk, self.send_chunk)
+
+    def send_chunk(self, sid, chunk):
         if len(chunk) == 0:
             self.send_status(sid, SSH2_FX_EOF)
         elif len(chunk) > 0:
@@ -443,7 +726,11 @@ class SFTPServer(object):
         chunk = self.consume_string()
         if self.hook:
             self.hook.write(handle_id, off, chunk)
-        if self.storage.write(handle, off, chunk):
+        self.reply(sid, self.storage.write(handle, off, chunk),
+                   self.send_written)
+
+    def send_written(self, sid, written):
+        if written:
             self.send_status(sid, SSH2_FX_OK)
         else:
             self.send_status(sid, SSH2_FX_FAILURE)
@@ -496,6 +783,245 @@ class SFTPServer(object):
         link = self.storage.readlink(filename)
         self.send_dummy_item(sid, link, filename)
 
+    def _extended(self, sid):
+        request = self.consume_string()
+        if request not in self.extended_table:
+            self.send_status(sid, SSH2_FX_OP_UNSUPPORTED)
+            return
+        self.extended_table[request](self, sid)
+
+    def _posix_rename(self, sid):
+        oldpath = self.consume_filename()
+        newpath = self.consume_filename()
+        if self.hook:
+            self.hook.posix_rename(oldpath, newpath)
+        self.storage.posix_rename(oldpath, newpath)
+        self.send_status(sid, SSH2_FX_OK)
+
+    def _hardlink(self, sid):
+        oldpath = self.consume_filename()
+        newpath = self.consume_filename()
+        if self.hook:
+            self.hook.hardlink(oldpath, newpath)
+        self.storage.hardlink(oldpath, newpath)
+        self.send_status(sid, SSH2_FX_OK)
+
+    def _fsync(self, sid):
+        handle, handle_id = self.consume_handle_and_id()
+        if self.hook:
+            self.hook.fsync(handle_id)
+        if self.fsync_group_commit:
+            self.fsync_queue.append((sid, handle, self.defer()))
+            return
+        self.storage.fsync(handle)
+        self.send_status(sid, SSH2_FX_OK)
+
+    def read_small_file(self, filename):
+        """Read the whole content of a small file.
+
+        Returns:
+            dict: The stats of the file.
+            bytes: The file content.
+
+        Raises:
+            SFTPException: If the file is bigger than small_file_threshold.
+        """
+        limit = self.small_file_threshold
+        handle = self.storage.open(filename, os.O_RDONLY, 0)
+        try:
+            attrs = self.storage.stat(handle, fstat=True)
+            data = b''
+            if attrs[b'size'] <= limit:
+                while len(data) <= limit:
+                    chunk = resolve(self.storage.read(
+                        handle, len(data), limit + 1 - len(data)))
+                    if not chunk:
+                        break
+                    data += chunk
+        finally:
+            self.storage.close(handle)
+        if attrs[b'size'] > limit or len(data) > limit:
+            raise SFTPException(b'File too large')
+        attrs[b'size'] = len(data)
+        return attrs, data
+
+    def write_small_file(self, filename, attrs, data):
+        """Atomically replace filename with data.
+
+        The data is written to a temporary file inside the same directory,
+        which is then renamed to filename.
+        """
+        head, tail = os.path.split(filename)
+        tmpname = self.verify_filename(os.path.join(
+            head,
+            b'.' + tail + b'.' + binascii.hexlify(os.urandom(4)) + b'.part'
+        ))
+        handle = self.storage.open(
+            tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+            attrs.get(b'perm', 0o666)
+        )
+        try:
+            try:
+                if data and not resolve(
+                        self.storage.write(handle, 0, data)):
+                    raise SFTPException()
+            finally:
+                self.storage.close(handle)
+            attrs = dict(
+                (k, v) for k, v in attrs.items()
+                if k not in (b'size', b'perm', b'extended')
+            )
+            if attrs:
+                self.storage.setstat(tmpname, attrs)
+            self.storage.posix_rename(tmpname, filename)
+        except Exception:
+            try:
+                self.storage.rm(tmpname)
+            except Exception:
+                pass
+            raise
+
+    def _get_file(self, sid):
+        filename = self.consume_filename()
+        if self.hook:
+            self.hook.get_file(filename)
+        attrs, data = self.read_small_file(filename)
+        msg = struct.pack('>BI', SSH2_FXP_EXTENDED_REPLY, sid)
+        msg += self.encode_attrs(attrs)
+        msg += struct.pack('>I', len(data)) + data
+        self.send_msg(msg)
+
+    def _get_files(self, sid):
+        count = self.consume_int()
+        msg = b''
+        served = 0
+        # the length, type, id and count come first
+        max_size = self.max_reply_size - 13
+        for i in range(count):
+            try:
+                filename = self.consume_filename()
+                if self.hook:
+                    self.hook.get_file(filename)
+                attrs, data = self.read_small_file(filename)
+                entry = struct.pack('>I', SSH2_FX_OK)
+                entry += self.encode_attrs(attrs)
+                entry += struct.pack('>I', len(data)) + data
+            except Exception as e:
+                entry = struct.pack('>I', self.error_status(e))
+            if served and len(msg) + len(entry) > max_size:
+                break  # the client will ask again for the remaining ones
+            msg += entry
+            served += 1
+        self.send_msg(
+            struct.pack('>BII', SSH2_FXP_EXTENDED_REPLY, sid, served) + msg
+        )
+
+    def _put_file(self, sid):
+        filename = self.consume_filename()
+        attrs = self.consume_attrs()
+        data = self.consume_string()
+        if self.hook:
+            self.hook.put_file(filename, attrs, data)
+        self.write_small_file(filename, attrs, data)
+        self.send_status(sid, SSH2_FX_OK)
+
+    def _tar_open(self, sid):
+        filename = self.consume_filename()
+        flags = self.consume_int()
+        if self.hook:
+            self.hook.tar_open(filename, flags)
+        stream = SFTPTarStream(
+            self.storage, filename,
+            verify=self.verify_filename,
+            compress=bool(flags & TAR_OPEN_GZIP)
+        )
+        handle_id = self.add_handle(stream, filename)
+        self.streams.add(handle_id)
+        msg = struct.pack('>BII', SSH2_FXP_HANDLE, sid, len(handle_id))
+        msg += handle_id
+        self.send_msg(msg)
+
+    def _rmtree(self, sid):
+        filename = self.consume_filename()
+        if self.hook:
+            self.hook.rmtree(filename)
+        removed, errors = self.storage.rmtree(filename)
+        if self.log_level <= INFO:
+            self.log("rmtree: %d entries removed, %d failures" % (
+                removed, len(errors)))
+        msg = struct.pack(
+            '>BIQI', SSH2_FXP_EXTENDED_REPLY, sid, removed, len(errors))
+        # the length, type, id, counts and the reported count
+        size = 4 + len(msg) + 4
+        failures = list()
+        for path, e in errors:
+            entry = struct.pack('>I', len(path)) + path + struct.pack(
+                '>I', self.error_status(e))
+            if size + len(entry) > self.max_reply_size:
+                break
+            failures.append(entry)
+            size += len(entry)
+        self.send_msg(
+            msg + struct.pack('>I', len(failures)) + b''.join(failures))
+
+    def _makedirs(self, sid):
+        filename = self.consume_filename()
+        attrs = self.consume_attrs()
+        if self.hook:
+            self.hook.makedirs(filename, attrs)
+        self.storage.makedirs(
+            filename,
+            attrs.get(b'perm', 0o777)
+        )
+        self.send_status(sid, SSH2_FX_OK)
+
+    def _disk_usage(self, sid):
+        filename = self.consume_filename()
+        if self.hook:
+            self.hook.disk_usage(filename)
+        usage = self.storage.disk_usage(filename)
+        msg = struct.pack(
+            '>BIQQQ', SSH2_FXP_EXTENDED_REPLY, sid,
+            usage[b'size'], usage[b'files'], usage[b'dirs']
+        )
+        self.send_msg(msg)
+
+    def _stat_many(self, sid):
+        flags = self.consume_int()
+        # each path takes 4 bytes at least, each stat 36 bytes at most
+        # (after the length, type, id and count): the client will ask
+        # again for the paths not served
+        count = min(
+            self.consume_int(),
+            len(self.payload) // 4,
+            (self.max_reply_size - 13) // (4 + 32)
+        )
+        results = list()
+        filenames = list()
+        for i in range(count):
+            if not self.payload:
+                break
+            try:
+                filenames.append(self.consume_filename())
+                results.append(None)
+            except Exception as e:
+                results.append(e)  # e.g. forbidden path
+        lstat = bool(flags & STAT_MANY_LSTAT)
+        if self.hook:
+            self.hook.stat_many(filenames, lstat)
+        stats = iter(self.storage.stat_many(filenames, lstat=lstat))
+        entries = [
+            struct.pack('>BII', SSH2_FXP_EXTENDED_REPLY, sid, len(results))]
+        for result in results:
+            if result is None:
+                result = next(stats)
+            if isinstance(result, Exception):
+                entries.append(struct.pack('>I', self.error_status(result)))
+            else:
+                entries.append(struct.pack('>I', SSH2_FX_OK))
+                entries.append(self.encode_attrs(result))
+        self.send_msg(b''.join(entries))
+
     table = {
         SSH2_FXP_REALPATH: _realpath,
         SSH2_FXP_LSTAT: _lstat,
@@ -514,5 +1040,20 @@ class SFTPServer(object):
         SSH2_FXP_FSETSTAT: _fsetstat,
         SSH2_FXP_RENAME: _rename,
         SSH2_FXP_SYMLINK: _symlink,
-        SSH2_FXP_READLINK: _readlink
+        SSH2_FXP_READLINK: _readlink,
+        SSH2_FXP_EXTENDED: _extended
+    }
+
+    extended_table = {
+        b'posix-rename@openssh.com': _posix_rename,
+        b'hardlink@openssh.com': _hardlink,
+        b'fsync@openssh.com': _fsync,
+        b'stat-many@unbit.com': _stat_many,
+        b'get-file@unbit.com': _get_file,
+        b'get-files@unbit.com': _get_files,
+        b'put-file@unbit.com': _put_file,
+        b'tar-open@unbit.com': _tar_open,
+        b'rmtree@unbit.com': _rmtree,
+        b'makedirs@unbit.com': _makedirs,
+        b'du@unbit.com': _disk_usage
     }
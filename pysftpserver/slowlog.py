@@ -0,0 +1,99 @@
+"""Log the requests slower than a threshold, as JSON lines.
+
+Each line describes a request that took at least threshold seconds from
+its dispatch to its reply (see SFTPServer.measure), e.g.:
+    {"time": "2016-01-01T12:00:00", "request": "READ", "id": 42,
+     "path": "/srv/alice/big.iso", "handle": "3", "offset": 1048576,
+     "size": 32768, "total_ms": 1520.3, "storage_ms": 1519.8,
+     "protocol_ms": 0.5, "queued_ms": 0.1, "input_queue_bytes": 65600,
+     "output_queue_bytes": 0, "pending_replies": 12}
+
+queued_ms is the time the request waited to be dispatched since it was
+read, the queue fields the backlog of the server at that time.
+Up to rate lines are written per second: the lines suppressed are counted
+in the suppressed field of the next one.
+"""
+
+import json
+import struct
+import time
+
+from pysftpserver.logger import SFTPLogWriter
+from pysftpserver.metrics import NAMES
+from pysftpserver.recorder import ARGUMENTS, EXTENDED_ARGUMENTS, parse_string
+from pysftpserver.server import (SSH2_FXP_EXTENDED, SSH2_FXP_READ,
+                                 SSH2_FXP_WRITE)
+
+
+class SFTPSlowLog(object):
+    """Log the requests slower than threshold seconds to the file at path,
+    up to rate lines per second."""
+
+    def __init__(self, path, threshold=1.0, rate=10):
+        self.writer = SFTPLogWriter(open(path, 'a'))
+        self.threshold = threshold
+        self.rate = rate
+        self.tokens = rate
+        self.last_refill = time.time()
+        self.suppressed = 0
+
+    def describe(self, sftpserver, msg_type, payload):
+        """Return the fields describing the request msg_type, whose
+        arguments are payload: its name, and its first path or handle
+        (with the name of the file it was opened from)."""
+        fields = {'request': NAMES.get(msg_type, str(msg_type))}
+        off = 0
+        arguments = ARGUMENTS.get(msg_type, ())
+        if msg_type == SSH2_FXP_EXTENDED:
+            name, off = parse_string(payload, off)
+            fields['request'] = name.decode('utf-8', 'replace')
+            arguments = EXTENDED_ARGUMENTS.get(name, ())
+        arguments = [a for a in arguments if a != 'int'][:1]
+        if arguments == ['handle']:
+            handle, off = parse_string(payload, off)
+            fields['handle'] = handle.decode('utf-8', 'replace')
+            path, _ = sftpserver.get_filename_from_handle_id(handle)
+            if path is not None:
+                fields['path'] = path.decode('utf-8', 'replace')
+            if msg_type == SSH2_FXP_READ:
+                fields['offset'], fields['size'] = struct.unpack(
+                    '>QI', payload[off:off + 12])
+            elif msg_type == SSH2_FXP_WRITE:
+                fields['offset'], = struct.unpack('>Q', payload[off:off + 8])
+                fields['size'], = struct.unpack(
+                    '>I', payload[off + 8:off + 12])
+        elif arguments == ['path']:
+            fields['path'] = parse_string(payload, off)[0].decode(
+                'utf-8', 'replace')
+        return fields
+
+    def allow(self):
+        """Return True if a line can be written now."""
+        now = time.time()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def check(self, fields, elapsed, storage_seconds):
+        """Log the request described by fields, if it took elapsed seconds
+        (storage_seconds in the storage) or more than the threshold."""
+        if elapsed < self.threshold or not self.allow():
+            return
+        fields = dict(fields)
+        fields['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        fields['total_ms'] = round(elapsed * 1000, 3)
+        fields['storage_ms'] = round(storage_seconds * 1000, 3)
+        fields['protocol_ms'] = round((elapsed - storage_seconds) * 1000, 3)
+        if self.suppressed:
+            fields['suppressed'] = self.suppressed
+            self.suppressed = 0
+        self.writer.write(json.dumps(fields, sort_keys=True) + '\n')
+
+    def close(self):
+        self.writer.close()
+        self.writer.file.close()
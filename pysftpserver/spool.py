@@ -0,0 +1,316 @@
+"""Write-back staging of the uploads, for the proxy storage.
+
+The files opened for writing are written to a local spool directory,
+at disk speed, and uploaded to the remote server once they are closed,
+by a few background workers. The renames, removals and attribute changes
+of the files still to be uploaded are queued too: the operations on the
+same paths are always executed in order.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from paramiko import SFTPAttributes
+
+
+class SpooledFile(object):
+    """A file staged in the spool, standing for the remote file path.
+
+    Same interface of the Paramiko files used by the proxy storage.
+    """
+
+    def __init__(self, path, local, writable=True):
+        self.path = path
+        self.local = local
+        self.writable = writable
+        self.fd = os.open(local, os.O_RDWR if writable else os.O_RDONLY)
+        self.attrs = dict()  # attributes to set once uploaded
+        self.lock = threading.Lock()  # of the position of fd
+
+    def read(self, off, size):
+        with self.lock:
+            os.lseek(self.fd, off, os.SEEK_SET)
+            return os.read(self.fd, size)
+
+    def write(self, off, chunk):
+        with self.lock:
+            os.lseek(self.fd, off, os.SEEK_SET)
+            while chunk:
+                chunk = chunk[os.write(self.fd, chunk):]
+        return True
+
+    def stat(self):
+        _stat = SFTPAttributes.from_stat(os.fstat(self.fd))
+        if b'perm' in self.attrs:
+            _stat.st_mode = self.attrs[b'perm']
+        return _stat
+
+    def truncate(self, size):
+        os.ftruncate(self.fd, size)
+
+    def chown(self, uid, gid):
+        self.attrs[b'uid'], self.attrs[b'gid'] = uid, gid
+
+    def chmod(self, mode):
+        self.attrs[b'perm'] = mode
+
+    def utime(self, times):
+        self.attrs[b'atime'], self.attrs[b'mtime'] = times
+
+    def fsync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Job(object):
+    """An operation queued in the spool, touching paths."""
+
+    def __init__(self, kind, paths, *args):
+        self.kind = kind
+        self.paths = paths
+        self.args = args
+
+
+class SFTPUploadSpool(object):
+    """Stage the uploads in spool_dir, and upload them in background.
+
+    connect is called by each of the workers to open its own SFTP client;
+    each operation is tried up to retries more times, waiting
+    retry_delay seconds (doubled each time) in between.
+    Paths must be absolute and normalized.
+    """
+
+    def __init__(self, spool_dir, connect, workers=2, retries=3,
+                 retry_delay=1):
+        # a private directory, inside spool_dir
+        self.dir = tempfile.mkdtemp(prefix='pysftpserver-', dir=spool_dir)
+        self.connect = connect
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cond = threading.Condition()
+        self.jobs = list()  # queued, in order
+        self.running = list()
+        self.staged = dict()  # path -> local file of its latest contents
+        self.writing = set()  # local files still open for writing
+        self.attrs = dict()  # local file -> attributes to set once uploaded
+        self.errors = list()  # (job, exception) of the failed jobs
+        self.stopping = False
+        self.workers = [
+            threading.Thread(target=self.work) for i in range(max(1, workers))
+        ]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def stage(self, path):
+        """Return a new SpooledFile, standing for path."""
+        fd, local = tempfile.mkstemp(dir=self.dir)
+        os.close(fd)
+        with self.cond:
+            self.staged[path] = local
+            self.writing.add(local)
+        return SpooledFile(path, local)
+
+    def lookup(self, path):
+        """Return a read-only SpooledFile of the staged contents of path,
+        or None if it is not staged."""
+        with self.cond:
+            local = self.staged.get(path)
+            if local is None:
+                return None
+            return SpooledFile(path, local, writable=False)
+
+    def stat(self, path):
+        """Return the (size, mtime) of the staged contents of path,
+        or None if it is not staged."""
+        with self.cond:
+            local = self.staged.get(path)
+            if local is None:
+                return None
+            _stat = os.stat(local)
+            return _stat.st_size, int(_stat.st_mtime)
+
+    def close(self, handle):
+        """Close the handle, queueing its upload if it was written."""
+        handle.close()
+        if not handle.writable:
+            return
+        with self.cond:
+            self.writing.discard(handle.local)
+            # it could have been renamed (or replaced) while it was written
+            attrs = dict(handle.attrs)
+            attrs.update(self.attrs.pop(handle.local, {}))
+            for path, local in self.staged.items():
+                if local == handle.local:
+                    self.queue(Job('upload', [path], local, attrs))
+                    break
+            else:
+                self.collect()
+
+    def rename(self, oldpath, newpath, posix=False):
+        with self.cond:
+            local = self.staged.pop(oldpath, None)
+            self.staged.pop(newpath, None)
+            if local is not None:
+                self.staged[newpath] = local
+            self.queue(Job('rename', [oldpath, newpath], posix))
+
+    def remove(self, path):
+        with self.cond:
+            self.staged.pop(path, None)
+            self.queue(Job('remove', [path]))
+
+    def setstat(self, path, attrs):
+        with self.cond:
+            local = self.staged.get(path)
+            if local in self.writing:
+                # set them once it is uploaded
+                self.attrs.setdefault(local, dict()).update(attrs)
+            else:
+                self.queue(Job('setstat', [path], attrs))
+
+    def pending(self, path):
+        """Return whether some operations on path are still to be done."""
+        with self.cond:
+            return any(path in job.paths for job in self.jobs + self.running) \
+                or path in self.staged
+
+    def settle(self, path=None, tree=False):
+        """Wait the operations on path (and inside it, if tree is True),
+        or all of them if path is None."""
+        prefix = os.path.join(path, b'') if path else None
+
+        def touches(job):
+            return path is None or any(
+                p == path or (tree and p.startswith(prefix))
+                for p in job.paths)
+
+        with self.cond:
+            while any(touches(job) for job in self.jobs + self.running):
+                self.cond.wait()
+
+    def drain(self):
+        """Wait all the operations and stop the workers.
+
+        Return the (kind, paths, exception) of the failed ones.
+        """
+        self.settle()
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+        if not self.errors:
+            shutil.rmtree(self.dir, True)
+        return [(job.kind, job.paths, e) for job, e in self.errors]
+
+    def queue(self, job):
+        """Queue the job. The lock must be held."""
+        self.jobs.append(job)
+        self.cond.notify_all()
+
+    def next_job(self):
+        """Return the first job that doesn't touch the paths
+        of the previous and running ones, or None."""
+        busy = set()
+        for job in self.running:
+            busy.update(job.paths)
+        for job in self.jobs:
+            if not busy.intersection(job.paths):
+                return job
+            busy.update(job.paths)
+        return None
+
+    def collect(self):
+        """Forget the staged files already uploaded and remove
+        the local files no longer needed. The lock must be held."""
+        paths = set()
+        needed = set(self.writing)
+        for job in self.jobs + self.running:
+            paths.update(job.paths)
+            if job.kind == 'upload':
+                needed.add(job.args[0])
+        # the contents of the failed uploads are kept
+        needed.update(
+            job.args[0] for job, e in self.errors if job.kind == 'upload')
+        for path, local in list(self.staged.items()):
+            if path not in paths and local not in self.writing:
+                del self.staged[path]
+        needed.update(self.staged.values())
+        for name in os.listdir(self.dir):
+            local = os.path.join(self.dir, name)
+            if local not in needed:
+                os.remove(local)
+
+    def work(self):
+        client = None
+        while True:
+            with self.cond:
+                job = self.next_job()
+                while job is None:
+                    if self.stopping:
+                        if client:
+                            client.close()
+                        return
+                    self.cond.wait()
+                    job = self.next_job()
+                self.jobs.remove(job)
+                self.running.append(job)
+
+            delay = self.retry_delay
+            for attempt in range(self.retries + 1):
+                try:
+                    if client is None:
+                        client = self.connect()
+                    self.run(client, job)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if client:
+                        client.close()
+                    client = None
+                    if attempt < self.retries:
+                        time.sleep(delay)
+                        delay *= 2
+
+            with self.cond:
+                self.running.remove(job)
+                if error is not None:
+                    self.errors.append((job, error))
+                self.collect()
+                self.cond.notify_all()
+
+    @staticmethod
+    def run(client, job):
+        if job.kind == 'upload':
+            local, attrs = job.args
+            client.put(local, job.paths[0])
+            SFTPUploadSpool.apply(client, job.paths[0], attrs)
+        elif job.kind == 'rename':
+            posix, = job.args
+            if posix:
+                client.posix_rename(*job.paths)
+            else:
+                client.rename(*job.paths)
+        elif job.kind == 'remove':
+            client.remove(job.paths[0])
+        elif job.kind == 'setstat':
+            SFTPUploadSpool.apply(client, job.paths[0], job.args[0])
+
+    @staticmethod
+    def apply(client, path, attrs):
+        """Set the attributes (as parsed by the server) of path."""
+        if b'size' in attrs:
+            client.truncate(path, attrs[b'size'])
+        if all(k in attrs for k in (b'uid', b'gid')):
+            client.chown(path, attrs[b'uid'], attrs[b'gid'])
+        if b'perm' in attrs:
+            client.chmod(path, attrs[b'perm'])
+        if all(k in attrs for k in (b'atime', b'mtime')):
+            client.utime(path, (attrs[b'atime'], attrs[b'mtime']))
@@ -1,7 +1,9 @@
 """General SFTP storage. Subclass it the way you want!"""
 
+import errno
 import os
 import itertools
+from stat import S_ISDIR
 
 from pysftpserver.abstractstorage import SFTPAbstractServerStorage
 from pysftpserver.futimes import futimes
@@ -131,6 +133,98 @@ class SFTPServerStorage(SFTPAbstractServerStorage):
         """Move/rename file."""
         os.rename(oldpath, newpath)
 
+    def rmtree(self, filename):
+        """Remove filename and, if it is a directory, all its contents.
+
+        Symlinks are removed, never followed.
+        os.scandir provides the type of each entry,
+        so that no further stat is needed.
+        """
+        if not hasattr(os, 'scandir'):  # Python 2
+            return SFTPAbstractServerStorage.rmtree(self, filename)
+        if os.path.islink(filename) or not os.path.isdir(filename):
+            os.remove(filename)
+            return 1, []
+
+        removed = 0
+        errors = list()
+        stack = [(filename, os.scandir(filename))]
+        while stack:
+            dirname, entries = stack[-1]
+            entry = next(entries, None)
+            if entry is None:  # now the directory should be empty
+                entries.close()
+                stack.pop()
+                try:
+                    os.rmdir(dirname)
+                    removed += 1
+                except OSError as e:
+                    errors.append((dirname, e))
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, os.scandir(entry.path)))
+                else:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError as e:
+                errors.append((entry.path, e))
+        return removed, errors
+
+    def makedirs(self, filename, mode):
+        """Create directory filename with given mode, and its missing parents
+        (with the default mode, as mkdir -p does).
+
+        Nothing is done if the directory already exists.
+        """
+        try:
+            os.makedirs(filename, mode)
+        except OSError as e:
+            if e.errno != errno.EEXIST or not os.path.isdir(filename):
+                raise
+
+    def disk_usage(self, filename):
+        """Summarize the usage of filename and, if it is a directory,
+        of all its contents. Symlinks are not followed.
+
+        Return a dictionary holding the total size of the files (b'size'),
+        and the number of files (b'files') and directories (b'dirs').
+        """
+        if not hasattr(os, 'scandir'):  # Python 2
+            return SFTPAbstractServerStorage.disk_usage(self, filename)
+        _stat = os.lstat(filename)
+        if not S_ISDIR(_stat.st_mode):
+            return {b'size': _stat.st_size, b'files': 1, b'dirs': 0}
+
+        usage = {b'size': 0, b'files': 0, b'dirs': 1}
+        stack = [filename]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        usage[b'dirs'] += 1
+                        stack.append(entry.path)
+                    else:
+                        usage[b'size'] += entry.stat(
+                            follow_symlinks=False).st_size
+                        usage[b'files'] += 1
+                except OSError:
+                    pass  # vanished
+            entries.close()
+        return usage
+
+    def posix_rename(self, oldpath, newpath):
+        """Move/rename file, atomically replacing newpath if it exists."""
+        os.rename(oldpath, newpath)
+
+    def hardlink(self, oldpath, newpath):
+        """Create newpath as an hard link to oldpath."""
+        os.link(oldpath, newpath)
+
     def symlink(self, linkpath, targetpath):
         """Symlink file."""
         os.symlink(targetpath, linkpath)
@@ -151,9 +245,14 @@ class SFTPServerStorage(SFTPAbstractServerStorage):
         os.lseek(handle, off, os.SEEK_SET)
         return os.read(handle, size)
 
+    def fsync(self, handle):
+        """Flush the handle contents to stable storage."""
+        os.fsync(handle)
+
     def close(self, handle):
         """Close the file handle."""
         try:
             handle.close()
         except AttributeError:
-            pass
+            if isinstance(handle, int):  # a file descriptor
+                os.close(handle)
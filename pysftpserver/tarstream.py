@@ -0,0 +1,191 @@
+"""Stream a directory tree as a tar archive.
+
+The archive is lazily generated from the storage while it is read,
+so that memory usage does not depend on the size of the tree.
+"""
+
+import os
+import stat
+import sys
+import tarfile
+import zlib
+
+from pysftpserver.deferred import resolve
+from pysftpserver.pysftpexceptions import SFTPException
+
+BLOCKSIZE = tarfile.BLOCKSIZE
+RECORDSIZE = tarfile.RECORDSIZE
+CHUNK_SIZE = 64 * 1024  # size of each storage read
+
+if sys.version_info < (3, ):
+    # tarfile takes the byte names as they are, decoding them (replacing
+    # the invalid bytes) just for the PAX headers
+    ERRORS = 'replace'
+
+    def decode(name):
+        return name
+else:
+    # the names which aren't valid UTF-8 are kept byte by byte
+    ERRORS = 'surrogateescape'
+
+    def decode(name):
+        return name.decode('utf-8', ERRORS)
+
+
+class SFTPTarStream(object):
+    """A read-only handle producing the tar archive of a directory.
+
+    Reads must be sequential: the server answers pipelined READs in order,
+    so this is always the case for ordinary clients.
+    """
+
+    def __init__(self, storage, dirname, verify=None, compress=False):
+        """Walk dirname in storage.
+
+        verify is called on each path before adding it to the archive:
+        entries for which it raises are skipped.
+        If compress is True, the archive is gzipped.
+        """
+        self.storage = storage
+        self.verify = verify
+        self.offset = 0  # offset of the first byte of the buffer
+        self.buffer = b''
+        self.eof = False
+        # open the directory now, so that errors are raised on open
+        self.chunks = self.archive(dirname, storage.opendir(dirname))
+        if compress:
+            self.chunks = self.gzip(self.chunks)
+
+    def read(self, off, size):
+        """Read size bytes starting at offset off."""
+        if off < self.offset:
+            raise SFTPException(b'Tar streams must be read sequentially')
+        while not self.eof and self.offset + len(self.buffer) < off + size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                break
+            self.buffer += chunk
+            if self.offset + len(self.buffer) <= off:  # skip it
+                self.offset += len(self.buffer)
+                self.buffer = b''
+        start = off - self.offset
+        data = self.buffer[start:start + size]
+        self.buffer = self.buffer[start + len(data):]
+        self.offset = off + len(data)
+        return data
+
+    def close(self):
+        """Close the file possibly open by the archive generator."""
+        self.chunks.close()
+
+    @staticmethod
+    def gzip(chunks):
+        """Gzip the chunks."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+
+    def walk(self, dirname, entries):
+        """Yield (path, name inside the archive, stats) of each entry
+        inside dirname, depth first.
+
+        entries is the iterator returned by opendir(dirname).
+        """
+        stack = [(dirname, b'', entries)]
+        try:
+            while stack:
+                parent, arcparent, entries = stack[-1]
+                entry = next(entries, None)
+                if entry is None:
+                    self.storage.close(entries)
+                    stack.pop()
+                    continue
+                if entry in (b'.', b'..'):
+                    continue
+                path = os.path.join(parent, entry)
+                arcname = os.path.join(arcparent, entry)
+                try:
+                    if self.verify:
+                        self.verify(path)
+                    attrs = self.storage.stat(path, lstat=True)
+                except Exception:
+                    continue  # forbidden or vanished
+                yield path, arcname, attrs
+                if stat.S_ISDIR(attrs[b'perm']):
+                    try:
+                        stack.append(
+                            (path, arcname, self.storage.opendir(path)))
+                    except Exception:
+                        pass
+        finally:
+            for parent, arcparent, entries in stack:
+                self.storage.close(entries)
+
+    def archive(self, dirname, entries):
+        """Yield the chunks of the tar archive of dirname."""
+        length = 0
+        for path, arcname, attrs in self.walk(dirname, entries):
+            info = tarfile.TarInfo(decode(arcname))
+            info.mode = stat.S_IMODE(attrs[b'perm'])
+            info.uid = attrs[b'uid']
+            info.gid = attrs[b'gid']
+            info.mtime = int(attrs[b'mtime'])
+            mode = attrs[b'perm']
+            handle = None
+            if stat.S_ISDIR(mode):
+                info.type = tarfile.DIRTYPE
+            elif stat.S_ISLNK(mode):
+                try:
+                    link = self.storage.readlink(path)
+                except Exception:
+                    continue
+                info.type = tarfile.SYMTYPE
+                info.linkname = decode(link)
+            elif stat.S_ISREG(mode):
+                try:
+                    handle = self.storage.open(path, os.O_RDONLY, 0)
+                except Exception:
+                    continue
+                info.size = attrs[b'size']
+            else:
+                continue  # devices, fifos and sockets are skipped
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', ERRORS)
+            length += len(header)
+            yield header
+            if handle is not None:
+                try:
+                    for chunk in self.content(handle, info.size):
+                        length += len(chunk)
+                        yield chunk
+                finally:
+                    self.storage.close(handle)
+        # two zero blocks, then pad to a whole record
+        end = length + 2 * BLOCKSIZE
+        end += -end % RECORDSIZE
+        yield b'\0' * (end - length)
+
+    def content(self, handle, size):
+        """Yield exactly size bytes (padded to a whole block) of handle.
+
+        The file could have changed since it was stat'ed: it is truncated
+        or filled with zeros, so that the archive is still valid.
+        """
+        off = 0
+        while off < size:
+            try:
+                chunk = resolve(self.storage.read(
+                    handle, off, min(CHUNK_SIZE, size - off)))
+            except Exception:
+                chunk = b''
+            if not chunk:
+                break
+            off += len(chunk)
+            yield chunk
+        padding = size - off
+        padding += -size % BLOCKSIZE
+        if padding:
+            yield b'\0' * padding
@@ -21,12 +21,14 @@ A stub SFTP server for loopback SFTP testing.
 """
 
 
+import errno
 import os
 
 from paramiko import (AUTH_FAILED, AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_OK,
                       RSAKey, ServerInterface, SFTPAttributes, SFTPHandle,
                       SFTPServer, SFTPServerInterface)
 from paramiko.common import o666
+from paramiko.sftp import CMD_EXTENDED
 
 from pysftpserver.tests.utils import t_path
 
@@ -165,6 +167,9 @@ class StubSFTPServer (SFTPServerInterface):
             return SFTPServer.convert_errno(e.errno)
         return SFTP_OK
 
+    def posix_rename(self, oldpath, newpath):
+        return self.rename(oldpath, newpath)
+
     def mkdir(self, path, attr):
         path = self._realpath(path)
         try:
@@ -218,3 +223,38 @@ class StubSFTPServer (SFTPServerInterface):
             else:
                 symlink = '<error>'
         return symlink
+
+
+class StubSFTPServerSubsystem (SFTPServer):
+    """SFTP subsystem that supports some more OpenSSH extensions."""
+
+    def _process(self, t, request_number, msg):
+        if t == CMD_EXTENDED:
+            tag = msg.get_text()
+            if tag == "hardlink@openssh.com":
+                return self._hardlink(request_number, msg)
+            if tag == "fsync@openssh.com":
+                return self._fsync(request_number, msg)
+            msg.rewind()
+            msg.get_int()  # request number
+        return SFTPServer._process(self, t, request_number, msg)
+
+    def _hardlink(self, request_number, msg):
+        oldpath = self.server._realpath(msg.get_text())
+        newpath = self.server._realpath(msg.get_text())
+        try:
+            os.link(oldpath, newpath)
+        except OSError as e:
+            return self._send_status(
+                request_number, SFTPServer.convert_errno(e.errno))
+        self._send_status(request_number, SFTP_OK)
+
+    def _fsync(self, request_number, msg):
+        handle = msg.get_binary()
+        if handle not in self.file_table:
+            return self._send_status(
+                request_number, SFTPServer.convert_errno(errno.EBADF))
+        f = self.file_table[handle]
+        f.writefile.flush()
+        os.fsync(f.writefile.fileno())
+        self._send_status(request_number, SFTP_OK)
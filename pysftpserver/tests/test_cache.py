@@ -0,0 +1,92 @@
+import os
+import unittest
+from shutil import rmtree
+
+from pysftpserver.cache import LRUCache, SFTPAttributesCache, SFTPBlockCache
+from pysftpserver.tests.utils import t_path
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_lru(self):
+        cache = LRUCache(size=2, ttl=5, clock=self.clock)
+        cache.put(b'a', 1)
+        cache.put(b'b', 2)
+        self.assertEqual(cache.get(b'a'), 1)  # b is now the oldest
+        cache.put(b'c', 3)
+        self.assertEqual(cache.get(b'b'), None)
+        self.assertEqual(cache.get(b'c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_ttl(self):
+        cache = LRUCache(size=2, ttl=5, clock=self.clock)
+        cache.put(b'a', 1)
+        self.clock.now = 5
+        self.assertIn(b'a', cache)
+        self.clock.now = 6
+        self.assertNotIn(b'a', cache)
+        self.assertEqual(cache.get(b'a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = SFTPAttributesCache(clock=self.clock)
+        for path in (b'/a', b'/a/b', b'/a/b/c', b'/ab'):
+            cache.attrs.put((path, False), path)
+            cache.dirs.put(path, [])
+        cache.missing.put(b'/a/d', True)
+
+        cache.invalidate(b'/a/b/c')
+        self.assertNotIn((b'/a/b/c', False), cache.attrs)
+        self.assertNotIn(b'/a/b', cache.dirs)  # the parent listing
+        self.assertIn((b'/a/b', False), cache.attrs)
+
+        cache.invalidate_tree(b'/a')
+        self.assertEqual(list(cache.attrs.entries), [(b'/ab', False)])
+        self.assertEqual(list(cache.dirs.entries), [b'/ab'])
+        self.assertEqual(len(cache.missing), 0)
+
+    def test_blocks(self):
+        cache = SFTPBlockCache(memory=4, block_size=2)
+        cache.put((b'/a', 0, 4, 0), b'ab')
+        cache.put((b'/a', 0, 4, 1), b'cd')
+        self.assertEqual(cache.get((b'/a', 0, 4, 0)), b'ab')
+        cache.put((b'/b', 0, 2, 0), b'ef')
+        self.assertEqual(cache.memory_used, 4)
+        self.assertEqual(cache.get((b'/a', 0, 4, 1)), None)
+        self.assertEqual(cache.get((b'/a', 1, 4, 0)), None)  # changed file
+        self.assertEqual(cache.stats(), {'blocks': (1, 2, 1 / 3.)})
+
+    def test_blocks_spill(self):
+        spill_dir = t_path('spill')
+        os.mkdir(spill_dir)
+        try:
+            cache = SFTPBlockCache(
+                memory=2, block_size=2, spill_dir=spill_dir, spill_size=4)
+            for i, data in enumerate((b'ab', b'cd', b'ef', b'gh')):
+                cache.put((b'/a', 0, 8, i), data)
+            self.assertEqual(len(os.listdir(cache.spill_dir)), 2)
+            self.assertEqual(cache.get((b'/a', 0, 8, 0)), None)
+            self.assertEqual(cache.get((b'/a', 0, 8, 1)), b'cd')
+            self.assertEqual(cache.get((b'/a', 0, 8, 3)), b'gh')
+            self.assertEqual(cache.spill_used, 4)
+            del cache
+            self.assertEqual(os.listdir(spill_dir), [])
+        finally:
+            rmtree(spill_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
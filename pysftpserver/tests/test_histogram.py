@@ -0,0 +1,43 @@
+import unittest
+
+from pysftpserver.histogram import Histogram, bucket, bucket_range
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_buckets(self):
+        previous = 0
+        for value in range(100000):
+            index = bucket(value)
+            low, high = bucket_range(index)
+            self.assertTrue(low <= value <= high)
+            # within 1/16 of the value
+            self.assertLessEqual(high - low, max(value // 16, 1))
+            self.assertIn(index, (previous, previous + 1))
+            previous = index
+
+    def test_percentile(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(99), 0)
+        for value in range(1, 1001):
+            histogram.record(value)
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.mean(), 500.5)
+        self.assertAlmostEqual(histogram.percentile(50), 500, delta=500 / 16)
+        self.assertAlmostEqual(histogram.percentile(99), 990, delta=990 / 16)
+        self.assertEqual(histogram.percentile(100), 1000)
+
+    def test_merge(self):
+        one, other = Histogram(), Histogram()
+        one.record(10)
+        other.record(10)
+        other.record(100000)
+        one.merge(other)
+        self.assertEqual(one.count, 3)
+        self.assertEqual(one.max, 100000)
+        self.assertEqual(one.ranges()[0], (10, 10, 2))
+        self.assertEqual(sum(count for _, _, count in one.ranges()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ from pysftpserver.server import (SSH2_FILEXFER_ATTR_ACMODTIME,
                                  SSH2_FILEXFER_ATTR_PERMISSIONS,
                                  SSH2_FILEXFER_ATTR_SIZE, SSH2_FXF_CREAT,
                                  SSH2_FXF_READ, SSH2_FXF_WRITE, SSH2_FXP_CLOSE,
+                                 SSH2_FXP_EXTENDED,
                                  SSH2_FXP_FSETSTAT, SSH2_FXP_FSTAT,
                                  SSH2_FXP_INIT, SSH2_FXP_LSTAT, SSH2_FXP_MKDIR,
                                  SSH2_FXP_OPEN, SSH2_FXP_OPENDIR,
@@ -113,6 +114,44 @@ class TestHook(SftpHook):
     def readlink(self, filename):
         self.set_result('readlink', filename)
 
+    def posix_rename(self, oldpath, newpath):
+        self.set_result('posix_rename', oldpath, 'oldpath')
+        self.set_result('posix_rename', newpath, 'newpath')
+
+    def hardlink(self, oldpath, newpath):
+        self.set_result('hardlink', oldpath, 'oldpath')
+        self.set_result('hardlink', newpath, 'newpath')
+
+    def fsync(self, handle_id):
+        filename, is_dir = self.server.get_filename_from_handle_id(handle_id)
+        self.set_result('fsync', filename)
+
+    def stat_many(self, filenames, lstat):
+        self.set_result('stat_many', pickle.dumps(filenames), 'filenames')
+        self.set_result('stat_many', lstat, 'lstat')
+
+    def get_file(self, filename):
+        self.set_result('get_file', filename)
+
+    def put_file(self, filename, attrs, data):
+        self.set_result('put_file', filename, 'filename')
+        self.set_result('put_file', pickle.dumps(attrs), 'attrs')
+        self.set_result('put_file', data, 'data')
+
+    def tar_open(self, filename, flags):
+        self.set_result('tar_open', filename, 'filename')
+        self.set_result('tar_open', flags, 'flags')
+
+    def rmtree(self, filename):
+        self.set_result('rmtree', filename)
+
+    def makedirs(self, filename, attrs):
+        self.set_result('makedirs', filename, 'filename')
+        self.set_result('makedirs', pickle.dumps(attrs), 'attrs')
+
+    def disk_usage(self, filename):
+        self.set_result('disk_usage', filename)
+
 
 class ServerTest(unittest.TestCase):
 
@@ -525,6 +564,148 @@ class ServerTest(unittest.TestCase):
         self.server.process()
         self.assertEqual(self.hook.get_result('readlink'), targetpath)
 
+    def test_posix_rename(self):
+        oldpath = b'services'
+        newpath = b'other_services'
+        os.close(os.open(oldpath, os.O_CREAT))
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'posix-rename@openssh.com'),
+            sftpstring(oldpath),
+            sftpstring(newpath),
+        )
+        self.server.process()
+        self.assertEqual(
+            self.hook.get_result('posix_rename', 'oldpath'), oldpath)
+        self.assertEqual(
+            self.hook.get_result('posix_rename', 'newpath'), newpath)
+        os.unlink(newpath)
+
+    def test_hardlink(self):
+        oldpath = b'services'
+        newpath = b'other_services'
+        os.close(os.open(oldpath, os.O_CREAT))
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'hardlink@openssh.com'),
+            sftpstring(oldpath),
+            sftpstring(newpath),
+        )
+        self.server.process()
+        self.assertEqual(self.hook.get_result('hardlink', 'oldpath'), oldpath)
+        self.assertEqual(self.hook.get_result('hardlink', 'newpath'), newpath)
+        os.unlink(oldpath)
+        os.unlink(newpath)
+
+    def test_fsync(self):
+        filename = b'services'
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(filename),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'fsync@openssh.com'),
+            sftpstring(handle),
+        )
+        self.server.process()
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        self.server.process()
+        self.assertEqual(self.hook.get_result('fsync'), filename)
+        os.unlink(filename)
+
+    def test_stat_many(self):
+        filenames = [b'services', b'other_services']
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(0),
+            sftpint(len(filenames)),
+            *[sftpstring(filename) for filename in filenames]
+        )
+        self.server.process()
+        self.assertEqual(
+            pickle.loads(self.hook.get_result('stat_many', 'filenames')),
+            filenames)
+        self.assertEqual(self.hook.get_result('stat_many', 'lstat'), False)
+
+    def test_get_file(self):
+        filename = b'services'
+        os.close(os.open(filename, os.O_CREAT))
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-file@unbit.com'),
+            sftpstring(filename),
+        )
+        self.server.process()
+        self.assertEqual(self.hook.get_result('get_file'), filename)
+        os.unlink(filename)
+
+    def test_put_file(self):
+        filename = b'services'
+        attrs = {b'perm': 0o100600}
+        data = b'foo'
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'put-file@unbit.com'),
+            sftpstring(filename),
+            sftpint(SSH2_FILEXFER_ATTR_PERMISSIONS),
+            sftpint(attrs[b'perm']),
+            sftpstring(data),
+        )
+        self.server.process()
+        self.assertEqual(self.hook.get_result('put_file', 'filename'), filename)
+        self.assertEqual(
+            pickle.loads(self.hook.get_result('put_file', 'attrs')), attrs)
+        self.assertEqual(self.hook.get_result('put_file', 'data'), data)
+        os.unlink(filename)
+
+    def test_tar_open(self):
+        filename = b'foo'
+        os.mkdir(filename)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'tar-open@unbit.com'),
+            sftpstring(filename),
+            sftpint(1),
+        )
+        self.server.process()
+        self.assertEqual(self.hook.get_result('tar_open', 'filename'), filename)
+        self.assertEqual(self.hook.get_result('tar_open', 'flags'), 1)
+        os.rmdir(filename)
+
+    def test_tree_extensions(self):
+        filename = b'foo/bar'
+        attrs = {b'perm': 0o700}
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'makedirs@unbit.com'),
+            sftpstring(filename),
+            sftpint(SSH2_FILEXFER_ATTR_PERMISSIONS),
+            sftpint(attrs[b'perm']),
+        ) + sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'du@unbit.com'),
+            sftpstring(filename),
+        ) + sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'rmtree@unbit.com'),
+            sftpstring(filename),
+        )
+        self.server.process()
+        self.assertEqual(self.hook.get_result('makedirs', 'filename'), filename)
+        self.assertEqual(
+            pickle.loads(self.hook.get_result('makedirs', 'attrs')), attrs)
+        self.assertEqual(self.hook.get_result('disk_usage'), filename)
+        self.assertEqual(self.hook.get_result('rmtree'), filename)
+        os.rmdir(b'foo')
+
 
 if __name__ == '__main__':
     unittest.main()
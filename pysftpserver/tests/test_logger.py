@@ -0,0 +1,105 @@
+import io
+import os
+import struct
+import sys
+import threading
+import unittest
+from shutil import rmtree
+
+from pysftpserver.logger import DEBUG, INFO, SFTPLogWriter
+from pysftpserver.server import (SSH2_FILEXFER_VERSION, SSH2_FXP_INIT,
+                                 SSH2_FXP_STAT, SFTPServer)
+from pysftpserver.tests.utils import sftpcmd, sftpstring, t_path
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+
+class BlockingFile(io.StringIO):
+    """A file whose writes wait until unblocked."""
+
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.unblocked = threading.Event()
+        self.flushes = 0
+
+    def write(self, text):
+        self.unblocked.wait()
+        return io.StringIO.write(self, text)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class LogWriterTest(unittest.TestCase):
+
+    def test_write(self):
+        f = BlockingFile()
+        f.unblocked.set()
+        writer = SFTPLogWriter(f, flush_interval=60)
+        writer.write('one\n')
+        writer.write('two\n')
+        writer.close()
+        self.assertEqual(f.getvalue(), 'one\ntwo\n')
+        self.assertEqual(f.flushes, 1)
+        # once closed, the writes are written at once
+        writer.write('three\n')
+        self.assertEqual(f.getvalue(), 'one\ntwo\nthree\n')
+
+    def test_dropped(self):
+        f = BlockingFile()
+        writer = SFTPLogWriter(f, max_queue=2)
+        for i in range(10):
+            writer.write('{}\n'.format(i))
+        # the writer takes one, up to 2 are queued
+        self.assertGreaterEqual(writer.total_dropped, 7)
+        f.unblocked.set()
+        writer.close()
+        lines = f.getvalue().splitlines()
+        dropped = '{} log lines dropped'.format(writer.total_dropped)
+        self.assertIn(dropped, lines)
+        lines.remove(dropped)
+        self.assertEqual(len(lines), 10 - writer.total_dropped)
+        self.assertEqual(lines, sorted(lines))
+
+
+class ServerLogTest(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(t_path())
+        self.home = 'home'
+        self.logfile = t_path('levels.log')
+        if not os.path.isdir(self.home):
+            os.mkdir(self.home)
+        self.stderr = sys.stderr
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        os.chdir(t_path())
+        rmtree(self.home)
+        os.unlink(self.logfile)
+
+    def log_statuses(self, log_level):
+        server = SFTPServer(
+            SFTPServerVirtualChroot(t_path(self.home)),
+            logfile=self.logfile,
+            log_level=log_level
+        )
+        server.input_queue = struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION)
+        server.input_queue += sftpcmd(SSH2_FXP_STAT, sftpstring(b'missing'))
+        server.process()
+        server.log('processed')
+        server.logfile.close()
+        with open(self.logfile) as f:
+            return f.read()
+
+    def test_levels(self):
+        log = self.log_statuses(INFO)
+        self.assertNotIn('sending status', log)
+        self.assertIn(' INFO processed', log)
+
+        log = self.log_statuses(DEBUG)
+        self.assertIn(' DEBUG sending status 2', log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import socket
+import struct
+import time
+import unittest
+from shutil import rmtree
+
+from pysftpserver.deferred import SFTPDeferred
+from pysftpserver.metrics import (PrometheusTextfileExporter, SFTPMetrics,
+                                  StatsdExporter, create_metrics)
+from pysftpserver.server import (SSH2_FILEXFER_VERSION, SSH2_FXF_CREAT,
+                                 SSH2_FXF_READ, SSH2_FXF_WRITE,
+                                 SSH2_FXP_CLOSE, SSH2_FXP_EXTENDED,
+                                 SSH2_FXP_INIT, SSH2_FXP_OPEN, SSH2_FXP_READ,
+                                 SSH2_FXP_STAT, SSH2_FXP_WRITE, SFTPServer)
+from pysftpserver.tests.utils import (get_sftphandle, sftpcmd, sftpint,
+                                      sftpint64, sftpstring, t_path)
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+
+class DeferredStorage(SFTPServerVirtualChroot):
+    """Reads completing after delay seconds, failing past the end."""
+
+    delay = 0.05
+
+    def read(self, handle, off, size):
+        def pump():
+            time.sleep(self.delay)
+            if off:
+                deferred.set_error(OSError(5, 'Input/output error'))
+            else:
+                deferred.set_result(
+                    SFTPServerVirtualChroot.read(self, handle, off, size))
+        deferred = SFTPDeferred(pump)
+        return deferred
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(t_path())
+        self.home = 'home'
+        self.textfile = t_path('metrics.prom')
+        if not os.path.isdir(self.home):
+            os.mkdir(self.home)
+
+        self.statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.statsd.bind(('127.0.0.1', 0))
+        self.statsd.settimeout(5)
+        self.metrics = SFTPMetrics([
+            PrometheusTextfileExporter(self.textfile),
+            StatsdExporter(self.statsd.getsockname()),
+        ])
+        self.server = SFTPServer(
+            SFTPServerVirtualChroot(self.home),
+            metrics=self.metrics
+        )
+        self.server.input_queue = struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION)
+        self.server.process()
+        self.server.output_queue = b''
+
+    def tearDown(self):
+        os.chdir(t_path())
+        rmtree(self.home)
+        self.metrics.close()
+        self.statsd.close()
+
+    def received(self):
+        """Return the lines of the datagrams received by statsd."""
+        lines = list()
+        try:
+            while True:
+                lines.extend(self.statsd.recv(65536).decode().split('\n'))
+                self.statsd.settimeout(0.2)
+        except socket.timeout:
+            self.statsd.settimeout(5)
+        return lines
+
+    def run_session(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN, sftpstring(b'foo'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE), sftpint(0))
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE, sftpstring(handle), sftpint64(0),
+            sftpstring(b'x' * 1000))
+        self.server.input_queue += sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        self.server.input_queue += sftpcmd(SSH2_FXP_STAT, sftpstring(b'bar'))
+        self.server.input_queue += sftpcmd(
+            SSH2_FXP_EXTENDED, sftpstring(b'makedirs@unbit.com'),
+            sftpstring(b'dir'), sftpint(0))
+        self.server.process()
+
+    def test_requests(self):
+        self.run_session()
+        requests = self.metrics.requests
+        self.assertEqual(
+            sorted(requests),
+            ['CLOSE', 'OPEN', 'STAT', 'WRITE', 'makedirs@unbit.com'])
+        for stats in requests.values():
+            self.assertEqual(stats.count, 1)
+            self.assertEqual(stats.latency.count, 1)
+            self.assertLessEqual(stats.storage.total, stats.latency.total)
+        self.assertEqual(requests['STAT'].errors, 1)
+        self.assertEqual(requests['WRITE'].errors, 0)
+        self.assertGreater(requests['WRITE'].bytes_in, 1000)
+        # an OK status: length, type, id and code
+        self.assertEqual(requests['CLOSE'].bytes_out, 4 + 1 + 4 + 4)
+        self.assertTrue(os.path.isdir(t_path(os.path.join(self.home, 'dir'))))
+
+    def test_export(self):
+        self.run_session()
+        self.metrics.tick(force=True)
+
+        with open(self.textfile) as f:
+            textfile = f.read()
+        self.assertIn('# TYPE pysftpserver_requests_total counter', textfile)
+        self.assertIn(
+            'pysftpserver_request_errors_total{request="STAT"} 1', textfile)
+        self.assertIn(
+            'pysftpserver_request_duration_seconds_bucket'
+            '{request="WRITE",le="+Inf"} 1', textfile)
+        self.assertIn(
+            'pysftpserver_storage_duration_seconds_count'
+            '{request="makedirs@unbit.com"} 1', textfile)
+
+        lines = self.received()
+        self.assertIn('pysftpserver.STAT.errors:1|c', lines)
+        self.assertIn('pysftpserver.makedirs_unbit_com.requests:1|c', lines)
+
+        # only the increments are sent
+        self.server.input_queue = sftpcmd(SSH2_FXP_STAT, sftpstring(b'bar'))
+        self.server.process()
+        self.metrics.tick(force=True)
+        lines = self.received()
+        self.assertIn('pysftpserver.STAT.requests:1|c', lines)
+        self.assertFalse([line for line in lines if 'WRITE' in line])
+
+        self.metrics.close()
+        self.assertFalse(os.path.exists(self.textfile))
+
+    def test_unknown_requests(self):
+        self.server.input_queue = b''.join(
+            sftpcmd(SSH2_FXP_EXTENDED, sftpstring(('foo%d@example.com' % i).encode()))
+            for i in range(100))
+        self.server.input_queue += sftpcmd(250)
+        self.server.process()
+        requests = self.metrics.requests
+        self.assertEqual(sorted(requests), ['EXTENDED', 'unknown'])
+        self.assertEqual(requests['EXTENDED'].count, 100)
+        self.assertEqual(requests['unknown'].count, 1)
+
+    def test_export_escape(self):
+        self.metrics.stats('a"b\\c\nd')
+        self.metrics.tick(force=True)
+        with open(self.textfile) as f:
+            textfile = f.read()
+        self.assertIn(
+            'pysftpserver_requests_total{request="a\\"b\\\\c\\nd"} 0',
+            textfile)
+
+    def test_deferred(self):
+        with open(t_path(os.path.join(self.home, 'foo')), 'wb') as f:
+            f.write(b'x' * 100)
+        server = SFTPServer(
+            DeferredStorage(t_path(self.home)), metrics=self.metrics)
+        server.input_queue = struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION)
+        server.process()
+        server.output_queue = b''
+        server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN, sftpstring(b'foo'), sftpint(SSH2_FXF_READ),
+            sftpint(0))
+        server.process()
+        handle = get_sftphandle(server.output_queue)
+        server.input_queue = sftpcmd(
+            SSH2_FXP_READ, sftpstring(handle), sftpint64(0), sftpint(100))
+        server.input_queue += sftpcmd(
+            SSH2_FXP_READ, sftpstring(handle), sftpint64(100), sftpint(100))
+        server.process()
+
+        reads = self.metrics.requests['READ']
+        self.assertEqual(reads.count, 2)
+        self.assertEqual(reads.errors, 1)
+        # a data reply, and a status
+        self.assertEqual(reads.bytes_out, 4 + 1 + 4 + 4 + 100 + 4 + 1 + 4 + 4)
+        delay = DeferredStorage.delay * 1000000
+        self.assertGreaterEqual(reads.latency.total, 2 * delay)
+        self.assertGreaterEqual(reads.storage.total, 2 * delay)
+
+    def test_disabled(self):
+        self.assertIsNone(create_metrics())
+        server = SFTPServer(SFTPServerVirtualChroot(t_path(self.home)))
+        self.assertIsInstance(server.storage, SFTPServerVirtualChroot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import struct
+import sys
+import unittest
+from shutil import rmtree
+
+from pysftpserver.recorder import (HANDLE, REQUEST, SFTPRecorder,
+                                   parse_string, read_recording, rewrite)
+from pysftpserver.replay import replay
+from pysftpserver.server import (SSH2_FILEXFER_VERSION, SSH2_FXF_CREAT,
+                                 SSH2_FXF_WRITE, SSH2_FXP_CLOSE,
+                                 SSH2_FXP_EXTENDED, SSH2_FXP_INIT,
+                                 SSH2_FXP_OPEN, SSH2_FXP_RENAME,
+                                 SSH2_FXP_WRITE, SFTPServer)
+from pysftpserver.tests.utils import (get_sftphandle, sftpcmd, sftpint,
+                                      sftpint64, sftpstring, t_path)
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.realpath(t_path())))
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(t_path())
+        self.home = 'home'
+        self.scratch = 'scratch'
+        self.recording = t_path('session.sftprec')
+        for directory in (self.home, self.scratch):
+            if not os.path.isdir(directory):
+                os.mkdir(directory)
+
+    def tearDown(self):
+        os.chdir(t_path())
+        rmtree(self.home)
+        rmtree(self.scratch)
+        if os.path.exists(self.recording):
+            os.unlink(self.recording)
+
+    def record(self, **kwargs):
+        """Record a session writing the file 'foo' inside 'dir'."""
+        server = SFTPServer(
+            SFTPServerVirtualChroot(self.home),
+            raise_on_error=True,
+            recorder=SFTPRecorder(self.recording, **kwargs)
+        )
+        server.input_queue = struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION)
+        server.input_queue += sftpcmd(
+            SSH2_FXP_EXTENDED, sftpstring(b'makedirs@unbit.com'),
+            sftpstring(b'dir'), sftpint(0))
+        server.process()
+        server.output_queue = b''
+        server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN, sftpstring(b'dir/foo'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE), sftpint(0))
+        server.process()
+        handle = get_sftphandle(server.output_queue)
+        server.output_queue = b''
+        server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE, sftpstring(handle), sftpint64(0),
+            sftpstring(b'data'))
+        server.input_queue += sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        server.process()
+        server.recorder.close()
+        return list(read_recording(self.recording))
+
+    def test_record(self):
+        records = self.record()
+        kinds = [kind for elapsed, kind, data in records]
+        self.assertEqual(kinds, [REQUEST, REQUEST, REQUEST, HANDLE,
+                                 REQUEST, REQUEST])
+        elapsed = [elapsed for elapsed, kind, data in records]
+        self.assertEqual(elapsed, sorted(elapsed))
+        self.assertIn(b'dir/foo', records[2][2])
+        # the handle is recorded with the id of the request opening it
+        sid, handle = records[3][2]
+        self.assertEqual(sid, struct.unpack('>I', records[2][2][5:9])[0])
+        self.assertIn(handle, records[4][2])
+
+    def test_max_size(self):
+        records = self.record(max_size=64)
+        self.assertLessEqual(os.path.getsize(self.recording), 64)
+        self.assertEqual(len(records), 2)
+
+    def test_redact(self):
+        records = self.record(redact=True)
+        request, off = parse_string(records[1][2], 9)
+        redacted_dir, _ = parse_string(records[1][2], off)
+        redacted_foo, _ = parse_string(records[2][2], 9)
+        self.assertEqual(request, b'makedirs@unbit.com')
+        self.assertNotIn(b'dir', redacted_dir)
+        self.assertNotIn(b'foo', redacted_foo)
+        # the same names are redacted the same way
+        self.assertEqual(redacted_foo.split(b'/')[0], redacted_dir)
+
+    def test_rewrite(self):
+        msg = sftpcmd(
+            SSH2_FXP_RENAME, sftpstring(b'/old'), sftpstring(b'/new'))
+        rewritten = rewrite(msg, path=lambda p: b'/scratch' + p)
+        self.assertEqual(rewritten[:9], struct.pack(
+            '>I', len(msg) - 4 + 16) + msg[4:9])
+        self.assertEqual(
+            rewritten[9:],
+            sftpstring(b'/scratch/old') + sftpstring(b'/scratch/new'))
+
+        msg = sftpcmd(
+            SSH2_FXP_WRITE, sftpstring(b'0'), sftpint64(0),
+            sftpstring(b'data'))
+        rewritten = rewrite(msg, handle=lambda h: b'42')
+        self.assertEqual(rewritten[9:], sftpstring(b'42') + msg[14:])
+
+    def test_replay(self):
+        self.record()
+        command = [
+            'env', 'PYTHONPATH=' + REPOSITORY, sys.executable,
+            os.path.join(REPOSITORY, 'bin', 'pysftpjail'), '{root}']
+        replayers = replay(
+            [self.recording], command, instances=2,
+            scratch=t_path(self.scratch))
+        for i, replayer in enumerate(replayers):
+            self.assertIsNone(replayer.failure)
+            self.assertEqual(replayer.errors, 0)
+            self.assertEqual(len(replayer.latencies), 4)
+            with open(t_path(os.path.join(
+                    self.scratch, 'instance{}'.format(i), 'dir', 'foo')),
+                    'rb') as f:
+                self.assertEqual(f.read(), b'data')
+
+
+if __name__ == "__main__":
+    unittest.main()
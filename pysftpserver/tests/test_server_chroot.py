@@ -1,16 +1,23 @@
 from __future__ import print_function
 
+import errno
+import io
 import os
+import tarfile
 import unittest
 from shutil import rmtree
 import stat as stat_lib
 
-from pysftpserver.server import (SSH2_FILEXFER_ATTR_ACMODTIME,
+from pysftpserver.server import (STAT_MANY_LSTAT, TAR_OPEN_GZIP,
+                                 SSH2_FILEXFER_ATTR_ACMODTIME,
                                  SSH2_FILEXFER_ATTR_PERMISSIONS,
                                  SSH2_FILEXFER_ATTR_SIZE,
-                                 SSH2_FILEXFER_VERSION, SSH2_FXF_CREAT,
-                                 SSH2_FXF_EXCL, SSH2_FXF_READ, SSH2_FXF_WRITE,
-                                 SSH2_FXP_CLOSE, SSH2_FXP_FSETSTAT,
+                                 SSH2_FILEXFER_VERSION, SSH2_FX_FAILURE, SSH2_FXF_CREAT,
+                                 SSH2_FX_NO_SUCH_FILE,
+                                 SSH2_FX_PERMISSION_DENIED, SSH2_FXF_EXCL,
+                                 SSH2_FXF_READ, SSH2_FXF_WRITE,
+                                 SSH2_FXP_CLOSE, SSH2_FXP_EXTENDED,
+                                 SSH2_FXP_FSETSTAT,
                                  SSH2_FXP_FSTAT, SSH2_FXP_INIT, SSH2_FXP_LSTAT,
                                  SSH2_FXP_MKDIR, SSH2_FXP_OPEN,
                                  SSH2_FXP_OPENDIR, SSH2_FXP_READ,
@@ -22,11 +29,42 @@ from pysftpserver.server import (SSH2_FILEXFER_ATTR_ACMODTIME,
                                  SFTPNotFound, SFTPServer)
 from pysftpserver.tests.utils import (get_sftpdata, get_sftphandle,
                                       get_sftpint, get_sftpname, get_sftpstat,
+                                      get_sftpfile, get_sftpfiles,
+                                      get_sftprmtree, get_sftpusage,
+                                      get_sftpstats, get_sftpstatus,
                                       sftpcmd, sftpint, sftpint64, sftpstring,
                                       t_path)
+from pysftpserver.abstractstorage import SFTPAbstractServerStorage
 from pysftpserver.virtualchroot import SFTPServerVirtualChroot
 
 
+class MinimalStorage(SFTPAbstractServerStorage):
+    """Files of home, with just open, write, close, rename and rm."""
+
+    def __init__(self, home):
+        self.home = home
+
+    def open(self, filename, flags, mode):
+        return os.open(os.path.join(self.home, filename), flags, mode)
+
+    def write(self, handle, off, chunk):
+        os.lseek(handle, off, os.SEEK_SET)
+        os.write(handle, chunk)
+        return True
+
+    def close(self, handle):
+        os.close(handle)
+
+    def rename(self, oldpath, newpath):
+        newpath = os.path.join(self.home, newpath)
+        if os.path.exists(newpath):  # as in the SFTP rename
+            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST))
+        os.rename(os.path.join(self.home, oldpath), newpath)
+
+    def rm(self, filename):
+        os.remove(os.path.join(self.home, filename))
+
+
 class ServerTest(unittest.TestCase):
 
     def setUp(self):
@@ -643,6 +681,604 @@ class ServerTest(unittest.TestCase):
 
         os.unlink('services')
 
+    def test_init_extensions(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_INIT, sftpint(2), sftpint(0)
+        )
+        self.server.process()
+        for name in (b'posix-rename@openssh.com',
+                     b'hardlink@openssh.com',
+                     b'fsync@openssh.com'):
+            self.assertIn(sftpstring(name), self.server.output_queue)
+
+    def test_extended_unsupported(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'unknown@example.com')
+        )
+        self.assertRaises(SFTPException, self.server.process)
+
+    def test_posix_rename(self):
+        with open('services', 'w') as f:
+            f.write('new')
+        with open('other_services', 'w') as f:
+            f.write('old')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'posix-rename@openssh.com'),
+            sftpstring(b'services'),
+            sftpstring(b'other_services'),
+        )
+        self.server.process()
+        self.assertNotIn('services', os.listdir('.'))
+        with open('other_services') as f:
+            self.assertEqual(f.read(), 'new')
+
+        os.unlink('other_services')
+
+    def test_posix_rename_forbidden(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'posix-rename@openssh.com'),
+            sftpstring(b'services'),
+            sftpstring(b'/etc/services'),
+        )
+        self.assertRaises(SFTPForbidden, self.server.process)
+
+    def test_hardlink(self):
+        with open('services', 'w') as f:
+            f.write('foo')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'hardlink@openssh.com'),
+            sftpstring(b'services'),
+            sftpstring(b'other_services'),
+        )
+        self.server.process()
+        self.assertEqual(
+            os.lstat('services').st_ino, os.lstat('other_services').st_ino)
+        self.assertEqual(os.lstat('services').st_nlink, 2)
+
+        os.unlink('services')
+        os.unlink('other_services')
+
+    def test_fsync(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'fsync@openssh.com'),
+            sftpstring(handle),
+        )
+        self.server.process()
+        self.assertEqual(get_sftpstatus(self.server.output_queue), 0)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+
+        os.unlink('services')
+
+    def test_close_error(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        fd = self.server.handles[handle]
+
+        def close(handle):
+            raise OSError(5, 'Input/output error')
+        self.server.storage.close = close
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.assertRaises(SFTPException, self.server.process)
+        self.assertNotIn(handle, self.server.handles)
+
+        os.close(fd)
+        os.unlink('services')
+
+    def test_fsync_group_commit(self):
+        self.server.fsync_group_commit = True
+        handles = list()
+        for filename in (b'services', b'other_services'):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_OPEN,
+                sftpstring(filename),
+                sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+                sftpint(0)
+            )
+            self.server.process()
+            handles.append(get_sftphandle(self.server.output_queue))
+
+        synced = list()
+        fsync_many = self.server.storage.fsync_many
+
+        def _fsync_many(handles):
+            synced.append(len(handles))
+            return fsync_many(handles)
+
+        self.server.storage.fsync_many = _fsync_many
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(
+            sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'fsync@openssh.com'),
+                sftpstring(handle),
+            )
+            for handle in handles + handles
+        )
+        self.server.process()
+        # a single commit, replied to each request
+        self.assertEqual(synced, [4])
+        self.assertEqual(len(self.server.output_queue), 4 * 13)
+
+        for handle in handles:
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_CLOSE,
+                sftpstring(handle)
+            )
+            self.server.process()
+
+        os.unlink('services')
+        os.unlink('other_services')
+
+    def test_stat_many(self):
+        with open('services', 'w') as f:
+            f.write('foo')
+        os.symlink('services', 'link')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(0),
+            sftpint(4),
+            sftpstring(b'services'),
+            sftpstring(b'link'),
+            sftpstring(b'missing'),
+            sftpstring(b'/etc/services'),
+        )
+        self.server.process()
+        stats = get_sftpstats(self.server.output_queue)
+        self.assertEqual(len(stats), 4)
+        self.assertEqual(stats[0]['size'], 3)
+        self.assertEqual(stats[0]['uid'], os.getuid())
+        self.assertEqual(stats[1]['size'], 3)  # followed
+        self.assertEqual(stats[2], SSH2_FX_NO_SUCH_FILE)
+        self.assertEqual(stats[3], SSH2_FX_PERMISSION_DENIED)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(STAT_MANY_LSTAT),
+            sftpint(1),
+            sftpstring(b'link'),
+        )
+        self.server.process()
+        stats = get_sftpstats(self.server.output_queue)
+        self.assertTrue(stat_lib.S_ISLNK(stats[0]['mode']))
+
+        # the count is bounded by the paths sent
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(0),
+            sftpint(2000000),
+            sftpstring(b'services'),
+        )
+        self.server.process()
+        stats = get_sftpstats(self.server.output_queue)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['size'], 3)
+
+        # and by the stats that fit in a reply
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(0),
+            sftpint(10000),
+            *[sftpstring(b'services')] * 10000
+        )
+        self.server.process()
+        self.assertLessEqual(
+            len(self.server.output_queue), self.server.max_reply_size)
+        stats = get_sftpstats(self.server.output_queue)
+        self.assertLess(len(stats), 10000)
+        self.assertEqual(stats[-1]['size'], 3)
+
+        os.unlink('link')
+        os.unlink('services')
+
+    def test_get_file(self):
+        with open('services', 'wb') as f:
+            f.write(b'foo' * 1000)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-file@unbit.com'),
+            sftpstring(b'services'),
+        )
+        self.server.process()
+        attrs, data = get_sftpfile(self.server.output_queue)
+        self.assertEqual(data, b'foo' * 1000)
+        self.assertEqual(attrs['size'], 3000)
+        self.assertEqual(attrs['mtime'], int(os.stat('services').st_mtime))
+
+        self.server.small_file_threshold = 2999
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-file@unbit.com'),
+            sftpstring(b'services'),
+        )
+        self.assertRaises(SFTPException, self.server.process)
+
+        os.unlink('services')
+
+    def test_get_files(self):
+        for i in range(3):
+            with open('file%d' % i, 'wb') as f:
+                f.write(b'x' * (1000 * i))
+
+        self.server.small_file_threshold = 1000
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-files@unbit.com'),
+            sftpint(5),
+            sftpstring(b'file0'),
+            sftpstring(b'file1'),
+            sftpstring(b'file2'),  # too large
+            sftpstring(b'missing'),
+            sftpstring(b'../forbidden'),
+        )
+        self.server.process()
+        files = get_sftpfiles(self.server.output_queue)
+        self.assertEqual(files[0][1], b'')
+        self.assertEqual(files[1][1], b'x' * 1000)
+        self.assertEqual(files[1][0]['size'], 1000)
+        self.assertEqual(
+            files[2:],
+            [SSH2_FX_FAILURE, SSH2_FX_NO_SUCH_FILE, SSH2_FX_PERMISSION_DENIED]
+        )
+
+        # only a part of the files fit in the reply
+        self.server.max_reply_size = 1
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-files@unbit.com'),
+            sftpint(2),
+            sftpstring(b'file1'),
+            sftpstring(b'file0'),
+        )
+        self.server.process()
+        files = get_sftpfiles(self.server.output_queue)
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0][1], b'x' * 1000)
+
+        # the reply never exceeds max_reply_size
+        self.server.max_reply_size = 2100
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-files@unbit.com'),
+            sftpint(3),
+            sftpstring(b'file1'),
+            sftpstring(b'file1'),
+            sftpstring(b'file0'),
+        )
+        self.server.process()
+        self.assertLessEqual(len(self.server.output_queue), 2100)
+        self.assertEqual(len(get_sftpfiles(self.server.output_queue)), 2)
+
+        for i in range(3):
+            os.unlink('file%d' % i)
+
+    def test_small_file_threshold(self):
+        server = SFTPServer(
+            SFTPServerVirtualChroot(t_path(self.home)),
+            small_file_threshold=1024 * 1024
+        )
+        self.assertLess(server.small_file_threshold, server.max_reply_size)
+
+    def test_put_file(self):
+        mtime = 1415626120
+        with open('services', 'wb') as f:
+            f.write(b'old')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'put-file@unbit.com'),
+            sftpstring(b'services'),
+            sftpint(
+                SSH2_FILEXFER_ATTR_PERMISSIONS |
+                SSH2_FILEXFER_ATTR_ACMODTIME
+            ),
+            sftpint(0o600),
+            sftpint(mtime),
+            sftpint(mtime),
+            sftpstring(b'new'),
+        )
+        self.server.process()
+        self.assertEqual(os.listdir('.'), ['services'])
+        with open('services', 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(os.lstat('services').st_mtime, mtime)
+        self.assertEqual(stat_lib.S_IMODE(os.lstat('services').st_mode), 0o600)
+
+        os.unlink('services')
+
+    def test_put_file_minimal_storage(self):
+        # posix_rename is not overridden: it falls back to rm and rename
+        server = SFTPServer(
+            MinimalStorage(t_path(self.home).encode()), raise_on_error=True)
+        for data in (b'old', b'new'):
+            server.input_queue = sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'put-file@unbit.com'),
+                sftpstring(b'services'),
+                sftpint(0),
+                sftpstring(data),
+            )
+            server.process()
+            self.assertEqual(os.listdir(t_path(self.home)), ['services'])
+            with open(t_path(os.path.join(self.home, 'services')), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        os.unlink(t_path(os.path.join(self.home, 'services')))
+
+    def test_put_file_forbidden(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'put-file@unbit.com'),
+            sftpstring(b'../services'),
+            sftpint(0),
+            sftpstring(b'new'),
+        )
+        self.assertRaises(SFTPForbidden, self.server.process)
+
+    def read_tar(self, dirname, flags=0):
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'tar-open@unbit.com'),
+            sftpstring(dirname),
+            sftpint(flags),
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+
+        data = b''
+        while True:
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_READ,
+                sftpstring(handle),
+                sftpint64(len(data)),
+                sftpint(32768)
+            )
+            try:
+                self.server.process()
+            except SFTPException:
+                break  # EOF
+            data += get_sftpdata(self.server.output_queue)
+            stream = self.server.handles[handle]
+            self.assertLessEqual(len(stream.buffer), 64 * 1024)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertNotIn(handle, self.server.streams)
+        return data
+
+    def test_tar_open(self):
+        big = os.urandom(300 * 1024)
+        os.makedirs('foo/bar')
+        with open('foo/big', 'wb') as f:
+            f.write(big)
+        with open('foo/bar/small', 'wb') as f:
+            f.write(b'small')
+        os.symlink('small', 'foo/bar/link')
+        os.symlink('/etc/services', 'foo/outside')
+
+        for flags in (0, TAR_OPEN_GZIP):
+            data = self.read_tar(b'foo', flags)
+            tar = tarfile.open(fileobj=io.BytesIO(data))
+            self.assertEqual(
+                sorted(tar.getnames()),
+                ['bar', 'bar/link', 'bar/small', 'big']
+            )
+            self.assertEqual(tar.extractfile('big').read(), big)
+            self.assertEqual(tar.extractfile('bar/small').read(), b'small')
+            self.assertEqual(tar.getmember('bar/link').linkname, 'small')
+            self.assertTrue(tar.getmember('bar').isdir())
+
+        rmtree('foo')
+
+    def test_tar_open_gzip(self):
+        os.mkdir('foo')
+        with open('foo/text', 'wb') as f:
+            f.write(b'foo' * 10000)
+
+        data = self.read_tar(b'foo', TAR_OPEN_GZIP)
+        self.assertEqual(data[:2], b'\x1f\x8b')
+        self.assertLess(len(data), 10000)
+        tar = tarfile.open(fileobj=io.BytesIO(data), mode='r:gz')
+        self.assertEqual(tar.extractfile('text').read(), b'foo' * 10000)
+
+        rmtree('foo')
+
+    def test_tar_open_errors(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'tar-open@unbit.com'),
+            sftpstring(b'missing'),
+            sftpint(0),
+        )
+        self.assertRaises(SFTPNotFound, self.server.process)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'tar-open@unbit.com'),
+            sftpstring(b'..'),
+            sftpint(0),
+        )
+        self.assertRaises(SFTPForbidden, self.server.process)
+
+    def make_tree(self):
+        os.makedirs('foo/bar/baz')
+        for path in ('foo/a', 'foo/bar/b', 'foo/bar/baz/c'):
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+        os.mkdir('other')
+        os.symlink('../other', 'foo/link')
+
+    def rmtree(self, filename):
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'rmtree@unbit.com'),
+            sftpstring(filename),
+        )
+        self.server.process()
+        return get_sftprmtree(self.server.output_queue)
+
+    def test_rmtree(self):
+        self.make_tree()
+        removed, failed, failures = self.rmtree(b'foo')
+        self.assertEqual((removed, failed, failures), (7, 0, []))
+        self.assertEqual(os.listdir('.'), ['other'])  # link not followed
+
+        removed, failed, failures = self.rmtree(b'other')
+        self.assertEqual((removed, failed, failures), (1, 0, []))
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'rmtree@unbit.com'),
+            sftpstring(b'other'),
+        )
+        self.assertRaises(SFTPNotFound, self.server.process)
+
+    def test_rmtree_generic(self):
+        storage = self.server.storage
+        rm = storage.rm
+
+        def _rm(filename):
+            if filename.endswith(b'/b'):
+                raise OSError(13, 'Permission denied')
+            rm(filename)
+
+        storage.rm = _rm
+        storage.rmtree = lambda filename: \
+            SFTPAbstractServerStorage.rmtree(storage, filename)
+
+        self.make_tree()
+        removed, failed, failures = self.rmtree(b'foo')
+        self.assertEqual((removed, failed), (4, 3))
+        self.assertEqual(sorted(failures), [
+            (b'foo', SSH2_FX_FAILURE),  # not empty
+            (b'foo/bar', SSH2_FX_FAILURE),  # not empty
+            (b'foo/bar/b', SSH2_FX_FAILURE),
+        ])
+        self.assertEqual(os.listdir('foo/bar'), ['b'])
+
+        # the failures reported are limited by max_reply_size
+        self.server.max_reply_size = 50
+        removed, failed, failures = self.rmtree(b'foo')
+        self.assertEqual((removed, failed), (0, 3))
+        self.assertIn(len(failures), (1, 2))
+        self.assertLessEqual(len(self.server.output_queue), 50)
+
+        rmtree('foo')
+        rmtree('other')
+
+    def test_makedirs(self):
+        for i in range(2):  # the second time, nothing has to be done
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'makedirs@unbit.com'),
+                sftpstring(b'foo/bar/baz'),
+                sftpint(SSH2_FILEXFER_ATTR_PERMISSIONS),
+                sftpint(0o700),
+            )
+            self.server.process()
+            self.assertTrue(os.path.isdir('foo/bar/baz'))
+            self.assertEqual(
+                stat_lib.S_IMODE(os.lstat('foo/bar/baz').st_mode), 0o700)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'makedirs@unbit.com'),
+            sftpstring(b'../foo'),
+            sftpint(0),
+        )
+        self.assertRaises(SFTPForbidden, self.server.process)
+
+        rmtree('foo')
+
+    def test_makedirs_generic(self):
+        created = list()
+        storage = MinimalStorage(t_path(self.home).encode())
+
+        def stat(filename, lstat=False):
+            raise OSError(13, 'Permission denied')  # even the root
+
+        storage.stat = stat
+        storage.mkdir = lambda filename, mode: created.append((filename, mode))
+        # a parent named as the directory keeps the default mode
+        SFTPAbstractServerStorage.makedirs(storage, b'/a/a/', 0o700)
+        self.assertEqual(
+            created, [(b'/a', 0o777), (b'/a/a', 0o700)])
+
+    def test_disk_usage(self):
+        self.make_tree()
+        for disk_usage in (
+            self.server.storage.disk_usage,
+            lambda filename: SFTPAbstractServerStorage.disk_usage(
+                self.server.storage, filename)
+        ):
+            self.server.storage.disk_usage = disk_usage
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'du@unbit.com'),
+                sftpstring(b'foo'),
+            )
+            self.server.process()
+            size, files, dirs = get_sftpusage(self.server.output_queue)
+            self.assertEqual(files, 4)  # the link is counted as a file
+            self.assertEqual(dirs, 3)
+            self.assertEqual(size, 30 + len('../other'))
+
+        rmtree('foo')
+        rmtree('other')
+
     @classmethod
     def tearDownClass(cls):
         os.unlink(t_path("log"))  # comment me to see the log!
@@ -0,0 +1,161 @@
+import os
+import stat as stat_lib
+import unittest
+from shutil import rmtree
+
+from pysftpserver.server import (SSH2_FXF_CREAT, SSH2_FXF_READ,
+                                 SSH2_FXF_WRITE, SSH2_FXP_CLOSE,
+                                 SSH2_FXP_MKDIR, SSH2_FXP_OPEN,
+                                 SSH2_FXP_OPENDIR, SSH2_FXP_READ,
+                                 SSH2_FXP_READDIR, SSH2_FXP_RENAME,
+                                 SSH2_FXP_STAT, SSH2_FXP_WRITE,
+                                 SFTPException, SFTPNotFound, SFTPServer)
+from pysftpserver.tests.utils import (get_sftpdata, get_sftphandle,
+                                      get_sftpname, get_sftpstat,
+                                      sftpcmd, sftpint, sftpint64, sftpstring,
+                                      t_path)
+from pysftpserver.mountstorage import SFTPServerMountStorage
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+
+class MountTest(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(t_path())
+        self.homes = [t_path('mount_a'), t_path('mount_b')]
+        for home in self.homes:
+            os.mkdir(home)
+
+        self.connected = 0
+
+        def connect():
+            self.connected += 1
+            return SFTPServerVirtualChroot(self.homes[1])
+
+        self.storage = SFTPServerMountStorage({
+            '/a': SFTPServerVirtualChroot(self.homes[0]),
+            '/data/b': connect,
+        })
+        self.server = SFTPServer(
+            self.storage,
+            logfile=t_path('log'),
+            raise_on_error=True
+        )
+
+    def tearDown(self):
+        os.chdir(t_path())
+        for home in self.homes:
+            rmtree(home)
+
+    def listdir(self, dirname):
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPENDIR, sftpstring(dirname))
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        names = list()
+        while True:
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_READDIR, sftpstring(handle))
+            try:
+                self.server.process()
+            except SFTPException:  # EOF
+                break
+            names.append(get_sftpname(self.server.output_queue))
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        self.server.process()
+        return sorted(names)
+
+    def write(self, filename, data):
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(filename),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(data)
+        ) + sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        self.server.process()
+
+    def test_synthesized(self):
+        self.assertEqual(self.listdir(b'/'), [b'.', b'..', b'a', b'data'])
+        self.assertEqual(self.listdir(b'/data'), [b'.', b'..', b'b'])
+
+        for dirname in (b'/', b'/data', b'/data/b'):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_STAT, sftpstring(dirname))
+            self.server.process()
+            stat = get_sftpstat(self.server.output_queue)
+            self.assertTrue(stat_lib.S_ISDIR(stat['mode']))
+        # not connected yet
+        self.assertEqual(self.connected, 0)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_MKDIR, sftpstring(b'/data/c'), sftpint(0))
+        self.assertRaises(SFTPException, self.server.process)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'/missing'))
+        self.assertRaises(SFTPNotFound, self.server.process)
+
+    def test_routing(self):
+        self.write(b'/a/services', b'first')
+        self.write(b'/data/b/services', b'second')
+        self.assertEqual(self.connected, 1)
+        for home, data in zip(self.homes, (b'first', b'second')):
+            with open(os.path.join(home, 'services'), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        self.assertEqual(
+            self.listdir(b'/data/b'), [b'.', b'..', b'services'])
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'/data/b/../b/services'),
+            sftpint(SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_READ,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpint(100)
+        )
+        self.server.process()
+        self.assertEqual(get_sftpdata(self.server.output_queue), b'second')
+        self.server.input_queue = sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        self.server.process()
+        self.assertEqual(self.storage.handles, dict())
+
+        # renames can't cross the mounts
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_RENAME,
+            sftpstring(b'/a/services'),
+            sftpstring(b'/data/b/moved')
+        )
+        self.assertRaises(SFTPException, self.server.process)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_RENAME,
+            sftpstring(b'/a/services'),
+            sftpstring(b'/a/moved')
+        )
+        self.server.process()
+        self.assertTrue(os.path.exists(os.path.join(self.homes[0], 'moved')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,16 +7,23 @@ import logging
 import socket
 import select
 import paramiko
+import io
 import os
+import tarfile
 import unittest
 import stat
 
 from shutil import rmtree
 
-from pysftpserver.tests.stub_sftp import StubServer, StubSFTPServer
+from pysftpserver.tests.stub_sftp import (StubServer, StubSFTPServer,
+                                          StubSFTPServerSubsystem)
 from pysftpserver.tests.utils import *
 from pysftpserver.server import *
-from pysftpserver.proxystorage import SFTPServerProxyStorage
+from pysftpserver.benchmark import benchmark
+from pysftpserver.broker import SFTPBroker
+from pysftpserver.cache import SFTPAttributesCache, SFTPBlockCache
+from pysftpserver.proxystorage import SFTPServerProxyStorage, SSHConnector
+from pysftpserver.pysftpexceptions import SFTPConnectionError
 
 
 REMOTE_ROOT = t_path("server_root")
@@ -26,6 +33,7 @@ remote_file = lambda file_path: os.path.join(REMOTE_ROOT, file_path)
 
 
 event = threading.Event()
+listening = threading.Event()
 
 # attach existing loggers (use --nologcapture option to see output)
 logging.basicConfig(
@@ -41,6 +49,7 @@ def _start_sftp_server():
     sock.setblocking(0)
     sock.bind(('localhost', 2223))
     sock.listen(10)
+    listening.set()
 
     reads = {sock}
     others = set()
@@ -61,9 +70,10 @@ def _start_sftp_server():
                 t_path('server_id_rsa')
             )
             ts.add_server_key(host_key)
+            ts.use_compression(True)
             server = StubServer()
             ts.set_subsystem_handler(
-                'sftp', paramiko.SFTPServer, StubSFTPServer)
+                'sftp', StubSFTPServerSubsystem, StubSFTPServer)
             ts.start_server(server=server)
 
     sock.close()
@@ -76,6 +86,7 @@ def setup_module():
 
     t = threading.Thread(target=_start_sftp_server, name="server")
     t.start()
+    listening.wait()
 
 
 def teardown_module():
@@ -479,6 +490,282 @@ class TestProxyServer(unittest.TestCase):
         os.unlink(remote_file("bar"))
         os.rmdir(remote_file("foo"))
 
+    def test_readdir_attributes(self):
+        with open(remote_file('bar'), 'wb') as f:
+            f.write(b'bar')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPENDIR,
+            sftpstring(b'.')
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+
+        # the attributes come with the listing
+        client = self.server.storage.client
+        client.stat = client.lstat = None
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_READDIR,
+            sftpstring(handle),
+        )
+        self.server.process()
+        self.assertEqual(get_sftpname(self.server.output_queue), b'bar')
+        longname, blob = parse_sftpstring(self.server.output_queue[17 + 3:])
+        attrs, blob = parse_sftpattrs(blob)
+        self.assertEqual(attrs['size'], 3)
+        self.assertTrue(longname.startswith(b'-'))
+        self.assertTrue(longname.endswith(b' bar'))
+        self.assertEqual(self.server.storage.listed, dict())
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle),
+        )
+        self.server.process()
+        os.unlink(remote_file('bar'))
+
+    def test_readahead(self):
+        storage = self.server.storage
+        content = os.urandom(40)
+        with open(remote_file('services'), 'wb') as f:
+            f.write(content)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        state = list(storage.readaheads.values())[0]
+
+        requested = list()
+        cached_read = storage.cached_read
+
+        def counting_read(handle, off, size):
+            requested.append(off)
+            return cached_read(handle, off, size)
+
+        storage.cached_read = counting_read
+        data = b''
+        for off in range(0, 48, 4):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_READ,
+                sftpstring(handle),
+                sftpint64(off),
+                sftpint(4)
+            )
+            try:
+                self.server.process()
+            except SFTPException:
+                break  # EOF
+            data += get_sftpdata(self.server.output_queue)
+        self.assertEqual(data, content)
+        # each chunk has been requested once, in advance
+        self.assertEqual(sorted(set(requested)), requested[:len(set(requested))])
+        self.assertEqual(len(requested), len(set(requested)))
+        # until the end of file is seen, at most a window is read past it
+        self.assertLess(max(requested), 40 + 4 * state.max_window)
+
+        # a random access stops it
+        self.assertFalse(state.update(0, 4))
+        self.assertEqual(state.prefetched, dict())
+        self.assertTrue(state.update(4, 4))
+        state.interval = 0.01
+        self.assertEqual(state.window(0.1), 11)
+        self.assertEqual(state.window(10), state.max_window)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(storage.readaheads, dict())
+
+    def test_block_cache(self):
+        storage = self.server.storage
+        storage.block_cache = SFTPBlockCache(block_size=4)
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'0123456789')
+
+        def read(off, size):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_OPEN,
+                sftpstring(b'services'),
+                sftpint(SSH2_FXF_READ),
+                sftpint(0)
+            )
+            self.server.process()
+            handle = get_sftphandle(self.server.output_queue)
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_READ,
+                sftpstring(handle),
+                sftpint64(off),
+                sftpint(size)
+            ) + sftpcmd(
+                SSH2_FXP_CLOSE,
+                sftpstring(handle)
+            )
+            self.server.process()
+            return get_sftpdata(self.server.output_queue)
+
+        self.assertEqual(read(2, 5), b'23456')
+        self.assertEqual(storage.block_cache.stats()['blocks'][:2], (0, 2))
+        self.assertEqual(read(0, 8), b'01234567')
+        self.assertEqual(read(8, 8), b'89')
+        self.assertEqual(storage.block_cache.stats()['blocks'][:2], (2, 3))
+
+        # served locally, as long as the file does not change
+        remote_read = storage.remote_read
+        storage.remote_read = None
+        self.assertEqual(read(1, 9), b'123456789')
+        storage.remote_read = remote_read
+
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'abcdefghij')
+        os.utime(remote_file('services'), (0, 0))
+        self.assertEqual(read(1, 9), b'bcdefghij')
+        self.assertEqual(storage.fetching, dict())
+
+    def test_cache(self):
+        storage = self.server.storage
+        storage.cache = SFTPAttributesCache()
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'foo')
+
+        def stat(filename):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_STAT, sftpstring(filename))
+            self.server.process()
+            return get_sftpstat(self.server.output_queue)
+
+        self.assertEqual(stat(b'services')['size'], 3)
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'foobar')  # not seen through the cache
+        self.assertEqual(stat(b'services')['size'], 3)
+        self.assertEqual(storage.cache.attrs.hits, 1)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'missing'))
+        self.assertRaises(SFTPNotFound, self.server.process)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_MKDIR, sftpstring(b'missing'), sftpint(0))
+        self.server.process()
+        stat(b'missing')
+
+        # the proxy invalidates what it changes
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_SETSTAT,
+            sftpstring(b'services'),
+            sftpint(SSH2_FILEXFER_ATTR_SIZE),
+            sftpint64(1)
+        )
+        self.server.process()
+        self.assertEqual(stat(b'services')['size'], 1)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.assertEqual(stat(b'services')['size'], 0)  # truncated
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(b'foo')
+        ) + sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(stat(b'services')['size'], 3)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_RENAME,
+            sftpstring(b'services'),
+            sftpstring(b'missing/services')
+        )
+        self.server.process()
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'services'))
+        self.assertRaises(SFTPNotFound, self.server.process)
+        self.assertEqual(stat(b'missing/services')['size'], 3)
+
+    def test_write_behind(self):
+        storage = self.server.storage
+        storage.write_window = 2
+
+        def open_services(flags):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_OPEN,
+                sftpstring(b'services'),
+                sftpint(flags),
+                sftpint(0)
+            )
+            self.server.process()
+            return get_sftphandle(self.server.output_queue)
+
+        def write(handle, off, data):
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_WRITE,
+                sftpstring(handle),
+                sftpint64(off),
+                sftpstring(data)
+            )
+            self.server.process()
+
+        handle = open_services(SSH2_FXF_CREAT | SSH2_FXF_WRITE)
+        for i in range(4):
+            write(handle, i * 3, b'foo')
+            self.assertLessEqual(len(list(storage.writes.values())[0]), 2)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(storage.writes, dict())
+        with open(remote_file('services'), 'rb') as f:
+            self.assertEqual(f.read(), b'foo' * 4)
+
+        # the remote server refuses to write a read-only file:
+        # the write is acknowledged, and the error is raised on close
+        handle = open_services(SSH2_FXF_READ)
+        write(handle, 0, b'bar')
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.assertRaises(SFTPException, self.server.process)
+        self.assertEqual(storage.writes, dict())
+
+        # or on a later write
+        handle = open_services(SSH2_FXF_READ)
+        write(handle, 0, b'bar')
+        writes = list(storage.writes.values())[0]
+        while not writes[0].done:
+            storage.client._read_response()
+        self.assertRaises(SFTPException, write, handle, 3, b'bar')
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        with open(remote_file('services'), 'rb') as f:
+            self.assertEqual(f.read(), b'foo' * 4)
+
     def test_symlink(self):
         self.server.input_queue = sftpcmd(
             SSH2_FXP_SYMLINK, sftpstring(b'bad/ugly'), sftpstring(b'bad/ugliest'), sftpint(0))
@@ -552,6 +839,464 @@ class TestProxyServer(unittest.TestCase):
             SSH2_FXP_RMDIR, sftpstring(b'bad/ugly'), sftpint(0))
         self.assertRaises(SFTPNotFound, self.server.process)
 
+    def test_channels(self):
+        storage = SFTPServerProxyStorage(
+            "test:secret@localhost",
+            port=2223,
+            channels=3,
+            connections=2
+        )
+        self.server = SFTPServer(
+            storage, logfile=t_path('log'), raise_on_error=True)
+        self.assertEqual(len(storage.transports), 2)
+        self.assertEqual(len(set(storage.client for i in range(3))), 3)
+
+        handles = list()
+        for i in range(3):
+            filename = 'file{}'.format(i).encode()
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_OPEN,
+                sftpstring(filename),
+                sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+                sftpint(0)
+            )
+            self.server.process()
+            handles.append(get_sftphandle(self.server.output_queue))
+        # each handle is pinned to its own channel
+        self.assertEqual(
+            len(set(h.sftp for h in self.server.handles.values())), 3)
+
+        self.server.fsync_group_commit = True
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(
+            sftpcmd(
+                SSH2_FXP_WRITE,
+                sftpstring(handle),
+                sftpint64(0),
+                sftpstring(handle)
+            ) + sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'fsync@openssh.com'),
+                sftpstring(handle),
+            ) + sftpcmd(
+                SSH2_FXP_CLOSE,
+                sftpstring(handle)
+            )
+            for handle in handles
+        )
+        self.server.process()
+        for i, handle in enumerate(handles):
+            with open(remote_file('file{}'.format(i)), 'rb') as f:
+                self.assertEqual(f.read(), handle)
+
+        for transport in storage.transports:
+            transport.close()
+
+    def test_stripes(self):
+        storage = SFTPServerProxyStorage(
+            "test:secret@localhost",
+            port=2223,
+            channels=3,
+            stripe_size=4096
+        )
+        self.server = SFTPServer(
+            storage, logfile=t_path('log'), raise_on_error=True)
+        data = os.urandom(5 * 4096 + 100)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'striped'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE | SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        stripes = storage.stripes[self.server.handles[handle]]
+        self.assertEqual(len(set(stripe.sftp for stripe in stripes)), 3)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(100),
+            sftpstring(data[100:])
+        ) + sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(data[:100])
+        ) + sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'fsync@openssh.com'),
+            sftpstring(handle),
+        )
+        self.server.process()
+        with open(remote_file('striped'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_READ,
+            sftpstring(handle),
+            sftpint64(10),
+            sftpint(len(data))
+        )
+        self.server.process()
+        self.assertEqual(get_sftpdata(self.server.output_queue), data[10:])
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(storage.stripes, dict())
+
+        # small read-only files are not striped
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'small'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'small'),
+            sftpint(SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.assertNotIn(self.server.handles[handle], storage.stripes)
+
+        for transport in storage.transports:
+            transport.close()
+
+    def test_security_options(self):
+        storage = SFTPServerProxyStorage(
+            "test:secret@localhost",
+            port=2223,
+            ciphers=['aes256-ctr'],
+            macs=['hmac-sha1'],
+            compression=True
+        )
+        transport = storage.transports[0]
+        self.assertEqual(transport.local_cipher, 'aes256-ctr')
+        self.assertEqual(transport.local_mac, 'hmac-sha1')
+        self.assertEqual(transport.local_compression, 'zlib@openssh.com')
+        self.assertEqual(
+            storage.stat(b'.')[b'size'], os.stat(REMOTE_ROOT).st_size)
+        transport.close()
+
+        results = list(benchmark(
+            ciphers=['aes128-ctr', 'aes128-gcm@openssh.com'],
+            macs=['hmac-sha2-256'], compressions=(True, ),
+            size=64 * 1024, compressible=True))
+        self.assertEqual(
+            [result[:3] for result in results],
+            [('aes128-ctr', 'hmac-sha2-256', True),
+             ('aes128-gcm@openssh.com', None, True)])
+        self.assertTrue(all(result[3] > 0 for result in results))
+
+    def test_spool(self):
+        spool_dir = t_path('spool')
+        os.mkdir(spool_dir)
+        storage = SFTPServerProxyStorage(
+            "test:secret@localhost",
+            port=2223,
+            spool_dir=spool_dir
+        )
+        self.server = SFTPServer(
+            storage, logfile=t_path('log'), raise_on_error=True)
+        # hold the uploads
+        uploading = threading.Event()
+        connect = storage.spool.connect
+        storage.spool.connect = lambda: uploading.wait() and connect()
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'spooled'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(b'staged contents')
+        ) + sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(
+            get_sftpmsgs(self.server.output_queue)[-1][0], SSH2_FXP_STATUS)
+        # created, but not uploaded yet
+        self.assertEqual(os.stat(remote_file('spooled')).st_size, 0)
+
+        # reads are served by the spool
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT,
+            sftpstring(b'spooled')
+        )
+        self.server.process()
+        stat = get_sftpstat(self.server.output_queue)
+        self.assertEqual(stat['size'], len(b'staged contents'))
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(0),
+            sftpint(1),
+            sftpstring(b'spooled')
+        )
+        self.server.process()
+        self.assertEqual(get_sftpstats(self.server.output_queue), [stat])
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'spooled'),
+            sftpint(SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_READ,
+            sftpstring(handle),
+            sftpint64(7),
+            sftpint(100)
+        )
+        self.server.process()
+        self.assertEqual(get_sftpdata(self.server.output_queue), b'contents')
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+
+        # the rename is queued after the upload
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_RENAME,
+            sftpstring(b'spooled'),
+            sftpstring(b'renamed')
+        )
+        self.server.process()
+        self.assertTrue(os.path.exists(remote_file('spooled')))
+
+        uploading.set()
+        self.assertEqual(storage.drain(), [])
+        self.assertFalse(os.path.exists(remote_file('spooled')))
+        with open(remote_file('renamed'), 'rb') as f:
+            self.assertEqual(f.read(), b'staged contents')
+        self.assertEqual(os.listdir(spool_dir), [])
+
+        os.rmdir(spool_dir)
+        for transport in storage.transports:
+            transport.close()
+
+    def test_broker(self):
+        path = t_path('broker.sock')
+        broker = SFTPBroker(
+            SSHConnector("test:secret@localhost", port=2223).connect, path)
+        broker.listen()
+        thread = threading.Thread(target=broker.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        # two sessions share the single broker transport
+        storages = [
+            SFTPServerProxyStorage("ignored", broker=path, channels=2)
+            for i in range(2)
+        ]
+        self.assertEqual(len(broker.transports), 1)
+        self.assertEqual(storages[0].transports, [])
+
+        self.server = SFTPServer(
+            storages[0], logfile=t_path('log'), raise_on_error=True)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(b'brokered')
+        ) + sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+
+        self.server = SFTPServer(
+            storages[1], logfile=t_path('log'), raise_on_error=True)
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT,
+            sftpstring(b'services')
+        )
+        self.server.process()
+        stat = get_sftpstat(self.server.output_queue)
+        self.assertEqual(stat['size'], len(b'brokered'))
+
+        for storage in storages:
+            for client in storage.clients:
+                client.close()
+        broker.close()
+        os.unlink(path)
+
+    def test_reconnect(self):
+        storage = SFTPServerProxyStorage(
+            "test:secret@localhost",
+            port=2223,
+            lazy=True
+        )
+        self.assertEqual(storage.transports, [])
+        self.server = SFTPServer(
+            storage, logfile=t_path('log'), raise_on_error=True)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_READ | SSH2_FXF_WRITE),
+            sftpint(0)
+        )
+        self.server.process()
+        self.assertEqual(len(storage.transports), 1)
+        handle = get_sftphandle(self.server.output_queue)
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpstring(b'first ')
+        )
+        self.server.process()
+
+        # the connection drops: the file is reopened, without truncating it
+        lost = storage.transports[0]
+        lost.close()
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE,
+            sftpstring(handle),
+            sftpint64(6),
+            sftpstring(b'second')
+        )
+        self.server.process()
+        self.assertNotEqual(storage.transports[0], lost)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_READ,
+            sftpstring(handle),
+            sftpint64(0),
+            sftpint(100)
+        )
+        self.server.process()
+        self.assertEqual(
+            get_sftpdata(self.server.output_queue), b'first second')
+
+        storage.transports[0].close()
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT,
+            sftpstring(b'services')
+        )
+        self.server.process()
+        stat = get_sftpstat(self.server.output_queue)
+        self.assertEqual(stat['size'], len(b'first second'))
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(storage.opened, dict())
+        with open(remote_file('services'), 'rb') as f:
+            self.assertEqual(f.read(), b'first second')
+
+        storage.transports[0].close()
+
+    def test_reconnect_not_idempotent(self):
+        storage = self.server.storage
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'foo')
+        reconnects = list()
+        reconnect = storage.reconnect
+
+        def counted():
+            reconnected = reconnect()
+            reconnects.append(reconnected)
+            return reconnected
+        storage.reconnect = counted
+
+        # the errors of the remote server are just reported
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'missing'))
+        self.assertRaises(SFTPNotFound, self.server.process)
+        self.assertNotIn(True, reconnects)
+        del reconnects[:]
+
+        # the connection drops once the rename has been applied:
+        # it is not sent again, which would fail
+        client = storage.clients[0]
+        rename = client.rename
+
+        def dropping(oldpath, newpath):
+            rename(oldpath, newpath)
+            storage.transports[0].close()
+            raise EOFError()
+        client.rename = dropping
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_RENAME, sftpstring(b'services'), sftpstring(b'renamed'))
+        with self.assertRaises(SFTPException) as raised:
+            self.server.process()
+        self.assertNotIsInstance(raised.exception, SFTPNotFound)
+        self.assertEqual(reconnects, [False, True])
+        self.assertEqual(os.listdir(REMOTE_ROOT), ['renamed'])
+
+        # the next requests go on the new connection
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_REMOVE, sftpstring(b'renamed'))
+        self.server.process()
+        self.assertEqual(os.listdir(REMOTE_ROOT), [])
+        for transport in storage.transports:
+            transport.close()
+
+    def test_failover(self):
+        storage = SFTPServerProxyStorage(
+            "test:secret@127.0.0.2",
+            port=2223,
+            replicas=["localhost"],
+            keepalive=30
+        )
+        self.assertEqual(storage.connector.current, 1)
+        self.assertEqual(storage.home, '/')
+        storage.transports[0].close()
+
+        self.assertRaises(
+            SFTPConnectionError,
+            SSHConnector("test:wrong@localhost", port=2223).connect
+        )
+
     def test_copy_services(self):
         self.server.input_queue = sftpcmd(
             SSH2_FXP_OPEN,
@@ -627,6 +1372,329 @@ class TestProxyServer(unittest.TestCase):
 
         os.unlink(r_services)
 
+    def test_posix_rename(self):
+        with open(remote_file('services'), 'w') as f:
+            f.write('new')
+        with open(remote_file('other_services'), 'w') as f:
+            f.write('old')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'posix-rename@openssh.com'),
+            sftpstring(b'services'),
+            sftpstring(b'other_services'),
+        )
+        self.server.process()
+        self.assertNotIn('services', os.listdir(REMOTE_ROOT))
+        with open(remote_file('other_services')) as f:
+            self.assertEqual(f.read(), 'new')
+
+    def test_hardlink(self):
+        with open(remote_file('services'), 'w') as f:
+            f.write('foo')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'hardlink@openssh.com'),
+            sftpstring(b'services'),
+            sftpstring(b'other_services'),
+        )
+        self.server.process()
+        self.assertEqual(
+            os.lstat(remote_file('services')).st_ino,
+            os.lstat(remote_file('other_services')).st_ino
+        )
+
+    def test_fsync_group_commit(self):
+        self.server.fsync_group_commit = True
+        handles = list()
+        for filename in (b'services', b'other_services'):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_OPEN,
+                sftpstring(filename),
+                sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE),
+                sftpint(0)
+            )
+            self.server.process()
+            handles.append(get_sftphandle(self.server.output_queue))
+
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(
+            sftpcmd(
+                SSH2_FXP_WRITE,
+                sftpstring(handle),
+                sftpint64(0),
+                sftpstring(b'foo')
+            ) + sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'fsync@openssh.com'),
+                sftpstring(handle),
+            )
+            for handle in handles
+        )
+        self.server.process()
+        self.assertEqual(len(self.server.output_queue), 4 * 13)
+        with open(remote_file('services')) as f:
+            self.assertEqual(f.read(), 'foo')
+
+        for handle in handles:
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_CLOSE,
+                sftpstring(handle)
+            )
+            self.server.process()
+
+    def test_stat_many(self):
+        with open(remote_file('services'), 'w') as f:
+            f.write('foo')
+        os.symlink('services', remote_file('link'))
+        paths = [b'services', b'link', b'missing'] * 50
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'stat-many@unbit.com'),
+            sftpint(STAT_MANY_LSTAT),
+            sftpint(len(paths)),
+            *[sftpstring(path) for path in paths]
+        )
+        self.server.process()
+        stats = get_sftpstats(self.server.output_queue)
+        self.assertEqual(len(stats), len(paths))
+        self.assertEqual(stats[0]['size'], 3)
+        self.assertTrue(stat.S_ISLNK(stats[1]['mode']))
+        self.assertEqual(stats[2], SSH2_FX_NO_SUCH_FILE)
+        self.assertEqual(stats[-3], stats[0])
+
+    def test_stat_many_cached(self):
+        storage = self.server.storage
+        storage.cache = SFTPAttributesCache()
+        with open(remote_file('services'), 'w') as f:
+            f.write('foo')
+        os.symlink('nowhere', remote_file('broken'))
+
+        def stat_many(*paths):
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_EXTENDED,
+                sftpstring(b'stat-many@unbit.com'),
+                sftpint(0),
+                sftpint(len(paths)),
+                *[sftpstring(path) for path in paths]
+            )
+            self.server.process()
+            return get_sftpstats(self.server.output_queue)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'services'))
+        self.server.process()
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_STAT, sftpstring(b'missing'))
+        self.assertRaises(SFTPNotFound, self.server.process)
+        with open(remote_file('services'), 'w') as f:
+            f.write('foobar')  # not seen through the cache, as by stat
+        with open(remote_file('missing'), 'w') as f:
+            f.write('foo')
+
+        stats = stat_many(b'services', b'missing', b'broken')
+        self.assertEqual(stats[0]['size'], 3)
+        self.assertEqual(stats[1], SSH2_FX_NO_SUCH_FILE)
+        self.assertTrue(stat.S_ISLNK(stats[2]['mode']))  # lstat'ed
+        self.assertEqual(storage.cache.attrs.hits, 1)
+        self.assertEqual(storage.cache.missing.hits, 1)
+        # the misses are cached too
+        self.assertEqual(stat_many(b'broken'), stats[2:])
+        self.assertEqual(storage.cache.attrs.hits, 2)
+
+    def test_get_files(self):
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'foo' * 1000)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'get-files@unbit.com'),
+            sftpint(2),
+            sftpstring(b'services'),
+            sftpstring(b'missing'),
+        )
+        self.server.process()
+        files = get_sftpfiles(self.server.output_queue)
+        self.assertEqual(files[0][1], b'foo' * 1000)
+        self.assertEqual(files[0][0]['size'], 3000)
+        self.assertEqual(files[1], SSH2_FX_NO_SUCH_FILE)
+
+    def test_put_file(self):
+        with open(remote_file('services'), 'wb') as f:
+            f.write(b'old')
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'put-file@unbit.com'),
+            sftpstring(b'services'),
+            sftpint(0),
+            sftpstring(b'new'),
+        )
+        self.server.process()
+        self.assertEqual(os.listdir(REMOTE_ROOT), ['services'])
+        with open(remote_file('services'), 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+
+    def test_tar_open(self):
+        os.mkdir(remote_file('foo'))
+        with open(remote_file('foo/services'), 'wb') as f:
+            f.write(b'foo' * 1000)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'tar-open@unbit.com'),
+            sftpstring(b'foo'),
+            sftpint(TAR_OPEN_GZIP),
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+
+        data = b''
+        while True:
+            self.server.output_queue = b''
+            self.server.input_queue = sftpcmd(
+                SSH2_FXP_READ,
+                sftpstring(handle),
+                sftpint64(len(data)),
+                sftpint(32768)
+            )
+            try:
+                self.server.process()
+            except SFTPException:
+                break  # EOF
+            data += get_sftpdata(self.server.output_queue)
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        self.assertEqual(self.server.storage.listed, {})
+
+        tar = tarfile.open(fileobj=io.BytesIO(data), mode='r:gz')
+        self.assertEqual(tar.getnames(), ['services'])
+        self.assertEqual(tar.extractfile('services').read(), b'foo' * 1000)
+
+    def test_rmtree(self):
+        os.makedirs(remote_file('foo/bar'))
+        with open(remote_file('foo/bar/services'), 'wb') as f:
+            f.write(b'foo' * 1000)
+        os.symlink('bar', remote_file('foo/link'))
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'du@unbit.com'),
+            sftpstring(b'foo'),
+        )
+        self.server.process()
+        self.assertEqual(
+            get_sftpusage(self.server.output_queue), (3003, 2, 2))
+        self.assertEqual(self.server.storage.listed, {})
+
+        self.server.output_queue = b''
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'rmtree@unbit.com'),
+            sftpstring(b'foo'),
+        )
+        self.server.process()
+        self.assertEqual(get_sftprmtree(self.server.output_queue), (4, 0, []))
+        self.assertEqual(os.listdir(REMOTE_ROOT), [])
+        self.assertEqual(self.server.storage.listed, {})
+
+    def test_makedirs(self):
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_EXTENDED,
+            sftpstring(b'makedirs@unbit.com'),
+            sftpstring(b'foo/bar'),
+            sftpint(0),
+        )
+        self.server.process()
+        self.assertTrue(os.path.isdir(remote_file('foo/bar')))
+
+    def test_pipelined(self):
+        self.server.raise_on_error = False
+        self.server.max_deferred = 2
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN,
+            sftpstring(b'services'),
+            sftpint(SSH2_FXF_CREAT | SSH2_FXF_WRITE | SSH2_FXF_READ),
+            sftpint(0)
+        )
+        self.server.process()
+        handle = get_sftphandle(self.server.output_queue)
+
+        chunks = [os.urandom(32768) for i in range(4)]
+        writes = [
+            sftpcmd(
+                SSH2_FXP_WRITE,
+                sftpstring(handle),
+                sftpint64(i * 32768),
+                sftpstring(chunk)
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(writes)
+        self.server.process()
+        self.assertEqual(
+            get_sftpmsgs(self.server.output_queue),
+            [(SSH2_FXP_STATUS, get_sftpid(cmd), sftpint(SSH2_FX_OK))
+             for cmd in writes]
+        )
+
+        reads = [
+            sftpcmd(
+                SSH2_FXP_READ,
+                sftpstring(handle),
+                sftpint64(i * 32768),
+                sftpint(32768)
+            )
+            for i in range(5)
+        ]
+        self.server.output_queue = b''
+        self.server.input_queue = b''.join(reads)
+        self.server.process()
+        self.assertEqual(
+            get_sftpmsgs(self.server.output_queue),
+            [(SSH2_FXP_DATA, get_sftpid(cmd), sftpstring(chunk))
+             for cmd, chunk in zip(reads, chunks)] +
+            [(SSH2_FXP_STATUS, get_sftpid(reads[-1]), sftpint(SSH2_FX_EOF))]
+        )
+
+        # replies are sent once the input is over
+        self.server.fd_in, fd_in = os.pipe()
+        fd_out, self.server.fd_out = os.pipe()
+        try:
+            os.write(fd_in, b''.join(reads[:2]))
+            self.server.output_queue = b''
+            self.server.run_once()
+            self.assertEqual(len(self.server.deferred), 2)
+            self.server.run_once()
+            self.assertEqual(len(self.server.deferred), 0)
+            self.assertEqual(
+                get_sftpmsgs(self.server.output_queue),
+                [(SSH2_FXP_DATA, get_sftpid(cmd), sftpstring(chunk))
+                 for cmd, chunk in zip(reads, chunks[:2])]
+            )
+        finally:
+            for fd in (fd_in, self.server.fd_in, self.server.fd_out, fd_out):
+                os.close(fd)
+
+        self.server.input_queue = sftpcmd(
+            SSH2_FXP_CLOSE,
+            sftpstring(handle)
+        )
+        self.server.process()
+        with open(remote_file('services'), 'rb') as f:
+            self.assertEqual(f.read(), b''.join(chunks))
+        os.unlink(remote_file('services'))
+
     def tearDown(self):
         """Clean any leftover."""
         for f in os.listdir(LOCAL_ROOT):
@@ -0,0 +1,131 @@
+import json
+import os
+import struct
+import time
+import unittest
+from shutil import rmtree
+
+from pysftpserver.deferred import SFTPDeferred
+from pysftpserver.server import (SSH2_FILEXFER_VERSION, SSH2_FXF_CREAT,
+                                 SSH2_FXF_READ, SSH2_FXF_WRITE,
+                                 SSH2_FXP_CLOSE, SSH2_FXP_INIT,
+                                 SSH2_FXP_OPEN, SSH2_FXP_READ,
+                                 SSH2_FXP_STAT, SSH2_FXP_WRITE, SFTPServer)
+from pysftpserver.slowlog import SFTPSlowLog
+from pysftpserver.tests.utils import (get_sftphandle, sftpcmd, sftpint,
+                                      sftpint64, sftpstring, t_path)
+from pysftpserver.virtualchroot import SFTPServerVirtualChroot
+
+
+class SlowStorage(SFTPServerVirtualChroot):
+    """Reads completing later, after delay seconds."""
+
+    delay = 0.05
+
+    def read(self, handle, off, size):
+        def pump():
+            time.sleep(self.delay)
+            deferred.set_result(
+                SFTPServerVirtualChroot.read(self, handle, off, size))
+        deferred = SFTPDeferred(pump)
+        return deferred
+
+
+class SlowLogTest(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(t_path())
+        self.home = 'home'
+        self.path = t_path('slow.log')
+        if not os.path.isdir(self.home):
+            os.mkdir(self.home)
+
+    def tearDown(self):
+        os.chdir(t_path())
+        rmtree(self.home)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def create_server(self, storage=SFTPServerVirtualChroot, **kwargs):
+        self.slowlog = SFTPSlowLog(self.path, **kwargs)
+        server = SFTPServer(storage(t_path(self.home)), slowlog=self.slowlog)
+        server.input_queue = struct.pack(
+            '>IBI', 5, SSH2_FXP_INIT, SSH2_FILEXFER_VERSION)
+        server.process()
+        server.output_queue = b''
+        return server
+
+    def logged(self):
+        self.slowlog.close()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def open(self, server, flags):
+        server.input_queue = sftpcmd(
+            SSH2_FXP_OPEN, sftpstring(b'foo'), sftpint(flags), sftpint(0))
+        server.process()
+        handle = get_sftphandle(server.output_queue)
+        server.output_queue = b''
+        return handle
+
+    def test_fields(self):
+        server = self.create_server(threshold=0)
+        handle = self.open(server, SSH2_FXF_CREAT | SSH2_FXF_WRITE)
+        server.input_queue = sftpcmd(
+            SSH2_FXP_WRITE, sftpstring(handle), sftpint64(4096),
+            sftpstring(b'x' * 100))
+        server.input_queue += sftpcmd(SSH2_FXP_CLOSE, sftpstring(handle))
+        server.process()
+
+        opened, written, closed = self.logged()
+        self.assertEqual(opened['request'], 'OPEN')
+        self.assertEqual(opened['path'], 'foo')
+        self.assertEqual(written['request'], 'WRITE')
+        self.assertEqual(written['path'], 'foo')
+        self.assertEqual(written['handle'], handle.decode())
+        self.assertEqual((written['offset'], written['size']), (4096, 100))
+        # the close was queued after the write
+        self.assertGreater(written['input_queue_bytes'], 0)
+        self.assertEqual(closed['path'], written['path'])
+        for line in (opened, written, closed):
+            self.assertIsInstance(line['id'], int)
+            self.assertAlmostEqual(
+                line['total_ms'], line['storage_ms'] + line['protocol_ms'],
+                places=2)
+
+    def test_threshold(self):
+        server = self.create_server(threshold=10)
+        server.input_queue = sftpcmd(SSH2_FXP_STAT, sftpstring(b'.'))
+        server.process()
+        self.assertEqual(self.logged(), [])
+
+    def test_rate(self):
+        server = self.create_server(threshold=0, rate=2)
+        server.input_queue = b''.join(
+            sftpcmd(SSH2_FXP_STAT, sftpstring(b'.')) for i in range(10))
+        server.process()
+        server.slowlog.last_refill -= 1  # a second passes
+        server.input_queue = sftpcmd(SSH2_FXP_STAT, sftpstring(b'.'))
+        server.process()
+        logged = self.logged()
+        self.assertEqual(len(logged), 3)
+        self.assertEqual(logged[-1]['suppressed'], 8)
+
+    def test_deferred(self):
+        with open(t_path(os.path.join(self.home, 'foo')), 'wb') as f:
+            f.write(b'data')
+        server = self.create_server(SlowStorage, threshold=SlowStorage.delay)
+        handle = self.open(server, SSH2_FXF_READ)
+        server.input_queue = sftpcmd(
+            SSH2_FXP_READ, sftpstring(handle), sftpint64(0), sftpint(4))
+        server.process()
+
+        read, = self.logged()
+        self.assertEqual(read['request'], 'READ')
+        self.assertTrue(read['deferred'])
+        self.assertEqual((read['offset'], read['size']), (0, 4))
+        self.assertGreaterEqual(read['storage_ms'], SlowStorage.delay * 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -41,6 +41,11 @@ def get_sftpint(blob):
     return int(value)
 
 
+def get_sftpstatus(blob):
+    value, = struct.unpack('>I', blob[9:13])
+    return int(value)
+
+
 def get_sftpname(blob):
     namelen, = struct.unpack('>I', blob[13:17])
     return blob[17:17 + namelen]
@@ -56,3 +61,93 @@ def get_sftpstat(blob):
 def get_sftpdata(blob):
     datalen, = struct.unpack('>I', blob[9:13])
     return blob[13: 13 + datalen]
+
+
+def parse_sftpattrs(blob):
+    """Parse the attributes at the beginning of blob.
+
+    Return them and the rest of the blob.
+    """
+    attrs = dict()
+    (flags, attrs['size'], attrs['uid'], attrs['gid'], attrs['mode'],
+     attrs['atime'], attrs['mtime']) = struct.unpack('>IQIIIII', blob[:32])
+    return attrs, blob[32:]
+
+
+def parse_sftpstring(blob):
+    slen, = struct.unpack('>I', blob[0:4])
+    return blob[4:4 + slen], blob[4 + slen:]
+
+
+def get_sftpstats(blob):
+    """Parse the reply of the stat-many@unbit.com extension."""
+    count, = struct.unpack('>I', blob[9:13])
+    blob = blob[13:]
+    stats = list()
+    for i in range(count):
+        status, = struct.unpack('>I', blob[0:4])
+        blob = blob[4:]
+        if status:
+            stats.append(status)
+            continue
+        attrs, blob = parse_sftpattrs(blob)
+        stats.append(attrs)
+    return stats
+
+
+def get_sftpfile(blob):
+    """Parse the reply of the get-file@unbit.com extension."""
+    attrs, blob = parse_sftpattrs(blob[9:])
+    data, blob = parse_sftpstring(blob)
+    return attrs, data
+
+
+def get_sftpfiles(blob):
+    """Parse the reply of the get-files@unbit.com extension."""
+    count, = struct.unpack('>I', blob[9:13])
+    blob = blob[13:]
+    files = list()
+    for i in range(count):
+        status, = struct.unpack('>I', blob[0:4])
+        blob = blob[4:]
+        if status:
+            files.append(status)
+            continue
+        attrs, blob = parse_sftpattrs(blob)
+        data, blob = parse_sftpstring(blob)
+        files.append((attrs, data))
+    return files
+
+
+def get_sftprmtree(blob):
+    """Parse the reply of the rmtree@unbit.com extension."""
+    removed, failed, count = struct.unpack('>QII', blob[9:25])
+    blob = blob[25:]
+    failures = list()
+    for i in range(count):
+        path, blob = parse_sftpstring(blob)
+        status, = struct.unpack('>I', blob[0:4])
+        blob = blob[4:]
+        failures.append((path, status))
+    return removed, failed, failures
+
+
+def get_sftpusage(blob):
+    """Parse the reply of the du@unbit.com extension."""
+    return struct.unpack('>QQQ', blob[9:33])
+
+
+def get_sftpmsgs(blob):
+    """Split blob into its messages, (type, id, payload) tuples."""
+    msgs = list()
+    while blob:
+        msg_len, msg_type, msg_id = struct.unpack('>IBI', blob[0:9])
+        msgs.append((msg_type, msg_id, blob[9:4 + msg_len]))
+        blob = blob[4 + msg_len:]
+    return msgs
+
+
+def get_sftpid(cmd):
+    """Return the id of the command built by sftpcmd."""
+    msg_id, = struct.unpack('>I', cmd[5:9])
+    return msg_id
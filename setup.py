@@ -20,7 +20,8 @@ setup(
     license='MIT',
 
     packages=['pysftpserver'],
-    scripts=['bin/pysftpjail', 'bin/pysftpproxy'],
+    scripts=['bin/pysftpjail', 'bin/pysftpproxy', 'bin/pysftpbroker',
+             'bin/pysftpbench', 'bin/pysftpreplay'],
     test_suite='nose.collector',
     tests_require=['nose', 'paramiko'],
 